@@ -1,31 +1,238 @@
 #!/usr/bin/env python
 
-from database import PooledMDB as Database
+import shutil
+import signal
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Queries, from_url
 
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
 import tornado.options
+import tornado.process
 import tornado.web
 
+from tornado.log import access_log
 from tornado.options import define, options
 
 define("port", default=5000, help="port to bind to", type=int)
+define("processes", default=1, type=int,
+    help="number of worker processes to fork, 0 for one per CPU core")
+define("reuse_port", default=False, type=bool,
+    help="bind a socket per worker process (SO_REUSEPORT) "
+         "instead of sharing one socket among all of them")
+define("db_connections", default=0, type=int,
+    help="maximum number of database connections of all worker processes "
+         "together (e.g. below MariaDB's max_connections), 0 for no limit")
+define("shutdown_timeout", default=30.0, type=float,
+    help="seconds to wait for requests in progress when stopping")
 
-from config import settings, dbconf, bsconf
+from config import settings, dburl, bsconf, cacheconf
 from routes import routes
+from blobstore import Blobstore
+from broadcast import Broadcast
+from cache import StateCache, TTLCache
+from metrics import Metrics
+from policy import Stats
+from prefork import Master
+from storage import Storage
 
+import compression
 import models
+import profiling
 
 class Application(tornado.web.Application):
-    def __init__(self, dbconf, bsconf, handlers=None, **settings):
+    def __init__(self, dburl, bsconf, cacheconf, handlers=None,
+                 channel=None, **settings):
         super(Application, self).__init__(handlers, **settings)
-        self.blobstore = None # Blobstore(bsconf.nodes, **bsconf.opts)
-        self.database = Database(stale_timeout=599, **dbconf)
+        self.blobstore = (bsconf["nodes"] and
+            Blobstore(bsconf["nodes"], **bsconf["opts"]) or None)
+        # API handlers run queries in the worker threads, web handlers on
+        # the IOLoop thread, each thread using a connection of its own
+        self.executor = ThreadPoolExecutor(self.settings["worker_threads"])
+        self.database = from_url(dburl, pooled=True, stale_timeout=599,
+            max_connections=self.settings["worker_threads"] + 1)
+        self.engine = Storage(self.database)
+        self.statecache = StateCache(**cacheconf)
+        self.tokencache = TTLCache(self.settings["token_cache_ttl"])
+        self.repocache = TTLCache(self.settings["repo_cache_ttl"])
+        self.stats = Stats()
+        self.metrics = Metrics()
+        self.active = 0 # number of requests in progress
+        # Route names (see `routes`) by handler class, labelling metrics
+        self.routenames = dict((spec.handler_class, spec.name)
+            for spec in handlers or ()
+            if isinstance(spec, tornado.web.URLSpec) and spec.name)
+        # Invalidations of cached entries, sent to all worker processes
+        self.broadcast = Broadcast(channel)
+        self.broadcast.subscribe(self.invalidate)
 
-if __name__ == "__main__":
-    tornado.options.parse_command_line()
-    app = Application(dbconf, bsconf, routes, **settings)
+    def invalidate(self, message):
+        # Messages name the kind and key of the entries to drop, i.e.
+        # "token VALUE" for a deleted token, "user ID" for a renamed user
+        # (and the names of their repositories)
+        kind, key = message.split(" ", 1)
+        if kind == "token":
+            self.tokencache.invalidate(key)
+        elif kind == "user":
+            self.tokencache.invalidate_owner(int(key))
+            self.repocache.invalidate_owner(int(key))
+
+    def log_request(self, handler):
+        # Access log entries with the number of database statements of the
+        # request and the time spent on them (see `RequestHandler.queries`)
+        status = handler.get_status()
+        if status < 400:
+            log_method = access_log.info
+        elif status < 500:
+            log_method = access_log.warning
+        else:
+            log_method = access_log.error
+        queries = getattr(handler, "queries", None) or Queries()
+        seconds = handler.request.request_time()
+        log_method("%d %s %.2fms (%d queries, %.2fms)", status,
+            handler._request_summary(), 1000.0 * seconds,
+            queries.count, 1000.0 * queries.time)
+        cls = type(handler)
+        route = self.routenames.get(cls, cls.__name__)
+        branch = (getattr(handler, "branch", None) or
+            handler.request.method.lower())
+        self.metrics.request(route, branch, status, seconds, queries)
+        # Slow or profiled requests are reported in detail
+        profile = getattr(handler, "profile", None)
+        if profile is not None:
+            profiling.finish(self.settings, profile,
+                handler._request_summary(), seconds, queries,
+                route.replace(":", "-") + "-" + branch)
+
+    def collect(self):
+        # The state of the process reported along with the metrics: usage of
+        # the connection pool, requests in progress and cache statistics
+        pool = self.database
+        sc = self.statecache.stats()
+        ttl = [("token", self.tokencache.stats()),
+               ("repo", self.repocache.stats())]
+        return [
+            ("tailr_db_connections", "gauge",
+                "Pooled database connections by state.",
+                [(dict(state="in_use"), len(pool._in_use)),
+                 (dict(state="idle"), len(pool._connections))]),
+            ("tailr_db_connections_max", "gauge",
+                "Maximum number of pooled database connections.",
+                [({}, pool.max_connections or 0)]),
+            ("tailr_requests_in_progress", "gauge",
+                "Requests being served.", [({}, self.active)]),
+            ("tailr_state_cache_bytes", "gauge",
+                "Estimated size of the cached resource states.",
+                [({}, sc["size"])]),
+            ("tailr_state_cache_entries", "gauge",
+                "Cached resource states.", [({}, sc["entries"])]),
+            ("tailr_state_cache_lookups_total", "counter",
+                "Lookups in the resource state cache by result.",
+                [(dict(result="hit"), sc["hits"]),
+                 (dict(result="miss"), sc["misses"])]),
+            ("tailr_state_cache_evictions_total", "counter",
+                "Resource states evicted from the cache.",
+                [({}, sc["evictions"])]),
+            ("tailr_cache_entries", "gauge",
+                "Cached API tokens and repositories.",
+                [(dict(cache=name), st["entries"]) for name, st in ttl]),
+            ("tailr_cache_lookups_total", "counter",
+                "Lookups of API tokens and repositories by result.",
+                [(dict(cache=name, result="hit"), st["hits"])
+                    for name, st in ttl] +
+                [(dict(cache=name, result="miss"), st["misses"])
+                    for name, st in ttl]),
+            ("tailr_cache_queries_total", "counter",
+                "Database lookups of API tokens and repositories on misses.",
+                [(dict(cache=name), st["queries"]) for name, st in ttl]),
+            ("tailr_cache_query_seconds_total", "counter",
+                "Time spent on database lookups of API tokens and "
+                "repositories.",
+                [(dict(cache=name), st["qtime"]) for name, st in ttl]),
+        ]
+
+    def close(self):
+        self.broadcast.close()
+        self.executor.shutdown()
+        self.database.close_all()
+        if self.blobstore:
+            self.blobstore.close()
+
+def serve(sockets, settings, channel=None):
+    # Run the application in the current process until it receives SIGTERM
+    # or SIGINT, then stop accepting connections and wait for the requests
+    # in progress to finish (up to `shutdown_timeout` seconds). Messages to
+    # all worker processes go through the directory `channel` (if any).
+
+    app = Application(dburl, bsconf, cacheconf, routes, channel, **settings)
     models.initialize(app.database, app.blobstore)
+
     server = tornado.httpserver.HTTPServer(app)
-    server.listen(tornado.options.options.port)
-    tornado.ioloop.IOLoop.instance().start()
+    server.add_sockets(sockets or tornado.netutil.bind_sockets(
+        options.port, reuse_port=True))
+
+    ioloop = tornado.ioloop.IOLoop.current()
+    deadline = []
+
+    def drain():
+        if not deadline:
+            server.stop()
+            deadline.append(time.time() + options.shutdown_timeout)
+
+        if app.active == 0 or time.time() > deadline[0]:
+            ioloop.stop()
+        else:
+            ioloop.add_timeout(time.time() + 0.1, drain)
+
+    def stop(sig, frame):
+        ioloop.add_callback_from_signal(drain)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    ioloop.start()
+    app.close()
+
+if __name__ == "__main__":
+    tornado.options.parse_command_line()
+
+    processes = options.processes or tornado.process.cpu_count()
+
+    if options.db_connections:
+        # Size the worker threads (each with a connection of its own) of
+        # every process, keeping one connection for the IOLoop thread
+        connections = options.db_connections // processes
+
+        if connections < 2:
+            raise SystemExit("db_connections: need at least 2 per process")
+
+        settings["worker_threads"] = min(settings["worker_threads"],
+            connections - 1)
+
+    try:
+        compression.load(settings["compression"])
+    except ValueError as e:
+        raise SystemExit("COMPRESSION: %s" % e)
+
+    if processes > 1 and settings["debug"]:
+        raise SystemExit("processes: not available in debug mode")
+
+    if options.reuse_port and processes > 1:
+        sockets = None # bound by each worker
+    else:
+        sockets = tornado.netutil.bind_sockets(options.port)
+
+    if processes == 1:
+        serve(sockets, settings)
+    else:
+        channel = tempfile.mkdtemp(prefix="tailr-")
+        run = lambda: serve(sockets, settings, channel)
+        try:
+            Master(processes, run).serve()
+        finally:
+            shutil.rmtree(channel, ignore_errors=True)
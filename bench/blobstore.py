@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Compare writing and reading blobs in the blob store against the `blob`
+# table in the database. Uses scratch tables and temporary directories (on
+# the BLOBSTORE_PATH disks, if set), nothing else is touched. Run from the
+# project root:
+#
+# python bench/blobstore.py --count 10000 --size 4096
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import Model, PrimaryKeyField
+
+from blobstore import Blobstore
+from database import from_url
+from database import MSQLBinaryField, MSQLMediumBlobField
+
+from config import dburl, bsconf
+
+class BenchBlob(Model):
+    id = PrimaryKeyField()
+    data = MSQLMediumBlobField()
+
+class BenchRef(Model):
+    id = PrimaryKeyField()
+    sha = MSQLBinaryField(length=20)
+
+def blobs(count, size, seed):
+    """Generate compressed, RDF-like blobs of roughly `size` bytes."""
+    rnd = random.Random(seed)
+    for i in xrange(count):
+        lines = []
+        while sum(map(len, lines)) < size * 4:
+            lines.append('<http://example.org/r%d> <http://example.org/p%d> '
+                '"%d" .' % (i, rnd.randrange(100), rnd.randrange(10**9)))
+        yield zlib.compress('\n'.join(lines))
+
+def rate(n, seconds):
+    return '%10.1f/s %8.3f ms' % (n / seconds, seconds / n * 1000.0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--size', type=int, default=4096,
+        help='approx. size of each (compressed) blob in bytes')
+    parser.add_argument('--reads', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = list(blobs(args.count, args.size, args.seed))
+    rnd = random.Random(args.seed)
+    ids = [rnd.randrange(args.count) + 1 for _ in xrange(args.reads)]
+
+    database = from_url(dburl)
+    BenchBlob._meta.database = database
+    BenchRef._meta.database = database
+    database.create_tables([BenchBlob, BenchRef], safe=True)
+
+    # Temporary directories on the configured blob store disks, if any
+    nodes = [tempfile.mkdtemp(dir=n) for n in bsconf['nodes'] or [None]]
+
+    store = Blobstore(nodes, **bsconf['opts'])
+
+    try:
+        print '%d blobs, %d bytes total' % (len(data), sum(map(len, data)))
+        print
+
+        # Blob data in the database
+        t = time.time()
+        with database.atomic():
+            for d in data:
+                BenchBlob.create(data=d)
+        print 'db write:        ' + rate(len(data), time.time() - t)
+
+        t = time.time()
+        for i in ids:
+            BenchBlob.select(BenchBlob.data).where(BenchBlob.id == i).scalar()
+        print 'db read:         ' + rate(len(ids), time.time() - t)
+
+        # Blob data in the blob store, digests in the database
+        t = time.time()
+        with database.atomic():
+            for d in data:
+                BenchRef.create(sha=store.put(d))
+        print 'blobstore write: ' + rate(len(data), time.time() - t)
+
+        store.close()
+        store = Blobstore(nodes, **bsconf['opts']) # cold index and maps
+
+        t = time.time()
+        for i in ids:
+            sha = BenchRef.select(BenchRef.sha).where(BenchRef.id == i).scalar()
+            store.get(str(sha))
+        print 'blobstore read:  ' + rate(len(ids), time.time() - t)
+
+        t = time.time()
+        shas = [str(r.sha) for r in BenchRef.select(BenchRef.sha)]
+        for i in ids:
+            store.get(shas[i - 1])
+        print 'store only read: ' + rate(len(ids), time.time() - t)
+    finally:
+        store.close()
+        database.drop_tables([BenchBlob, BenchRef])
+        for node in nodes:
+            shutil.rmtree(node)
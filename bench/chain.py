@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Compare the queries fetching the delta chain of a historic revision: the
+# former ones, locating the start of the chain with correlated subqueries
+# (COALESCE over the last non-delta), and the current one, joining on the
+# `base` column of the changesets (a range scan on the index on repo, hkey,
+# base and time). Prints the query plans (EXPLAIN) of both and their mean
+# run times for a sample of keys and times of a repository.
+#
+# Run from the project root against a migrated database (see `python
+# migrate.py cset-base`), e.g.:
+# python bench/chain.py pmeinhardt/test --samples 1000
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import from_url
+
+from config import dburl
+from models import User, Repo, CSet
+
+import models
+
+LAST = ('(SELECT time FROM cset '
+    'WHERE repo_id = %s AND hkey_id = %s AND time <= %s '
+    'ORDER BY time DESC LIMIT 1)')
+
+OLD = {
+    Repo.FORWARD: ('SELECT time, type FROM cset '
+        'WHERE repo_id = %s AND hkey_id = %s AND time <= %s '
+        'AND time >= COALESCE((SELECT time FROM cset '
+        'WHERE repo_id = %s AND hkey_id = %s AND time <= %s AND type != %s '
+        'ORDER BY time DESC LIMIT 1), 0) '
+        'ORDER BY time',
+        lambda r, k, t: (r, k, t, r, k, t, CSet.DELTA)),
+    Repo.REVERSE: ('SELECT time, type FROM cset '
+        'WHERE repo_id = %s AND hkey_id = %s '
+        'AND time >= ' + LAST + ' '
+        'AND time <= (SELECT time FROM cset '
+        'WHERE repo_id = %s AND hkey_id = %s AND time >= ' + LAST + ' '
+        'AND type != %s ORDER BY time LIMIT 1) '
+        'ORDER BY time DESC',
+        lambda r, k, t: (r, k, r, k, t, r, k, r, k, t, CSet.DELTA)),
+}
+
+NEW = {
+    Repo.FORWARD: ('SELECT c.time, c.type FROM cset AS c '
+        'INNER JOIN (SELECT time, base FROM cset '
+        'WHERE repo_id = %s AND hkey_id = %s AND time <= %s '
+        'ORDER BY time DESC LIMIT 1) AS last '
+        'ON c.base = last.base AND c.time <= last.time '
+        'WHERE c.repo_id = %s AND c.hkey_id = %s '
+        'ORDER BY c.time',
+        lambda r, k, t: (r, k, t, r, k)),
+    Repo.REVERSE: ('SELECT c.time, c.type FROM cset AS c '
+        'INNER JOIN (SELECT time, base FROM cset '
+        'WHERE repo_id = %s AND hkey_id = %s AND time <= %s '
+        'ORDER BY time DESC LIMIT 1) AS last '
+        'ON c.base = last.base AND c.time >= last.time '
+        'WHERE c.repo_id = %s AND c.hkey_id = %s '
+        'ORDER BY c.time DESC',
+        lambda r, k, t: (r, k, t, r, k)),
+}
+
+def sample(database, repo, count):
+    # Random (key, time) pairs of existing changesets
+    rows = database.execute_sql('SELECT hkey_id, time FROM cset '
+        'WHERE repo_id = %s ORDER BY RAND() LIMIT %s',
+        (repo.id, count)).fetchall()
+    return [(str(sha), ts) for sha, ts in rows]
+
+def explain(database, query, params):
+    cursor = database.execute_sql('EXPLAIN ' + query, params)
+    columns = [c[0] for c in cursor.description]
+    for row in cursor.fetchall():
+        print '  ' + ', '.join('%s=%s' % (c, v)
+            for c, v in zip(columns, row) if v is not None)
+
+def run(database, query, params, samples):
+    rows, t = [], time.time()
+    for sha, ts in samples:
+        rows.append(database.execute_sql(query, params(sha, ts)).fetchall())
+    return time.time() - t, rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('repo', help='repository as USER/REPO')
+    parser.add_argument('--samples', type=int, default=1000,
+        help='number of (key, time) pairs to query')
+    args = parser.parse_args()
+
+    database = from_url(dburl)
+    models.initialize(database, None)
+
+    username, reponame = args.repo.split('/', 1)
+
+    repo = (Repo
+        .select()
+        .join(User)
+        .where((User.name == username) & (Repo.name == reponame))
+        .get())
+
+    samples = sample(database, repo, args.samples)
+
+    if not samples:
+        raise SystemExit('repository has no changesets')
+
+    random.shuffle(samples)
+
+    results = []
+
+    for name, (query, params) in (('old', OLD[repo.mode]),
+                                  ('new', NEW[repo.mode])):
+        bind = lambda sha, ts: params(repo.id, sha, ts)
+
+        print '%s query plan:' % name
+        explain(database, query, bind(*samples[0]))
+
+        t, rows = run(database, query, bind, samples)
+        results.append((name, t, rows))
+
+    print
+    print '%6s %12s' % ('query', 'mean ms')
+
+    for name, t, rows in results:
+        print '%6s %12.3f' % (name, t * 1000.0 / len(samples))
+
+    if results[0][2] != results[1][2]:
+        print 'warning: the queries returned different chains'
+
+    database.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# Compare compression codecs (see `compression`) on the snapshots of a
+# repository: reports the compression ratio and the compression and
+# decompression throughput (of uncompressed bytes) of each codec. For "dict"
+# codecs, a dictionary is trained on every other snapshot and the codec is
+# measured on the remaining ones. Nothing is written to the database. Run
+# from the project root, e.g.:
+#
+# python bench/codecs.py pmeinhardt/test zlib:1 zlib:6 zlib:9 zstd:3 dict:3
+#
+# Zstandard codecs require zstandard: pip install zstandard
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blobstore import Blobstore
+from database import from_url
+
+from config import dburl, bsconf
+from models import *
+
+import compression
+import models
+
+from train import SIZE, samples
+
+def measure(codec, data):
+    t = time.time()
+    blobs = [codec.compress(s) for s in data]
+    ctime = time.time() - t
+
+    t = time.time()
+    for blob in blobs:
+        codec.decompress(blob)
+    dtime = time.time() - t
+
+    return sum(map(len, blobs)), ctime, dtime
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('repo', help='repository as USER/REPO')
+    parser.add_argument('codecs', nargs='*',
+        default=['zlib:1', 'zlib:6', 'zlib:9', 'zstd:3', 'zstd:19', 'dict:3'],
+        help='codec specifications')
+    parser.add_argument('--limit', type=int, default=10000,
+        help='maximum number of snapshots to sample')
+    parser.add_argument('--size', type=int, default=SIZE,
+        help='size of trained dictionaries in bytes')
+    args = parser.parse_args()
+
+    database = from_url(dburl)
+    blobstore = (bsconf["nodes"] and
+        Blobstore(bsconf["nodes"], **bsconf["opts"]) or None)
+    models.initialize(database, blobstore)
+
+    username, reponame = args.repo.split('/', 1)
+
+    repo = (Repo
+        .select()
+        .join(User)
+        .where((User.name == username) & (Repo.name == reponame))
+        .get())
+
+    data = samples(repo, args.limit)
+
+    if len(data) < 2:
+        raise SystemExit('repository has too few snapshots')
+
+    print '%10s %8s %8s %12s %12s' % ('codec', 'blobs', 'ratio',
+        'comp MB/s', 'decomp MB/s')
+
+    for spec in args.codecs:
+        codec, sample = compression.load(spec), data
+
+        if spec.startswith('dict'):
+            d = compression.zstandard.train_dictionary(args.size, data[::2])
+            codec = compression.ZstdCodec(codec.level, d)
+            sample = data[1::2]
+
+        raw = sum(map(len, sample))
+        size, ctime, dtime = measure(codec, sample)
+
+        print '%10s %8d %8.2f %12.1f %12.1f' % (spec, len(sample),
+            float(raw) / size, raw / ctime / 1e6, raw / dtime / 1e6)
+
+    database.close()
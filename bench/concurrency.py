@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Measure the latency of fast requests (reads of a small resource) while
+# slow requests (historic reads of a large resource with long delta chains)
+# are served by the same process, i.e. how much slow requests hold up others.
+#
+# Requires requests (https://github.com/kennethreitz/requests):
+# pip install requests
+#
+# Create an (empty) repository and start a single application process with
+# the state cache disabled (STATE_CACHE_SIZE=0), so that every slow request
+# replays its delta chain. Then run e.g.:
+# python bench/concurrency.py --token TOKEN \
+#   http://localhost:5000/api/pmeinhardt/bench
+#
+# With `--read current`, slow requests read the current state of the large
+# resource instead. With a snapshot of more than 1 MiB (compressed), it is
+# decompressed and merged with the deltas as it is sent, e.g.:
+# python bench/concurrency.py --read current --size 500000 --revisions 5 ...
+
+import argparse
+import datetime
+import random
+import threading
+import time
+
+import requests
+
+QSDATEFMT = '%Y-%m-%d-%H:%M:%S'
+
+def statements(prefix, size, start=0):
+    return ['<http://example.org/%s> <http://example.org/p> "%d" .' % (
+        prefix, i) for i in xrange(start, start + size)]
+
+def session(token=None):
+    s = requests.Session()
+    s.headers = {'Content-Type': 'application/n-triples'}
+    if token:
+        s.headers['Authorization'] = 'token %s' % token
+    return s
+
+def setup(endpoint, args):
+    # Push a small resource and a large one with many revisions, each adding
+    # and removing a few statements, to make for long delta chains.
+    s = session(args.token)
+    start = datetime.datetime(2000, 1, 1)
+    stamps = []
+
+    small = 'http://example.org/bench/small/%d' % random.randrange(10**9)
+    large = 'http://example.org/bench/large/%d' % random.randrange(10**9)
+
+    res = s.put(endpoint, params=dict(key=small),
+        data='\n'.join(statements('small', 10)))
+    res.raise_for_status()
+
+    stmts = statements('large', args.size)
+
+    for i in xrange(args.revisions):
+        stamp = (start + datetime.timedelta(seconds=i)).strftime(QSDATEFMT)
+        stamps.append(stamp)
+        res = s.put(endpoint, params=dict(key=large, datetime=stamp),
+            data='\n'.join(stmts))
+        res.raise_for_status()
+        stmts = stmts[10:] + statements('large', 10, args.size + i * 10)
+
+    s.close()
+
+    return small, large, stamps
+
+def worker(endpoint, params, times, stop):
+    s = session()
+    while not stop.is_set():
+        t = time.time()
+        res = s.get(endpoint, params=params())
+        res.raise_for_status()
+        times.append(time.time() - t)
+    s.close()
+
+def run(endpoint, small, large, stamps, slow, args):
+    rnd = random.Random(args.seed)
+    stop = threading.Event()
+    fast, slowtimes = [], []
+
+    if args.read == 'current':
+        params = lambda: dict(key=large)
+    else:
+        params = lambda: dict(key=large, datetime=rnd.choice(stamps))
+
+    threads = [threading.Thread(target=worker, args=(endpoint, params,
+        slowtimes, stop)) for _ in xrange(slow)]
+
+    threads.extend(threading.Thread(target=worker, args=(endpoint,
+        lambda: dict(key=small), fast, stop))
+        for _ in xrange(args.fast))
+
+    for t in threads:
+        t.start()
+
+    time.sleep(args.duration)
+    stop.set()
+
+    for t in threads:
+        t.join()
+
+    return fast, slowtimes
+
+def summary(times):
+    if not times:
+        return (0, 0.0, 0.0, 0.0)
+    times = sorted(times)
+    return (len(times),
+        times[len(times) // 2] * 1000.0,
+        times[int(len(times) * 0.99)] * 1000.0,
+        times[-1] * 1000.0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('endpoint', help='API endpoint of an empty repo')
+    parser.add_argument('--token', required=True, help='API token')
+    parser.add_argument('--size', type=int, default=20000,
+        help='statements of the large resource')
+    parser.add_argument('--revisions', type=int, default=50,
+        help='revisions of the large resource')
+    parser.add_argument('--fast', type=int, default=4,
+        help='concurrent clients reading the small resource')
+    parser.add_argument('--slow', type=int, nargs='+', default=[0, 1, 4],
+        help='concurrent clients reading the large resource')
+    parser.add_argument('--read', choices=['historic', 'current'],
+        default='historic', help='states of the large resource read')
+    parser.add_argument('--duration', type=float, default=10.0,
+        help='seconds per run')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    small, large, stamps = setup(args.endpoint, args)
+
+    print '%-5s %-5s %8s %10s %10s %10s' % ('slow', 'kind', 'requests',
+        'p50 ms', 'p99 ms', 'max ms')
+
+    for slow in args.slow:
+        fast, slowtimes = run(args.endpoint, small, large, stamps, slow, args)
+        for kind, times in (('fast', fast), ('slow', slowtimes)):
+            print '%-5d %-5s %8d %10.2f %10.2f %10.2f' % ((slow, kind) +
+                summary(times))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Measure the latency of repository index pages deep into a large index,
+# comparing numbered pages (`page=N`, LIMIT/OFFSET) with cursor pages
+# (`after=...`, following the "next" links).
+#
+# Requires requests (https://github.com/kennethreitz/requests):
+# pip install requests
+#
+# A scratch repository can be filled with synthetic keys directly in the
+# database (their changesets have no blob data, so only the index of this
+# repository is of any use afterwards). Run from the project root, e.g.:
+# python bench/index.py --populate 2000000 \
+#   http://localhost:5000/api/pmeinhardt/bench
+
+import argparse
+import datetime
+import hashlib
+import os
+import sys
+import time
+import urlparse
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHUNK_SIZE = 1000 # rows per multi-row insert
+
+def populate(endpoint, count):
+    from database import from_url
+
+    from config import dburl
+    from models import User, Repo, HMap, CSet
+
+    import models
+
+    database = from_url(dburl)
+    models.initialize(database, None)
+
+    username, reponame = urlparse.urlparse(endpoint).path.split('/')[-2:]
+
+    repo = (Repo
+        .select()
+        .join(User)
+        .where((User.name == username) & (Repo.name == reponame))
+        .get())
+
+    ts = datetime.datetime(2000, 1, 1)
+
+    for start in xrange(0, count, CHUNK_SIZE):
+        keys = ['http://example.org/bench/index/%d' % i
+            for i in xrange(start, min(start + CHUNK_SIZE, count))]
+        shas = [hashlib.sha1(key).digest() for key in keys]
+
+        with database.atomic():
+            HMap.insert_many([dict(sha=sha, val=key)
+                for sha, key in zip(shas, keys)]).execute()
+            CSet.insert_many([dict(repo=repo.id, hkey=sha, time=ts,
+                type=CSet.SNAPSHOT, len=0, base=ts)
+                for sha in shas]).execute()
+
+    database.close()
+
+def timed(s, url, params=None):
+    t = time.time()
+    res = s.get(url, params=params)
+    res.raise_for_status()
+    return time.time() - t, res
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('endpoint', help='API endpoint of the repo')
+    parser.add_argument('--populate', type=int, default=0,
+        help='number of synthetic keys to add to the repo first')
+    parser.add_argument('--every', type=int, default=100,
+        help='measure numbered pages every this many pages')
+    args = parser.parse_args()
+
+    if args.populate:
+        populate(args.endpoint, args.populate)
+
+    s = requests.Session()
+
+    print '%8s %12s %12s' % ('page', 'offset ms', 'cursor ms')
+
+    url, params, page = args.endpoint, dict(index='true'), 1
+
+    while url:
+        cursor, res = timed(s, url, params)
+
+        if page == 1 or page % args.every == 0:
+            offset, _ = timed(s, args.endpoint,
+                dict(index='true', page=str(page)))
+            print '%8d %12.2f %12.2f' % (page, offset * 1000.0,
+                cursor * 1000.0)
+
+        url = res.links.get('next', {}).get('url')
+        params, page = None, page + 1
+
+    s.close()
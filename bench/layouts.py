@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Compare the statement lines and statement ids layouts (see `stmtdict`) on
+# generated resource histories in a forward-delta repository: reports the
+# stored bytes (for ids including the statement dictionary), the time to
+# encode all revisions (diffing and compressing, as when pushing them) and
+# the average time to reconstruct the latest state of a resource from its
+# delta chain. Statements are interned in memory, so nothing is written to
+# the database; looking up the statements of states of ids when serving them
+# (a query per 1000 statements) is not included. Run from the project root,
+# e.g.:
+#
+# python bench/layouts.py --size 1000 --churn 0.01 --revisions 100
+#
+# The ids layout requires numpy: pip install numpy
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Repo, CSet
+
+import compression
+import policy
+import stmtdict
+
+from convert import encode
+from revision import LINES, IDS
+
+def history(resource, size, churn, count, rnd):
+    """Generate `count` states of a resource with `size` statements, changing
+    a fraction `churn` of the statements from one revision to the next."""
+    n = [0]
+
+    def stmt():
+        n[0] += 1
+        return ('<http://example.org/r%d> <http://example.org/p%d> '
+            '"value %d" .' % (resource, n[0] % 50, n[0]))
+
+    stmts = set(stmt() for _ in xrange(size))
+    revs = []
+
+    for i in xrange(count):
+        revs.append((i, set(stmts)))
+        changed = rnd.sample(sorted(stmts), max(1, int(size * churn)))
+        stmts.difference_update(changed)
+        stmts.update(stmt() for _ in changed)
+
+    return revs
+
+def intern(revs, ids):
+    # Replace the states of `revs` by arrays of ids assigned in `ids`
+    return [(t, stmtdict.array(ids.setdefault(s, len(ids) + 1)
+        for s in stmts)) for t, stmts in revs]
+
+def latest(rows):
+    # The blob data of the delta chain of the latest revision
+    start = max(i for i, row in enumerate(rows) if row[1] != CSet.DELTA)
+    return [data for _, _, data in rows[start:]]
+
+def measure(histories, layout, pol, codec):
+    size, etime, rtime = 0, 0.0, 0.0
+
+    for revs in histories:
+        t = time.time()
+        rows = encode(revs, Repo.FORWARD, pol, codec, layout)
+        etime += time.time() - t
+
+        size += sum(len(data) for _, _, data in rows)
+
+        chain = latest(rows)
+        t = time.time()
+        layout.reconstruct(chain)
+        rtime += time.time() - t
+
+    return size, etime, rtime / len(histories)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resources', type=int, default=20,
+        help='number of resources')
+    parser.add_argument('--size', type=int, default=1000,
+        help='statements per resource')
+    parser.add_argument('--churn', type=float, default=0.01,
+        help='fraction of statements changed per revision')
+    parser.add_argument('--revisions', type=int, default=100,
+        help='number of revisions per resource')
+    parser.add_argument('--policy', default='size:10',
+        help='snapshot policy')
+    parser.add_argument('--codec', default='zlib:6',
+        help='compression codec')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    pol = policy.load(args.policy)
+    codec = compression.load(args.codec)
+
+    lines = [history(i, args.size, args.churn, args.revisions, rnd)
+        for i in xrange(args.resources)]
+
+    ids = {}
+    arrays = [intern(revs, ids) for revs in lines]
+
+    # Statement, digest and id of every dictionary entry
+    dictsize = sum(len(s) + 24 for s in ids)
+
+    print '%-6s %12s %12s %10s %14s' % ('layout', 'blob bytes',
+        'dict bytes', 'encode s', 'latest ms')
+
+    for name, layout, histories, extra in (('lines', LINES, lines, 0),
+                                           ('ids', IDS, arrays, dictsize)):
+        size, etime, rtime = measure(histories, layout, pol, codec)
+        print '%-6s %12d %12d %10.2f %14.3f' % (name, size, extra, etime,
+            rtime * 1000.0)
@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+
+# Load test a running application with a mixed workload on a synthetic
+# dataset: resources of `--size` statements, each revision changing a
+# fraction `--churn` of them. After pushing `--revisions` revisions of every
+# resource, clients issue random operations for `--duration` seconds, once
+# for each number of concurrent clients given by `--concurrency`:
+#
+# push          a new revision of a resource
+# latest        the current state of a resource
+# historic      the state of a resource at the time of a random revision
+# timemap       the timemap of a resource
+# index         the next page of the current index (following its cursor)
+# delete        a resource (the next push restores it)
+#
+# `--mix` weighs the operations, e.g. `push=1,latest=1` for pushes and reads
+# only. Revisions get consecutive timestamps starting in 2000, so historic
+# reads find every revision. Reports the throughput and the latency
+# percentiles and histogram of each operation, as a table or (`--json`)
+# as JSON.
+#
+# Requires requests (https://github.com/kennethreitz/requests):
+# pip install requests
+#
+# Start the application locally, e.g. `DEBUG=1 python app.py`, and run the
+# benchmark against a new repository, created (along with a user "bench"
+# and an API token) directly in the configured database:
+#
+# python bench/load.py --create --url http://localhost:5000 \
+#   --concurrency 1 4 16 --duration 30 --json results.json
+#
+# or against an existing, empty repository:
+#
+# python bench/load.py --token TOKEN http://localhost:5000/api/user/repo
+#
+# To compare the storage backends, run the same benchmark against the
+# application started with a MariaDB/MySQL and with a SQLite DATABASE_URL
+# (see `config`), e.g. `DATABASE_URL=sqlite:////tmp/load.db`, after
+# `python prepare.py` for each database.
+
+import argparse
+import bisect
+import collections
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QSDATEFMT = '%Y-%m-%d-%H:%M:%S'
+
+START = datetime.datetime(2000, 1, 1)
+
+OPERATIONS = ['push', 'latest', 'historic', 'timemap', 'index', 'delete']
+
+MIX = 'push=20,latest=40,historic=20,timemap=10,index=5,delete=5'
+
+# Upper bounds of the latency histogram buckets in milliseconds (the last
+# bucket holds all slower requests)
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+class Clock(object):
+    """Consecutive timestamps, one second apart."""
+
+    def __init__(self, start=START):
+        self.start = start
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            self.count += 1
+            return self.start + datetime.timedelta(seconds=self.count)
+
+class Resource(object):
+    """A synthetic resource with `size` statements, of which a fraction
+    `churn` changes from one revision to the next."""
+
+    def __init__(self, n, size, churn, seed):
+        self.key = 'http://example.org/load/%d' % n
+        self.size = size
+        self.churn = churn
+        self.rnd = random.Random(seed)
+        self.count = 0
+        self.stmts = [self.stmt() for _ in xrange(size)]
+        self.times = [] # of all revisions, including deletes
+        self.lock = threading.Lock() # held while writing a revision
+
+    def stmt(self):
+        self.count += 1
+        return '<%s> <http://example.org/p%d> "value %d" .' % (self.key,
+            self.count % 50, self.count)
+
+    def change(self):
+        changed = max(1, int(self.size * self.churn))
+        for i in self.rnd.sample(xrange(self.size), min(changed, self.size)):
+            self.stmts[i] = self.stmt()
+
+    def body(self):
+        return '\n'.join(self.stmts) + '\n'
+
+class Recorder(object):
+    """Latencies (in seconds), status codes, errors and response bytes of
+    the requests of each operation."""
+
+    def __init__(self):
+        self.times = collections.defaultdict(list)
+        self.status = collections.defaultdict(collections.Counter)
+        self.errors = collections.Counter()
+        self.bytes = collections.Counter()
+
+    def record(self, op, seconds, status, size, ok):
+        self.times[op].append(seconds)
+        self.status[op][status] += 1
+        self.bytes[op] += size
+        if not ok:
+            self.errors[op] += 1
+
+    def update(self, other):
+        for op in other.times:
+            self.times[op].extend(other.times[op])
+            self.status[op].update(other.status[op])
+        self.errors.update(other.errors)
+        self.bytes.update(other.bytes)
+
+def session(token=None):
+    s = requests.Session()
+    s.headers = {'Content-Type': 'application/n-triples'}
+    if token:
+        s.headers['Authorization'] = 'token %s' % token
+    return s
+
+def mix(spec):
+    # Parse "op=weight,..." into the operations and their cumulative weights
+    ops, weights, total = [], [], 0.0
+    for part in spec.split(','):
+        op, weight = part.split('=')
+        if op not in OPERATIONS:
+            raise ValueError('unknown operation: %s' % op)
+        total += float(weight)
+        ops.append(op)
+        weights.append(total)
+    return ops, weights
+
+def create(username, mode, layout):
+    # Create a repository (and if necessary the user `username`) with an API
+    # token directly in the configured database, returning the repository
+    # name and the token
+    from database import from_url
+
+    from config import dburl
+    from models import User, Repo, Token
+
+    import models
+
+    models.initialize(from_url(dburl), None)
+
+    try:
+        user = User.get(User.name == username)
+    except User.DoesNotExist:
+        user = User.create(name=username, confirmed=True)
+
+    reponame = 'load-%d' % random.randrange(10**9)
+
+    Repo.create(user=user, name=reponame, desc='bench/load.py',
+        mode=mode == 'reverse' and Repo.REVERSE or Repo.FORWARD,
+        layout=layout == 'ids' and Repo.IDS or Repo.LINES)
+
+    value = '%040x' % random.randrange(16**40)
+    Token.create(user=user, value=value, desc='bench/load.py')
+
+    return reponame, value
+
+class Client(object):
+    """Issues the operations of the workload against `endpoint`."""
+
+    def __init__(self, endpoint, token, resources, clock, recorder, rnd):
+        self.endpoint = endpoint
+        self.session = session(token)
+        self.resources = resources
+        self.clock = clock
+        self.recorder = recorder
+        self.rnd = rnd
+        self.cursor = None # URL of the next index page
+
+    def request(self, op, method, url=None, **kwargs):
+        t = time.time()
+        try:
+            res = self.session.request(method, url or self.endpoint,
+                **kwargs)
+            status, size = res.status_code, len(res.content)
+        except requests.RequestException:
+            res, status, size = None, 0, 0
+        seconds = time.time() - t
+        # Reads of deleted resources are expected to fail with 404
+        ok = 0 < status < 400 or (status == 404 and method == 'GET')
+        self.recorder.record(op, seconds, status, size, ok)
+        return res
+
+    def write(self, op, resource, method):
+        # Write a revision of `resource` unless another client is at it
+        if not resource.lock.acquire(False):
+            return
+        try:
+            ts = self.clock.next()
+            params = dict(key=resource.key, datetime=ts.strftime(QSDATEFMT))
+            if method == 'PUT':
+                resource.change()
+                res = self.request(op, 'PUT', params=params,
+                    data=resource.body())
+            else:
+                res = self.request(op, 'DELETE', params=params)
+            if res is not None and res.status_code == 200:
+                resource.times.append(ts)
+        finally:
+            resource.lock.release()
+
+    def push(self, resource):
+        self.write('push', resource, 'PUT')
+
+    def delete(self, resource):
+        self.write('delete', resource, 'DELETE')
+
+    def latest(self, resource):
+        self.request('latest', 'GET', params=dict(key=resource.key))
+
+    def historic(self, resource):
+        if not resource.times:
+            return # nothing pushed yet
+        ts = self.rnd.choice(resource.times)
+        self.request('historic', 'GET', params=dict(key=resource.key,
+            datetime=ts.strftime(QSDATEFMT)))
+
+    def timemap(self, resource):
+        self.request('timemap', 'GET', params=dict(key=resource.key,
+            timemap='true'))
+
+    def index(self, resource):
+        if self.cursor is None:
+            res = self.request('index', 'GET', params=dict(index='true'))
+        else:
+            res = self.request('index', 'GET', url=self.cursor)
+        self.cursor = (res is not None and
+            res.links.get('next', {}).get('url') or None)
+
+    def run(self, ops, weights, stop):
+        while not stop.is_set():
+            op = ops[bisect.bisect(weights, self.rnd.random() * weights[-1])]
+            getattr(self, op)(self.rnd.choice(self.resources))
+
+    def close(self):
+        self.session.close()
+
+def setup(endpoint, token, resources, clock, revisions, threads):
+    # Push `revisions` revisions of every resource, spread over `threads`
+    # clients
+    recorders = [Recorder() for _ in xrange(threads)]
+    queue = list(resources)
+    lock = threading.Lock()
+
+    def work(recorder):
+        client = Client(endpoint, token, resources, clock, recorder, None)
+        while True:
+            with lock:
+                if not queue:
+                    break
+                resource = queue.pop()
+            for _ in xrange(revisions):
+                client.push(resource)
+        client.close()
+
+    t = time.time()
+    workers = [threading.Thread(target=work, args=(r,)) for r in recorders]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.time() - t
+
+    recorder = Recorder()
+    for r in recorders:
+        recorder.update(r)
+
+    return recorder, elapsed
+
+def run(endpoint, token, resources, clock, concurrency, duration, ops,
+        weights, seed):
+    # Run `concurrency` clients for `duration` seconds
+    stop = threading.Event()
+    clients = [Client(endpoint, token, resources, clock, Recorder(),
+        random.Random(seed + i)) for i in xrange(concurrency)]
+    workers = [threading.Thread(target=c.run, args=(ops, weights, stop))
+        for c in clients]
+
+    t = time.time()
+    for w in workers:
+        w.start()
+    time.sleep(duration)
+    stop.set()
+    for w in workers:
+        w.join()
+    elapsed = time.time() - t
+
+    recorder = Recorder()
+    for c in clients:
+        recorder.update(c.recorder)
+        c.close()
+
+    return recorder, elapsed
+
+def histogram(times):
+    counts = [0] * (len(BUCKETS) + 1)
+    for t in times:
+        counts[bisect.bisect_left(BUCKETS, t * 1000.0)] += 1
+    return [dict(le=le, count=n) for le, n in zip(BUCKETS + [None], counts)]
+
+def percentile(times, p):
+    return times[min(len(times) - 1, int(len(times) * p))] * 1000.0
+
+def report(recorder, elapsed):
+    """Return the summary of a run, e.g. to be serialized as JSON."""
+    operations = {}
+
+    for op in OPERATIONS:
+        times = sorted(recorder.times[op])
+        if not times:
+            continue
+        operations[op] = dict(
+            requests=len(times),
+            errors=recorder.errors[op],
+            throughput=len(times) / elapsed,
+            bytes=recorder.bytes[op],
+            status=dict((str(s), n) for s, n in recorder.status[op].items()),
+            latency_ms=dict(
+                mean=sum(times) / len(times) * 1000.0,
+                p50=percentile(times, 0.5),
+                p90=percentile(times, 0.9),
+                p99=percentile(times, 0.99),
+                max=times[-1] * 1000.0),
+            histogram=histogram(times))
+
+    count = sum(len(t) for t in recorder.times.itervalues())
+
+    return dict(
+        duration=elapsed,
+        requests=count,
+        errors=sum(recorder.errors.itervalues()),
+        throughput=count / elapsed,
+        operations=operations)
+
+def table(runs):
+    print '%-11s %-8s %8s %7s %9s %9s %9s %9s %9s' % ('concurrency',
+        'op', 'requests', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms',
+        'max ms')
+    for r in runs:
+        for op in OPERATIONS:
+            if op not in r['operations']:
+                continue
+            o, l = r['operations'][op], r['operations'][op]['latency_ms']
+            print '%-11s %-8s %8d %7d %9.1f %9.2f %9.2f %9.2f %9.2f' % (
+                r['concurrency'], op, o['requests'], o['errors'],
+                o['throughput'], l['p50'], l['p90'], l['p99'], l['max'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('endpoint', nargs='?',
+        help='API endpoint of an empty repo (unless --create)')
+    parser.add_argument('--token', help='API token (unless --create)')
+    parser.add_argument('--create', action='store_true',
+        help='create a repository and token in the configured database')
+    parser.add_argument('--url', default='http://localhost:5000',
+        help='application URL (with --create)')
+    parser.add_argument('--user', default='bench',
+        help='owner of the created repository (with --create)')
+    parser.add_argument('--mode', choices=['forward', 'reverse'],
+        default='forward', help='mode of the created repository')
+    parser.add_argument('--layout', choices=['lines', 'ids'],
+        default='lines', help='layout of the created repository')
+    parser.add_argument('--resources', type=int, default=100,
+        help='number of resources')
+    parser.add_argument('--size', type=int, default=1000,
+        help='statements per resource')
+    parser.add_argument('--churn', type=float, default=0.01,
+        help='fraction of statements changed per revision')
+    parser.add_argument('--revisions', type=int, default=10,
+        help='revisions per resource pushed before the runs')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4],
+        help='concurrent clients, one run each')
+    parser.add_argument('--duration', type=float, default=10.0,
+        help='seconds per run')
+    parser.add_argument('--mix', default=MIX,
+        help='weights of the operations')
+    parser.add_argument('--json', metavar='FILE',
+        help='write the results as JSON to FILE ("-" for stdout)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.create:
+        reponame, token = create(args.user, args.mode, args.layout)
+        endpoint = '%s/api/%s/%s' % (args.url.rstrip('/'), args.user,
+            reponame)
+    elif args.endpoint and args.token:
+        endpoint, token = args.endpoint, args.token
+    else:
+        parser.error('give an endpoint and --token, or --create')
+
+    ops, weights = mix(args.mix)
+    rnd = random.Random(args.seed)
+    clock = Clock()
+
+    resources = [Resource(i, args.size, args.churn, rnd.random())
+        for i in xrange(args.resources)]
+
+    recorder, elapsed = setup(endpoint, token, resources, clock,
+        args.revisions, max(args.concurrency))
+
+    results = dict(
+        endpoint=endpoint,
+        config=dict((k, getattr(args, k)) for k in ('resources', 'size',
+            'churn', 'revisions', 'duration', 'mix', 'seed')),
+        setup=report(recorder, elapsed),
+        runs=[])
+
+    for concurrency in args.concurrency:
+        recorder, elapsed = run(endpoint, token, resources, clock,
+            concurrency, args.duration, ops, weights, args.seed)
+        summary = report(recorder, elapsed)
+        summary['concurrency'] = concurrency
+        results['runs'].append(summary)
+
+    if args.json == '-':
+        print json.dumps(results, indent=2, sort_keys=True)
+    else:
+        table(results['runs'])
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Microbenchmarks of the revision engine (see `revision`), without HTTP or a
+# database: parsing pushed N-Triples, hashing statements, compressing and
+# decompressing snapshots, computing and applying deltas, replaying delta
+# chains and deciding on the changeset for a push (`revise`), for resources
+# of several sizes and rates of change between revisions. Each benchmark is
+# repeated for at least `--min-time` seconds; the best and median times per
+# run are reported, and written as JSON with `--json`, so that runs can be
+# compared: `--compare` reports the ratios to the results of an earlier
+# run and exits with status 1 if any benchmark got slower by more than
+# `--threshold`. Run from the project root, e.g.:
+#
+# python bench/micro.py --sizes 1000 100000 --churn 0.01 0.1 --json a.json
+# python bench/micro.py --sizes 1000 100000 --churn 0.01 0.1 --compare a.json
+#
+# The ids layout (see `stmtdict`) is included if numpy is installed.
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collections import namedtuple
+
+import compression
+import policy
+import stmtdict
+
+from models import CSet
+from revision import (parse, shasum, snapshot, decompress, diff, patch,
+    replay, revise, IDS)
+
+# Changeset of a delta chain, as passed to `revise`
+Change = namedtuple('Change', 'time type len')
+
+def stmt(i):
+    return ('<http://example.org/r%d> <http://example.org/p%d> '
+        '"value %d" .' % (i // 20, i % 20, i))
+
+def states(size, churn, count, rnd):
+    """Return `count` sorted states of a resource with `size` statements,
+    a fraction `churn` of which changes from one state to the next."""
+    stmts = [stmt(i) for i in xrange(size)]
+    n, out = size, []
+    for _ in xrange(count):
+        out.append(sorted(stmts))
+        for i in rnd.sample(xrange(size), max(1, int(size * churn))):
+            stmts[i] = stmt(n)
+            n += 1
+    return out
+
+def chain(revs, codec):
+    # The blob data of a delta chain leading from the first to the last of
+    # the states `revs`
+    blobs = [snapshot(revs[0], codec)]
+    for prev, stmts in zip(revs, revs[1:]):
+        blobs.append(diff(prev, stmts, codec))
+    return blobs
+
+def benchmarks(size, churn, deltas, codec, rnd):
+    """Yield the name and the function to be timed of each benchmark for
+    resources of `size` statements changing by a fraction `churn`."""
+    revs = states(size, churn, deltas + 2, rnd)
+    prev, stmts = revs[-2], revs[-1]
+    body = '\n'.join(stmts) + '\n'
+    snap = snapshot(stmts, codec)
+    blobs = chain(revs[:-1], codec)
+    delta = diff(prev, stmts, codec)
+    changes = [Change(i, i and CSet.DELTA or CSet.SNAPSHOT, len(b))
+        for i, b in enumerate(blobs)]
+    pol = policy.load('size:10')
+
+    yield 'parse', lambda: parse(body, 'application/n-triples')
+    yield 'shasum', lambda: [shasum(s) for s in stmts]
+    yield 'snapshot', lambda: snapshot(stmts, codec)
+    yield 'decompress', lambda: decompress(snap)
+    yield 'diff', lambda: diff(prev, stmts, codec)
+    yield 'patch', lambda: patch(set(prev), delta)
+    yield 'replay', lambda: sum(len(c) for c in replay(blobs))
+    yield 'revise', lambda: revise(changes, prev, stmts, pol, None, codec)
+
+    if stmtdict.numpy is None:
+        return
+
+    ids = dict((s, i + 1) for i, s in enumerate(sorted(set(
+        itertools.chain.from_iterable(revs)))))
+    arrays = [stmtdict.array(ids[s] for s in r) for r in revs]
+    aprev, astmts = arrays[-2], arrays[-1]
+    ablobs = [IDS.snapshot(arrays[0], codec)]
+    ablobs.extend(IDS.delta(a, b, codec) or IDS.empty(codec)
+        for a, b in zip(arrays[:-2], arrays[1:-1]))
+    adelta = IDS.delta(aprev, astmts, codec) or IDS.empty(codec)
+
+    yield 'ids/snapshot', lambda: IDS.snapshot(astmts, codec)
+    yield 'ids/diff', lambda: IDS.delta(aprev, astmts, codec)
+    yield 'ids/patch', lambda: IDS.patch(aprev, adelta)
+    yield 'ids/replay', lambda: IDS.reconstruct(ablobs)
+    yield 'ids/revise', lambda: revise(changes, aprev, astmts, pol, None,
+        codec, IDS)
+
+def measure(fn, min_time, min_runs):
+    # Return the times of repeated calls of `fn`, running it at least
+    # `min_runs` times and for at least `min_time` seconds
+    times, total = [], 0.0
+    while len(times) < min_runs or total < min_time:
+        t = timeit.default_timer()
+        fn()
+        times.append(timeit.default_timer() - t)
+        total += times[-1]
+    return sorted(times)
+
+def key(result):
+    return '%s/%d/%g' % (result['name'], result['size'], result['churn'])
+
+def compare(results, baseline, threshold):
+    # Print the ratio of each time to that of the baseline, returning the
+    # number of benchmarks slower by more than `threshold`
+    old = dict((key(r), r) for r in baseline['results'])
+    slower = 0
+    print '%-14s %9s %7s %12s %12s %7s' % ('benchmark', 'size', 'churn',
+        'before ms', 'after ms', 'ratio')
+    for r in results:
+        b = old.get(key(r))
+        if b is None:
+            continue
+        ratio = r['best'] / b['best']
+        flag = ratio > threshold and ' slower' or ''
+        slower += bool(flag)
+        print '%-14s %9d %7g %12.3f %12.3f %7.2f%s' % (r['name'], r['size'],
+            r['churn'], b['best'] * 1000.0, r['best'] * 1000.0, ratio, flag)
+    return slower
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+        default=[100, 10000, 100000], help='statements per resource')
+    parser.add_argument('--churn', type=float, nargs='+',
+        default=[0.001, 0.01, 0.1],
+        help='fractions of statements changed per revision')
+    parser.add_argument('--deltas', type=int, default=10,
+        help='deltas in replayed chains')
+    parser.add_argument('--codec', default='zlib:6',
+        help='compression codec')
+    parser.add_argument('--min-time', type=float, default=0.5,
+        help='seconds to repeat each benchmark for')
+    parser.add_argument('--min-runs', type=int, default=3,
+        help='runs of each benchmark at least')
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+        help='run only these benchmarks')
+    parser.add_argument('--json', metavar='FILE',
+        help='write the results as JSON to FILE')
+    parser.add_argument('--compare', metavar='FILE',
+        help='compare with the JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.1,
+        help='ratio above which a benchmark counts as slower')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    codec = compression.load(args.codec)
+    results = []
+
+    print '%-14s %9s %7s %6s %10s %10s' % ('benchmark', 'size', 'churn',
+        'runs', 'best ms', 'median ms')
+
+    for size in args.sizes:
+        for churn in args.churn:
+            rnd = random.Random(args.seed)
+            for name, fn in benchmarks(size, churn, args.deltas, codec, rnd):
+                if args.only and name not in args.only:
+                    continue
+                times = measure(fn, args.min_time, args.min_runs)
+                results.append(dict(name=name, size=size, churn=churn,
+                    runs=len(times), best=times[0],
+                    median=times[len(times) // 2]))
+                print '%-14s %9d %7g %6d %10.3f %10.3f' % (name, size, churn,
+                    len(times), times[0] * 1000.0,
+                    times[len(times) // 2] * 1000.0)
+                sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(
+                date=datetime.datetime.utcnow().isoformat(),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                codec=args.codec,
+                deltas=args.deltas,
+                results=results), f, indent=2, sort_keys=True)
+
+    if args.compare:
+        print
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                sys.exit(1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Compare read and write costs of the forward and reverse-delta storage modes.
+#
+# Requires requests (https://github.com/kennethreitz/requests):
+# pip install requests
+#
+# Create two (empty) repositories, one in each storage mode, then run e.g.:
+# python bench/modes.py --token TOKEN \
+#   http://localhost:5000/api/pmeinhardt/fwd \
+#   http://localhost:5000/api/pmeinhardt/rev
+
+import argparse
+import datetime
+import random
+import time
+
+import requests
+
+QSDATEFMT = '%Y-%m-%d-%H:%M:%S'
+
+def revisions(size, churn, count, seed):
+    """Generate `count` states of a resource with `size` statements, changing
+    a fraction `churn` of the statements from one revision to the next."""
+    rnd = random.Random(seed)
+    n = [0]
+
+    def stmt():
+        n[0] += 1
+        return '<http://example.org/r> <http://example.org/p%d> "%d" .' % (
+            n[0] % 50, n[0])
+
+    stmts = set(stmt() for _ in xrange(size))
+
+    for _ in xrange(count):
+        yield '\n'.join(stmts)
+        changed = rnd.sample(sorted(stmts), max(1, int(size * churn)))
+        stmts.difference_update(changed)
+        stmts.update(stmt() for _ in changed)
+
+def timed(fn, *args, **kwargs):
+    t = time.time()
+    res = fn(*args, **kwargs)
+    if res.status_code != 200:
+        raise RuntimeError('%d %s' % (res.status_code, res.url))
+    return time.time() - t
+
+def summary(times):
+    times = sorted(times)
+    return (sum(times) / len(times) * 1000.0,
+        times[len(times) // 2] * 1000.0,
+        times[int(len(times) * 0.99)] * 1000.0)
+
+def run(endpoint, args):
+    s = requests.Session()
+    s.headers = {
+        'Content-Type': 'application/n-triples',
+        'Authorization': 'token %s' % args.token,
+    }
+
+    key = 'http://example.org/bench/%d' % random.randrange(10**9)
+    start = datetime.datetime(2000, 1, 1)
+    stamps = []
+
+    writes = []
+    for i, body in enumerate(revisions(args.size, args.churn,
+                                       args.revisions, args.seed)):
+        stamp = (start + datetime.timedelta(seconds=i)).strftime(QSDATEFMT)
+        stamps.append(stamp)
+        writes.append(timed(s.put, endpoint,
+            params=dict(key=key, datetime=stamp), data=body))
+
+    latest = [timed(s.get, endpoint, params=dict(key=key))
+        for _ in xrange(args.reads)]
+
+    rnd = random.Random(args.seed)
+    historic = [timed(s.get, endpoint,
+        params=dict(key=key, datetime=rnd.choice(stamps)))
+        for _ in xrange(args.reads)]
+
+    s.close()
+
+    return writes, latest, historic
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('forward', help='API endpoint of a forward repo')
+    parser.add_argument('reverse', help='API endpoint of a reverse repo')
+    parser.add_argument('--token', required=True, help='API token')
+    parser.add_argument('--size', type=int, default=1000,
+        help='statements per resource')
+    parser.add_argument('--churn', type=float, default=0.01,
+        help='fraction of statements changed per revision')
+    parser.add_argument('--revisions', type=int, default=100,
+        help='number of revisions to push')
+    parser.add_argument('--reads', type=int, default=100,
+        help='number of reads per kind')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print '%-8s %-9s %10s %10s %10s' % ('mode', 'op', 'mean ms', 'p50 ms',
+        'p99 ms')
+
+    for mode in ('forward', 'reverse'):
+        writes, latest, historic = run(getattr(args, mode), args)
+        for op, times in (('push', writes), ('latest', latest),
+                          ('historic', historic)):
+            print '%-8s %-9s %10.2f %10.2f %10.2f' % ((mode, op) +
+                summary(times))
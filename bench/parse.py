@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Compare parsing N-Triples with librdf against the native line-based parser
+# (see `ntriples`), checking that both produce the same statement lines.
+# Inputs are either given N-Triples files (e.g. DBpedia dumps split per
+# resource, or whole dumps) or generated resources resembling DBpedia ones,
+# with labels and abstracts in several languages. Run from the project
+# root, e.g.:
+#
+# python bench/parse.py --generate 1000 10000 100000
+# python bench/parse.py data/Berlin.nt data/labels_en.nt
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RDF
+
+import ntriples
+
+from revision import Spool, rdflines, rdfstream
+
+CHUNK_SIZE = 64 * 1024 # bytes per chunk, as passed to `data_received`
+
+LABELS = [
+    ('en', 'Berlin'),
+    ('de', 'Berlin'),
+    ('fr', 'Berlin \\u00E9t\\u00E9'),
+    ('ru', '\\u0411\\u0435\\u0440\\u043B\\u0438\\u043D'),
+    ('ja', '\\u30D9\\u30EB\\u30EA\\u30F3'),
+    ('el', '\xce\x92\xce\xb5\xcf\x81\xce\xbf\xce\xbb\xce\xaf\xce\xbd\xce\xbf'),
+]
+
+def generate(count):
+    f = tempfile.NamedTemporaryFile(prefix='tailr-bench-', suffix='.nt')
+    r = '<http://dbpedia.org/resource/Bench_%d>'
+    for i in xrange(count):
+        s = r % (i // 50)
+        lang, label = LABELS[i % len(LABELS)]
+        kind = i % 4
+        if kind == 0:
+            f.write('%s <http://www.w3.org/2000/01/rdf-schema#label> '
+                '"%s %d"@%s .\n' % (s, label, i, lang))
+        elif kind == 1:
+            f.write('%s <http://dbpedia.org/ontology/abstract> '
+                '"%s is a \\"city\\" (no. %d).\\nSee also %s."@%s .\n' %
+                (s, label, i, label, lang))
+        elif kind == 2:
+            f.write('%s <http://dbpedia.org/ontology/populationTotal> '
+                '"%d"^^<http://www.w3.org/2001/XMLSchema#integer> .\n' %
+                (s, i))
+        else:
+            f.write('%s <http://dbpedia.org/ontology/wikiPageWikiLink> '
+                '%s .\n' % (s, r % i))
+    f.flush()
+    return f
+
+def spool(path):
+    body = Spool()
+    with open(path) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            body.write(chunk)
+    return body
+
+def librdf(body):
+    parser = RDF.Parser(mime_type='application/n-triples')
+    return set(str(st) + ' .' for st in rdfstream(parser, body))
+
+def native(body):
+    return set(ntriples.triples(rdflines(body)))
+
+def measure(fn, path):
+    body = spool(path)
+    t = time.time()
+    try:
+        stmts = fn(body)
+    except ntriples.Unsupported as e:
+        stmts = e
+    t = time.time() - t
+    body.close()
+    return t, stmts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', help='N-Triples files')
+    parser.add_argument('--generate', type=int, nargs='*', default=[],
+        help='statements per generated resource')
+    args = parser.parse_args()
+
+    if not args.files and not args.generate:
+        args.generate = [1000, 10000, 100000]
+
+    inputs = [(path, None) for path in args.files]
+    inputs += [(None, generate(count)) for count in args.generate]
+
+    print '%-24s %10s %10s %10s %10s %8s' % ('input', 'MiB', 'statements',
+        'librdf s', 'native s', 'speedup')
+
+    for path, f in inputs:
+        path = path or f.name
+        size = os.path.getsize(path) / 1024.0**2
+
+        lt, expected = measure(librdf, path)
+        nt, stmts = measure(native, path)
+
+        name = os.path.basename(path)[-24:]
+
+        if isinstance(stmts, ntriples.Unsupported):
+            print '%-24s %10.1f %10d %10.2f %10s %8s' % (name, size,
+                len(expected), lt, '-', '-')
+            print '  falls back to librdf: %s' % stmts
+        else:
+            print '%-24s %10.1f %10d %10.2f %10.2f %8.1f' % (name, size,
+                len(expected), lt, nt, lt / max(nt, 1e-6))
+            if stmts != expected:
+                print '  MISMATCH: %d statements differ, e.g.:' % len(
+                    stmts ^ expected)
+                for stmt in sorted(stmts ^ expected)[:4]:
+                    print '  ' + (stmt in expected and 'librdf ' or
+                        'native ') + stmt
+
+        if f is not None:
+            f.close()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Compare snapshot policies on the real history of a repository: re-encodes
+# all revisions of (a sample of) its resources with each policy and reports
+# the resulting storage size and the average time to reconstruct a revision
+# from its delta chain. Nothing is written to the database. Run from the
+# project root, e.g.:
+#
+# python bench/policy.py pmeinhardt/test size:5 size:10 chain:8 cost:1e-7
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blobstore import Blobstore
+from database import from_url
+
+from config import dburl, bsconf
+from models import *
+
+import models
+import policy
+
+from convert import encode, revisions
+from revision import LAYOUTS
+
+def chains(rows, mode):
+    """Yield the blob data of the delta chain for each revision."""
+    if mode == Repo.REVERSE:
+        for i in xrange(len(rows)):
+            chain = []
+            for _, cstype, data in rows[i:]:
+                if data is not None:
+                    chain.insert(0, data)
+                if cstype != CSet.DELTA:
+                    break
+            yield chain
+    else:
+        chain = []
+        for _, cstype, data in rows:
+            if cstype != CSet.DELTA:
+                chain = []
+            if data is not None:
+                chain.append(data)
+            yield chain
+
+def measure(history, mode, layout, pol):
+    size, latency, count = 0, 0.0, 0
+
+    for revs in history:
+        rows = encode(revs, mode, pol, layout=layout)
+        size += sum(len(row[2]) for row in rows if row[2])
+
+        for chain in chains(rows, mode):
+            if chain:
+                t = time.time()
+                layout.reconstruct(chain)
+                latency += time.time() - t
+                count += 1
+
+    return size, count and latency / count or 0.0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('repo', help='repository as USER/REPO')
+    parser.add_argument('policies', nargs='+', help='policy specifications')
+    parser.add_argument('--limit', type=int, default=1000,
+        help='maximum number of resources to sample')
+    args = parser.parse_args()
+
+    database = from_url(dburl)
+    blobstore = (bsconf["nodes"] and
+        Blobstore(bsconf["nodes"], **bsconf["opts"]) or None)
+    models.initialize(database, blobstore)
+
+    username, reponame = args.repo.split('/', 1)
+
+    repo = (Repo
+        .select()
+        .join(User)
+        .where((User.name == username) & (Repo.name == reponame))
+        .get())
+
+    shas = (CSet
+        .select(CSet.hkey)
+        .where(CSet.repo == repo)
+        .distinct()
+        .limit(args.limit)
+        .tuples())
+
+    history = [revisions(repo, sha) for sha, in shas]
+
+    current = (CSet
+        .select(fn.Sum(CSet.len))
+        .where((CSet.repo == repo) & (CSet.hkey << [sha for sha, in shas]))
+        .scalar())
+
+    print 'resources: %d, revisions: %d, stored bytes: %d' % (len(history),
+        sum(map(len, history)), current or 0)
+    print
+    print '%-16s %14s %18s' % ('policy', 'bytes', 'avg. latency ms')
+
+    for spec in args.policies:
+        size, latency = measure(history, repo.mode, LAYOUTS[repo.layout],
+            policy.load(spec))
+        print '%-16s %14d %18.3f' % (spec, size, latency * 1000.0)
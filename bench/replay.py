@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Compare the peak memory and run time of restoring the state of a resource
+# from a delta chain, and of computing the delta to a new state, with sets of
+# statements held in memory (`reconstruct`) against sorted streams merged as
+# the blobs are decompressed (`replay` and `diff`). The chain consists of a
+# snapshot followed by deltas each changing 1% of the statements. Each
+# measurement runs in a forked process of its own (see `bench/stream.py`).
+# Run from the project root, e.g.:
+#
+# python bench/replay.py --deltas 10 10000 1000000 5000000
+
+import argparse
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from revision import compress_lines, diff, reconstruct, replay, snapshot
+
+from stream import measure
+
+def stmt(i):
+    return ('<http://example.org/r%d> <http://example.org/p%d> '
+        '"value %d" .' % (i // 20, i % 20, i))
+
+def chain(count, deltas):
+    """Return the blobs of a delta chain of a resource with `count`
+    statements and its next state (sorted)."""
+    stmts = sorted(stmt(i) for i in xrange(count))
+    blobs = [snapshot(stmts)]
+    changed = max(1, count // 100)
+
+    for n in xrange(deltas + 1):
+        # Replace the statements at every 100th position
+        new = list(stmts)
+        for i in xrange(0, count, count // changed):
+            new[i] = stmt(count * (n + 1) + i)
+        new.sort()
+        if n < deltas:
+            blobs.append(diff(stmts, new))
+        stmts = new
+
+    return blobs, stmts
+
+def restore_set(blobs, new):
+    return len(reconstruct(blobs))
+
+def restore_stream(blobs, new):
+    return sum(len(chunk) for chunk in replay(blobs))
+
+def diff_set(blobs, new):
+    prev, stmts = reconstruct(blobs), set(new)
+    return len(compress_lines(itertools.chain(
+        ('D ' + s for s in prev - stmts),
+        ('A ' + s for s in stmts - prev))))
+
+def diff_stream(blobs, new):
+    return len(diff(replay(blobs), new))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('counts', type=int, nargs='*',
+        default=[10000, 1000000], help='statements per resource')
+    parser.add_argument('--deltas', type=int, default=10,
+        help='deltas following the snapshot')
+    args = parser.parse_args()
+
+    print '%10s %16s %10s %12s' % ('statements', 'operation', 'seconds',
+        'peak MiB')
+
+    for count in args.counts:
+        blobs, new = chain(count, args.deltas)
+
+        for name, fn in (('restore (set)', restore_set),
+                         ('restore (stream)', restore_stream),
+                         ('diff (set)', diff_set),
+                         ('diff (stream)', diff_stream)):
+            t, peak = measure(lambda _: fn(blobs, new), None)
+            print '%10d %16s %10.2f %12.1f' % (count, name, t,
+                peak / 1024.0**2)
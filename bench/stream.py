@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Compare the peak memory of processing a pushed resource state from a
+# buffered request body (the whole body in memory, parsed from a string and
+# compressed from one joined string) against a streamed one (spooled to a
+# temporary file, parsed from the file and compressed incrementally). Each
+# measurement runs in a forked process of its own. Run from the project
+# root, e.g.:
+#
+# python bench/stream.py 10000 1000000 10000000
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from revision import Spool, parse, compress, compress_lines, join
+
+CHUNK_SIZE = 64 * 1024 # bytes per chunk, as passed to `data_received`
+
+def generate(count):
+    f = tempfile.NamedTemporaryFile(prefix='tailr-bench-')
+    for i in xrange(count):
+        f.write('<http://example.org/r%d> <http://example.org/p%d> '
+            '"value %d" .\n' % (i // 20, i % 20, i))
+    f.flush()
+    return f
+
+def buffered(path):
+    body = open(path).read()
+    stmts = parse(body, 'application/n-triples')
+    return len(compress(join(stmts, '\n')))
+
+def streamed(path):
+    body = Spool()
+    with open(path) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            body.write(chunk)
+    stmts = parse(body, 'application/n-triples')
+    size = len(compress_lines(stmts))
+    body.close()
+    return size
+
+def measure(fn, path):
+    # Returns the run time and the growth of the peak resident set size
+    # (in bytes) of a forked process running `fn(path)`.
+    r, w = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(r)
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t = time.time()
+        fn(path)
+        t = time.time() - t
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(w, '%f %d' % (t, (peak - base) * 1024))
+        os._exit(0)
+
+    os.close(w)
+    out = os.read(r, 1024)
+    os.close(r)
+    os.waitpid(pid, 0)
+
+    t, peak = out.split()
+    return float(t), int(peak)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('counts', type=int, nargs='*',
+        default=[10000, 1000000, 10000000], help='statements per resource')
+    args = parser.parse_args()
+
+    print '%10s %10s %10s %10s %12s' % ('statements', 'body MiB', 'mode',
+        'seconds', 'peak MiB')
+
+    for count in args.counts:
+        f = generate(count)
+        size = os.path.getsize(f.name) / 1024.0**2
+
+        for name, fn in (('buffered', buffered), ('streamed', streamed)):
+            t, peak = measure(fn, f.name)
+            print '%10d %10.1f %10s %10.2f %12.1f' % (count, size, name, t,
+                peak / 1024.0**2)
+
+        f.close()
@@ -0,0 +1,288 @@
+import errno
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+class Blobstore(object):
+    """Content-addressed blob store on local disk.
+
+    Blobs are addressed by the SHA-1 digest of their data. The digest selects
+    one of the configured `nodes` (root directories, e.g. one per disk) and a
+    shard directory within it. Each shard holds a number of append-only pack
+    files with the blob data and an append-only index mapping digests to
+    their location in the packs:
+
+        <node>/<shard>/index
+        <node>/<shard>/pack-000000
+        <node>/<shard>/pack-000001
+        ...
+
+    Pack files are memory-mapped for reading. Writes are serialized per shard
+    with a file lock, so several processes can share the same store. Blobs
+    are immutable and identical blobs are only stored once, so they are not
+    removed as they are written: blobs no longer referenced (e.g. snapshots
+    replaced by backward deltas, blobs of rolled back transactions) are only
+    removed by `compact`, while the application is stopped.
+    """
+
+    # Index record: digest, pack number, offset, length
+    RECORD = struct.Struct(">20sIQI")
+
+    def __init__(self, nodes, shards=256, packsize=1024**3, sync=False):
+        if not nodes:
+            raise ValueError("no blob store nodes configured")
+        self.nodes = nodes
+        self.nshards = shards
+        self.packsize = packsize
+        self.sync = sync
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def put(self, data):
+        """Store `data` and return its digest."""
+        digest = hashlib.sha1(data).digest()
+        self._shard(digest).put(digest, data)
+        return digest
+
+    def get(self, digest):
+        """Return the data stored for `digest`, raise `KeyError` if missing."""
+        return self._shard(digest).get(digest)
+
+    def __contains__(self, digest):
+        return self._shard(digest).find(digest) is not None
+
+    def compact(self, live):
+        """Remove all blobs but those with the digests in the set `live`
+        from the store, rewriting the packs of the shards holding any other
+        blobs, and return the number and size of the blobs removed.
+
+        Processes holding the store open (e.g. the application) must be
+        stopped meanwhile: the locations of the kept blobs change."""
+        count = size = 0
+        for node in xrange(len(self.nodes)):
+            for shard in xrange(self.nshards):
+                path = os.path.join(self.nodes[node], "%03x" % shard)
+                if os.path.isdir(path):
+                    n, s = self._open(node, shard).compact(live)
+                    count += n
+                    size += s
+        return count, size
+
+    def close(self):
+        with self._lock:
+            for shard in self._shards.itervalues():
+                shard.close()
+            self._shards.clear()
+
+    def _shard(self, digest):
+        n = struct.unpack(">I", digest[:4])[0]
+        return self._open(n % len(self.nodes),
+            (n // len(self.nodes)) % self.nshards)
+
+    def _open(self, node, shard):
+        key = (node, shard)
+        try:
+            return self._shards[key]
+        except KeyError:
+            with self._lock:
+                if key not in self._shards:
+                    path = os.path.join(self.nodes[node], "%03x" % shard)
+                    self._shards[key] = Shard(path, self.RECORD,
+                        self.packsize, self.sync)
+                return self._shards[key]
+
+class Shard(object):
+    """A directory with pack files and their index (see `Blobstore`)."""
+
+    def __init__(self, path, record, packsize, sync):
+        self.path = path
+        self.record = record
+        self.packsize = packsize
+        self.sync = sync
+        self._index = {} # digest -> (pack, offset, length)
+        self._indexed = 0 # bytes of the index file read so far
+        self._pack = 0 # current pack number
+        self._maps = {} # pack -> mmap
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def find(self, digest):
+        with self._lock:
+            if digest not in self._index:
+                self._refresh()
+            return self._index.get(digest)
+
+    def get(self, digest):
+        loc = self.find(digest)
+        if loc is None:
+            raise KeyError(digest.encode("hex"))
+        pack, offset, length = loc
+        with self._lock:
+            m = self._map(pack, offset + length)
+            return m[offset:offset + length]
+
+    def put(self, digest, data):
+        if self.find(digest) is not None:
+            return
+
+        with open(self._file("lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with self._lock:
+                    # Another process may have stored the blob meanwhile
+                    self._refresh()
+                    if digest in self._index:
+                        return
+                    self._append(digest, data)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def compact(self, live):
+        # Copy the blobs in `live` to new packs, numbered after the current
+        # one, and switch to them by replacing the index, then remove the
+        # packs not referenced anymore (also those left by an interrupted
+        # compaction). Return the number and size of the blobs removed.
+        with open(self._file("lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with self._lock:
+                    self._refresh()
+                    dead = [loc for digest, loc in self._index.iteritems()
+                        if digest not in live]
+                    if dead:
+                        self._rewrite(live)
+                    self._prune()
+                    return len(dead), sum(loc[2] for loc in dead)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def close(self):
+        with self._lock:
+            for m in self._maps.itervalues():
+                m.close()
+            self._maps.clear()
+
+    def _append(self, digest, data):
+        pack = self._pack
+
+        try:
+            size = os.path.getsize(self._file("pack-%06d" % pack))
+        except OSError:
+            size = 0
+
+        if size > 0 and size + len(data) > self.packsize:
+            pack += 1
+
+        with open(self._file("pack-%06d" % pack), "ab") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+
+        rec = self.record.pack(digest, pack, offset, len(data))
+
+        with open(self._file("index"), "ab") as f:
+            # Drop a partially written record (see `_refresh`) left by a
+            # writer that crashed, which would misalign all later ones
+            f.truncate(self._indexed)
+            f.write(rec)
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+
+        self._index[digest] = (pack, offset, len(data))
+        self._indexed += len(rec)
+        self._pack = pack
+
+    def _rewrite(self, live):
+        kept = sorted((loc, digest) for digest, loc in self._index.iteritems()
+            if digest in live)
+        index, first = {}, self._pack + 1
+        pack, f = first, None
+
+        with open(self._file("index.new"), "wb") as idx:
+            for (old, offset, length), digest in kept:
+                if f is None or (f.tell() > 0 and
+                        f.tell() + length > self.packsize):
+                    if f is not None:
+                        self._close(f)
+                        pack += 1
+                    f = open(self._file("pack-%06d" % pack), "wb")
+                m = self._map(old, offset + length)
+                index[digest] = (pack, f.tell(), length)
+                idx.write(self.record.pack(digest, pack, f.tell(), length))
+                f.write(m[offset:offset + length])
+            if f is not None:
+                self._close(f)
+            self._close(idx)
+
+        os.rename(self._file("index.new"), self._file("index"))
+
+        for m in self._maps.itervalues():
+            m.close()
+        self._maps.clear()
+        self._index = index
+        self._indexed = len(index) * self.record.size
+        self._pack = index and pack or first
+
+    def _prune(self):
+        # Remove the packs holding no blobs, but the current one
+        used = set(loc[0] for loc in self._index.itervalues())
+        for name in os.listdir(self.path):
+            if name.startswith("pack-"):
+                pack = int(name[len("pack-"):])
+                if pack != self._pack and pack not in used:
+                    m = self._maps.pop(pack, None)
+                    if m is not None:
+                        m.close()
+                    os.remove(self._file(name))
+
+    def _close(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def _refresh(self):
+        # Read index records appended since the last refresh
+        try:
+            with open(self._file("index"), "rb") as f:
+                f.seek(self._indexed)
+                buf = f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+
+        size = self.record.size
+        end = len(buf) - len(buf) % size # ignore partially written records
+
+        for i in xrange(0, end, size):
+            digest, pack, offset, length = self.record.unpack_from(buf, i)
+            self._index[digest] = (pack, offset, length)
+            self._pack = max(self._pack, pack)
+
+        self._indexed += end
+
+    def _map(self, pack, end):
+        m = self._maps.get(pack)
+        if m is None or len(m) < end:
+            # (Re-)map the pack file, which may have grown since
+            if m is not None:
+                m.close()
+            with open(self._file("pack-%06d" % pack), "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[pack] = m
+        return m
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
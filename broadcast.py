@@ -0,0 +1,99 @@
+import errno
+import os
+import socket
+
+import tornado.ioloop
+
+from tornado.log import gen_log
+
+class Broadcast(object):
+    """Delivers short messages to all processes of the application, e.g. to
+    invalidate cache entries in every worker process.
+
+    Each process binds a unix datagram socket of its own in the directory
+    `path` (created by the master process before forking the workers) and
+    `publish` sends a message to the sockets of all other processes. The
+    functions registered with `subscribe` are called on the IOLoop for every
+    message, including the ones published by the process itself. Without a
+    `path` (a single process), messages are only delivered locally.
+
+    Delivery is best effort: messages for processes whose socket buffer is
+    full are dropped, so cached entries must expire eventually.
+    """
+
+    # Maximum size of a message in bytes
+    MAX_SIZE = 4096
+
+    def __init__(self, path=None):
+        self.path = path
+        self.subscribers = []
+        self.sock = None
+
+        if path is not None:
+            self.name = os.path.join(path, "%d.sock" % os.getpid())
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+            self.sock.bind(self.name)
+
+            tornado.ioloop.IOLoop.current().add_handler(self.sock.fileno(),
+                self._receive, tornado.ioloop.IOLoop.READ)
+
+    def subscribe(self, fn):
+        """Call `fn(message)` for every message received."""
+        self.subscribers.append(fn)
+
+    def publish(self, message):
+        """Deliver `message` to all processes (must be called on the IOLoop
+        thread)."""
+        if isinstance(message, unicode):
+            message = message.encode("utf-8")
+
+        self._deliver(message)
+
+        if self.sock is None:
+            return
+
+        for name in os.listdir(self.path):
+            name = os.path.join(self.path, name)
+            if name == self.name:
+                continue
+            try:
+                self.sock.sendto(message, name)
+            except socket.error as e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # Left behind by a process that was killed
+                    try:
+                        os.unlink(name)
+                    except OSError:
+                        pass
+                elif e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    gen_log.warning("broadcast to %s dropped", name)
+                else:
+                    raise
+
+    def close(self):
+        if self.sock is not None:
+            tornado.ioloop.IOLoop.current().remove_handler(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.name)
+            except OSError:
+                pass
+
+    def _receive(self, fd, events):
+        while True:
+            try:
+                message = self.sock.recv(self.MAX_SIZE)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self._deliver(message)
+
+    def _deliver(self, message):
+        for fn in self.subscribers:
+            try:
+                fn(message)
+            except Exception:
+                gen_log.exception("broadcast message %r failed", message)
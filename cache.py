@@ -0,0 +1,196 @@
+import collections
+import sys
+import threading
+import time
+
+class StateCache(object):
+    """Bounded LRU cache of reconstructed resource states.
+
+    Entries are keyed by `(repo id, hkey sha, head changeset time)` and hold
+    the resource state - a frozenset of statements - as it was at that head.
+    Since a key already pins down the exact revision, entries never become
+    stale; invalidation only serves to free memory for superseded states.
+
+    The size of each entry is estimated from the memory taken up by its
+    statements and the total size is kept below `maxsize` bytes by evicting
+    the least recently used entries.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict() # key -> (stmts, size)
+        self._heads = {} # (repo id, sha) -> set of cached head times
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, repo, sha, time):
+        key = (repo, sha, time)
+        with self._lock:
+            try:
+                entry = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[key] = entry # most recently used
+            self.hits += 1
+            return entry[0]
+
+    def put(self, repo, sha, time, stmts):
+        stmts = frozenset(stmts)
+        size = sizeof(stmts)
+
+        if size > self.maxsize:
+            return stmts
+
+        key = (repo, sha, time)
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (stmts, size)
+            self._heads.setdefault((repo, sha), set()).add(time)
+            self.size += size
+
+            while self.size > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+        return stmts
+
+    def extend(self, repo, sha, time, stmts):
+        """Cache the state of a new head, dropping the superseded ones."""
+        self.invalidate(repo, sha)
+        return self.put(repo, sha, time, stmts)
+
+    def invalidate(self, repo, sha):
+        """Remove all cached states for the given resource."""
+        with self._lock:
+            for ts in list(self._heads.get((repo, sha), ())):
+                self._remove((repo, sha, ts))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._heads.clear()
+            self.size = 0
+
+    def stats(self):
+        return dict(
+            entries=len(self._entries),
+            size=self.size,
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+            times = self._heads[key[:2]]
+            times.discard(key[2])
+            if not times:
+                del self._heads[key[:2]]
+
+def sizeof(stmts):
+    """Estimate the memory taken up by a set of statements in bytes."""
+    return sys.getsizeof(stmts) + sum(sys.getsizeof(s) for s in stmts)
+
+class TTLCache(object):
+    """Cache of entries expiring after `ttl` seconds (caching is disabled
+    for a `ttl` of 0), used for the users of API tokens and for repository
+    names, with entries grouped by the id of the user owning them.
+
+    Entries are dropped explicitly when they change, e.g. when a token is
+    deleted or a user is renamed, see `invalidate` and `invalidate_owner`;
+    the TTL only bounds how long a change can go unnoticed if an
+    invalidation is lost. Lookups in the database started before an
+    invalidation are not cached, see `generation`.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+        self.qtime = 0.0 # seconds spent in database lookups
+        self.generation = 0 # incremented by every invalidation
+        self._entries = {} # key -> (value, owner, expiry time)
+        self._owned = {} # owner -> set of cached keys
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.time():
+                if entry is not None:
+                    self._remove(key) # expired
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, owner, generation):
+        """Cache `value` for `key`, unless there were any invalidations
+        since the lookup began (at `generation`)."""
+        with self._lock:
+            if self.ttl <= 0 or generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (value, owner, time.time() + self.ttl)
+            self._owned.setdefault(owner, set()).add(key)
+
+    def query(self, seconds):
+        """Account for a database lookup taking `seconds`."""
+        with self._lock:
+            self.queries += 1
+            self.qtime += seconds
+
+    def invalidate(self, key):
+        """Remove the entry for `key`."""
+        with self._lock:
+            self.generation += 1
+            self._remove(key)
+
+    def invalidate_owner(self, owner):
+        """Remove all entries owned by the given user id."""
+        with self._lock:
+            self.generation += 1
+            for key in list(self._owned.get(owner, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._owned.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._entries),
+                ttl=self.ttl,
+                hits=self.hits,
+                misses=self.misses,
+                ratio=lookups and float(self.hits) / lookups or 0.0,
+                queries=self.queries,
+                qtime=self.qtime,
+            )
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._owned[entry[1]]
+            keys.discard(key)
+            if not keys:
+                del self._owned[entry[1]]
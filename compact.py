@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+# Remove the blobs no longer referenced by the database from the blob store
+# (see `Blobstore.compact`): snapshots replaced by backward deltas in
+# reverse-delta repositories, blobs rewritten by `convert.py` and those of
+# rolled back transactions. Stop the application before running it, e.g.:
+# `python compact.py`. The digests of all blobs are held in memory meanwhile
+# (about 100 bytes per blob).
+
+import sys
+
+from blobstore import Blobstore
+from database import from_url
+
+from config import dburl, bsconf
+
+def live(database):
+    # The digests of all blobs referenced by the database
+    cursor = database.execute_sql("SELECT data FROM blob")
+    return set(str(data) for data, in cursor if data is not None)
+
+if __name__ == "__main__":
+    if not bsconf["nodes"]:
+        print "no blob store configured (BLOBSTORE_PATH)"
+        sys.exit(1)
+
+    database = from_url(dburl)
+    blobstore = Blobstore(bsconf["nodes"], **bsconf["opts"])
+
+    digests = live(database)
+    count, size = blobstore.compact(digests)
+    blobstore.close()
+
+    print "%d blobs kept, %d blobs (%d bytes) removed" % (len(digests),
+        count, size)
@@ -0,0 +1,188 @@
+import io
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # optional: pip install zstandard
+
+# Compression codecs for blob data. Codecs are configured per repository with
+# a short specification string `name[:level]`, like snapshot policies, e.g.
+# "zlib:9" or "zstd:3":
+#
+# zlib:L    zlib (deflate) at level L (1-9)
+# zstd:L    Zstandard at level L (1-22)
+# dict:L    Zstandard at level L with the latest dictionary trained on the
+#           repository (see `train.py`), plain Zstandard until there is one
+#
+# Compressed data identifies its format and dictionary (if any), so blobs can
+# be decompressed regardless of the codec configured when storing them (see
+# `codec`). The format is also recorded in the `codec` column of the blobs.
+
+ZLIB = 0
+ZSTD = 1
+
+# Zstandard frames start with this magic number (zlib streams with 0x78)
+ZSTD_MAGIC = "\x28\xb5\x2f\xfd"
+
+class Codec(object):
+    """Base class for compression codecs, which implement `compressobj()`,
+    returning an object with `compress(s)` and `flush()` methods for
+    compressing data incrementally, `decompress(s)`, and
+    `decompress_chunks(s, size)`, decompressing `s` in chunks of at most
+    `size` bytes."""
+
+    def compress(self, s):
+        c = self.compressobj()
+        return c.compress(s) + c.flush()
+
+    def __repr__(self):
+        return "<%s>" % self.spec
+
+class ZlibCodec(Codec):
+    id = ZLIB
+    LEVEL = 6
+
+    def __init__(self, level=LEVEL):
+        self.level = int(level)
+        self.spec = "zlib:%d" % self.level
+
+    def compress(self, s):
+        return zlib.compress(s, self.level)
+
+    def compressobj(self):
+        return zlib.compressobj(self.level)
+
+    def decompress(self, s):
+        return zlib.decompress(s)
+
+    def decompress_chunks(self, s, size):
+        d = zlib.decompressobj()
+        while s:
+            chunk = d.decompress(s, size)
+            s = d.unconsumed_tail
+            if chunk:
+                yield chunk
+        chunk = d.flush()
+        if chunk:
+            yield chunk
+
+class ZstdCodec(Codec):
+    """Zstandard, with a trained dictionary (`ZstdCompressionDict`) or not.
+
+    Compression and decompression contexts are not safe to be shared among
+    threads, so new ones are created for every blob.
+    """
+
+    id = ZSTD
+    LEVEL = 3
+
+    def __init__(self, level=LEVEL, dictionary=None):
+        if zstandard is None:
+            raise ValueError("zstd: the zstandard module is not installed")
+        self.level = int(level)
+        self.dictionary = dictionary
+        self.spec = (dictionary and "dict:%d" or "zstd:%d") % self.level
+
+    def compressobj(self):
+        return zstandard.ZstdCompressor(level=self.level,
+            **self.options()).compressobj()
+
+    def decompress(self, s):
+        # Streamed frames do not record their size, which the one-shot
+        # decompression requires
+        return self.decompressor().decompressobj().decompress(s)
+
+    def decompress_chunks(self, s, size):
+        return self.decompressor().read_to_iter(io.BytesIO(s),
+            write_size=size)
+
+    def decompressor(self):
+        return zstandard.ZstdDecompressor(**self.options())
+
+    def options(self):
+        return self.dictionary and dict(dict_data=self.dictionary) or {}
+
+class Dictionaries(object):
+    """Trained dictionaries (see `models.Dictionary`), loaded from the
+    database on first use and kept for the lifetime of the process."""
+
+    # Seconds to remember the latest dictionary of a repository, i.e. the
+    # delay until a newly trained dictionary is used
+    TTL = 60.0
+
+    def __init__(self):
+        self._dicts = {} # id -> ZstdCompressionDict
+        self._latest = {} # repo id -> (dictionary id or None, expiry time)
+        self._lock = threading.Lock()
+
+    def get(self, id):
+        with self._lock:
+            d = self._dicts.get(id)
+        if d is None:
+            from models import Dictionary
+            data = (Dictionary
+                .select(Dictionary.data)
+                .where(Dictionary.id == id)
+                .scalar())
+            if data is None:
+                raise LookupError("unknown dictionary: %d" % id)
+            d = zstandard.ZstdCompressionDict(str(data))
+            with self._lock:
+                self._dicts[id] = d
+        return d
+
+    def latest(self, repo):
+        """Return the id of the latest dictionary of a repository (id) or
+        `None` if there is none."""
+        with self._lock:
+            entry = self._latest.get(repo)
+        if entry is None or entry[1] < time.time():
+            from models import Dictionary
+            id = (Dictionary
+                .select(Dictionary.id)
+                .where(Dictionary.repo == repo)
+                .order_by(Dictionary.time.desc(), Dictionary.id.desc())
+                .limit(1)
+                .scalar())
+            entry = (id, time.time() + self.TTL)
+            with self._lock:
+                self._latest[repo] = entry
+        return entry[0]
+
+dictionaries = Dictionaries()
+
+CODECS = dict(zlib=ZlibCodec, zstd=ZstdCodec, dict=ZstdCodec)
+
+DEFAULT = ZlibCodec() # same as zlib.compress
+
+def load(spec, repo=None):
+    """Return the codec for the given specification, e.g. "zstd:3", using
+    the latest dictionary of the repository (id) `repo` for "dict"."""
+    name, _, arg = spec.partition(":")
+
+    cls = CODECS.get(name)
+
+    if cls is None:
+        raise ValueError("invalid codec: %r" % spec)
+
+    try:
+        level = int(arg) if arg else cls.LEVEL
+    except ValueError:
+        raise ValueError("invalid codec: %r" % spec)
+
+    if name == "dict" and repo is not None:
+        id = dictionaries.latest(repo)
+        return cls(level, id and dictionaries.get(id) or None)
+    return cls(level)
+
+def codec(s):
+    """Return the codec to decompress the blob data `s` with."""
+    if s[:4] != ZSTD_MAGIC:
+        return DEFAULT
+    if zstandard is None:
+        raise RuntimeError("zstd: the zstandard module is not installed")
+    id = zstandard.get_frame_parameters(s).dict_id
+    return ZstdCodec(dictionary=id and dictionaries.get(id) or None)
@@ -2,15 +2,17 @@
 
 # Load application environment and initialize models
 
-from database import MDB as Database
+from blobstore import Blobstore
+from database import from_url
 
-from config import settings, dbconf, bsconf
+from config import settings, dburl, bsconf
 from models import *
 
 import models
 
-database = Database(**dbconf)
-blobstore = None # Blobstore(bsconf.nodes, **bsconf.opts)
+database = from_url(dburl)
+blobstore = (bsconf["nodes"] and
+    Blobstore(bsconf["nodes"], **bsconf["opts"]) or None)
 models.initialize(database, blobstore)
 
 # Drop into IPython
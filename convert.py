@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Convert a repository to another storage mode and/or layout, re-encoding
+# the changesets of all its resources, e.g.:
+# `python convert.py pmeinhardt/test reverse` or
+# `python convert.py pmeinhardt/test forward ids`
+#
+# Resources are converted one at a time, each in its own transaction. Make
+# sure the repository is not accessed while the conversion is running.
+
+import collections
+import sys
+
+from peewee import JOIN_LEFT_OUTER
+
+from blobstore import Blobstore
+from database import from_url
+
+from config import settings, dburl, bsconf
+from models import *
+
+import compression
+import models
+import policy
+import stmtdict
+
+from revision import LAYOUTS, revise, revise_reverse
+
+MODES = dict(forward=Repo.FORWARD, reverse=Repo.REVERSE)
+LAYOUT_NAMES = dict(lines=Repo.LINES, ids=Repo.IDS)
+
+Change = collections.namedtuple("Change", "time type len")
+
+def revisions(repo, sha):
+    """Return `(time, stmts)` for all revisions of a resource, ordered by time.
+
+    The statements `stmts` are `None` for deletes.
+    """
+    rows = (CSet
+        .select(CSet.time, CSet.type, Blob.data)
+        .join(Blob, JOIN_LEFT_OUTER, on=(
+            (Blob.repo == CSet.repo) &
+            (Blob.hkey == CSet.hkey) &
+            (Blob.time == CSet.time)))
+        .where((CSet.repo == repo) & (CSet.hkey == sha))
+        .order_by(CSet.time)
+        .tuples())
+
+    return decode(list(rows), repo.mode, LAYOUTS[repo.layout])
+
+def decode(rows, mode, layout):
+    """Restore all revisions from `(time, type, data)` rows in time order."""
+    revs, stmts = [], None
+
+    # Backward deltas apply to the next newer state
+    for time, cstype, data in mode == Repo.REVERSE and rows[::-1] or rows:
+        if cstype == CSet.DELETE:
+            stmts = None
+        elif cstype == CSet.SNAPSHOT:
+            stmts = layout.reconstruct([data])
+        else:
+            stmts = layout.patch(stmts, data)
+        revs.append((time, stmts))
+
+    return mode == Repo.REVERSE and revs[::-1] or revs
+
+def translate(revs, layout):
+    """Convert the states of revisions to the given layout (from the
+    other one), interning or looking up their statements."""
+    converted = []
+
+    for time, stmts in revs:
+        if stmts is not None and layout == Repo.IDS:
+            stmts = stmtdict.array(stmtdict.intern(stmts).itervalues())
+        elif stmts is not None:
+            stmts = set(stmtdict.resolve(stmts))
+        converted.append((time, stmts))
+
+    return converted
+
+def encode(revs, mode, policy, codec=compression.DEFAULT,
+           layout=LAYOUTS[Repo.LINES]):
+    """Encode revisions in the given mode as `[time, type, data]` rows."""
+    rows, chain, prev = [], [], None
+
+    for time, stmts in revs:
+        if stmts is None:
+            rows.append([time, CSet.DELETE, None])
+            chain, prev = [Change(time, CSet.DELETE, 0)], None
+            continue
+
+        if mode == Repo.FORWARD:
+            # Unchanged revisions (if any) are kept as empty deltas
+            cstype, data = (revise(chain, prev, stmts, policy, None, codec,
+                layout) or (CSet.DELTA, layout.empty(codec)))
+
+            entry = Change(time, cstype, len(data))
+            chain = cstype == CSet.DELTA and chain + [entry] or [entry]
+            rows.append([time, cstype, data])
+        else:
+            snap, back = (revise_reverse(chain, prev, stmts, policy, None,
+                codec, layout) or (layout.snapshot(stmts, codec),
+                layout.empty(codec)))
+
+            entry = Change(time, CSet.SNAPSHOT, len(snap))
+
+            if back is not None:
+                rows[-1][1:] = [CSet.DELTA, back]
+                chain = (chain[:-1] +
+                    [Change(chain[-1].time, CSet.DELTA, len(back)), entry])
+            else:
+                chain = [entry]
+
+            rows.append([time, CSet.SNAPSHOT, snap])
+
+        prev = stmts
+
+    return rows
+
+def convert(repo, mode, layout, policy, codec):
+    shas = (CSet
+        .select(CSet.hkey)
+        .where(CSet.repo == repo)
+        .distinct()
+        .tuples())
+
+    for i, (sha,) in enumerate(shas.iterator()):
+        revs = revisions(repo, sha)
+
+        if layout != repo.layout:
+            revs = translate(revs, layout)
+
+        rows = encode(revs, mode, policy, codec, LAYOUTS[layout])
+
+        changes = [row[:2] for row in rows]
+        bases = CSet.bases(changes, mode)
+        head = Head.derive(changes, mode)
+
+        with repo._meta.database.atomic():
+            Blob.delete().where((Blob.repo == repo) & (Blob.hkey == sha)).execute()
+            CSet.delete().where((CSet.repo == repo) & (CSet.hkey == sha)).execute()
+            Head.delete().where((Head.repo == repo) & (Head.hkey == sha)).execute()
+
+            for (time, cstype, data), base in zip(rows, bases):
+                if data is not None:
+                    Blob.insert(repo=repo, hkey=sha, time=time,
+                        data=data, codec=codec.id).execute()
+                CSet.insert(repo=repo, hkey=sha, time=time, type=cstype,
+                    len=data and len(data) or 0, base=base).execute()
+
+            Head.insert(repo=repo, hkey=sha, time=head[0], type=head[1],
+                base=head[2]).execute()
+
+        if (i + 1) % 1000 == 0:
+            print "%d resources converted" % (i + 1)
+
+    repo.mode = mode
+    repo.layout = layout
+    repo.save()
+
+if __name__ == "__main__":
+    if (len(sys.argv) not in (3, 4) or sys.argv[2] not in MODES or
+        "/" not in sys.argv[1] or
+        any(name not in LAYOUT_NAMES for name in sys.argv[3:])):
+        print "usage: python convert.py USER/REPO forward|reverse [lines|ids]"
+        sys.exit(1)
+
+    database = from_url(dburl)
+    blobstore = (bsconf["nodes"] and
+        Blobstore(bsconf["nodes"], **bsconf["opts"]) or None)
+    models.initialize(database, blobstore)
+
+    username, reponame = sys.argv[1].split("/", 1)
+    mode = MODES[sys.argv[2]]
+
+    repo = (Repo
+        .select()
+        .join(User)
+        .where((User.name == username) & (Repo.name == reponame))
+        .get())
+
+    layout = repo.layout
+    if len(sys.argv) == 4:
+        layout = LAYOUT_NAMES[sys.argv[3]]
+
+    if repo.mode != mode or repo.layout != layout:
+        convert(repo, mode, layout, policy.load(repo.policy or
+            settings["snapshot_policy"]), compression.load(repo.codec or
+            settings["compression"], repo.id))
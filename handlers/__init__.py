@@ -1,17 +1,95 @@
 import tornado.web
 
+from database import Queries, counting
+
+import profiling
+
 class RequestHandler(tornado.web.RequestHandler):
     """Base class for all request handlers."""
 
+    def __init__(self, application, request, **kwargs):
+        super(RequestHandler, self).__init__(application, request, **kwargs)
+        application.active += 1
+        # Profile of the request (see `profiling`), if any, and its
+        # database statements and the time spent on them (see `background`),
+        # logged with the request (see `Application`)
+        self.profile = profiling.start(application.settings, request)
+        self.queries = Queries(log=self.profile is not None)
+        self._counting = None
+        # The kind of request of handlers serving several kinds, labelling
+        # the metrics of the request (the method name otherwise)
+        self.branch = None
+
     def prepare(self):
+        # Web handlers run their queries on the IOLoop thread (a coroutine
+        # yielding to other requests meanwhile may miss some of them)
+        self._counting = counting(self.queries)
+        self._counting.__enter__()
         self.database.connect()
         super(RequestHandler, self).prepare()
 
     def on_finish(self):
+        if self._counting is not None:
+            self._counting.__exit__()
         if not self.database.is_closed():
             self.database.close()
+        self.application.active -= 1
         super(RequestHandler, self).on_finish()
 
+    def flush(self, include_footers=False, callback=None):
+        # In debug mode, the database statements run so far are reported
+        # with the headers
+        if self.settings.get("debug") and not self._headers_written:
+            self.set_header("X-DB-Queries", self.queries.count)
+            self.set_header("X-DB-Time", "%.2fms" % (self.queries.time * 1000))
+        return super(RequestHandler, self).flush(include_footers, callback)
+
+    def lap(self, name):
+        """Account the time since the previous lap to the phase `name` of
+        the request, if it is profiled (see `profiling`)."""
+        (self.profile or profiling.NOPROFILE).lap(name)
+
+    def running(self):
+        """Return a context manager starting a lap and running the profiler
+        of the request in the current thread, if it is profiled in full."""
+        return (self.profile or profiling.NOPROFILE).running()
+
+    def produce(self, iterator, name):
+        """Return a future for the next item of `iterator`, or `None` once it
+        is exhausted, produced in the worker thread pool in a lap of the
+        phase `name` (e.g. the next chunk of a response, produced as the
+        previous one is sent), to be yielded from a coroutine."""
+        return self.executor.submit(self._produce, iterator, name)
+
+    def _produce(self, iterator, name):
+        with self.running():
+            item = next(iterator, None)
+            self.lap(name)
+            return item
+
     @property
     def database(self):
         return self.application.database
+
+    @property
+    def executor(self):
+        return self.application.executor
+
+    def background(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` in the worker thread pool and return a
+        future for its result, to be yielded from a coroutine.
+
+        Connections are per thread: the call gets a connection from the
+        pool for its duration, so a transaction can not span several calls.
+        """
+        return self.executor.submit(self._background, fn, *args, **kwargs)
+
+    def _background(self, fn, *args, **kwargs):
+        with counting(self.queries), self.running():
+            self.database.connect()
+            self.lap("connect")
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if not self.database.is_closed():
+                    self.database.close()
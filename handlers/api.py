@@ -1,17 +1,27 @@
+import calendar
 import datetime
+import email.utils
 import functools
-import hashlib
-import string
+import itertools
 import time
-import zlib
+
+import tornado.gen
+import tornado.iostream
+import tornado.web
 
 from tornado.web import HTTPError
 from tornado.escape import url_escape, json_encode
-from peewee import IntegrityError, SQL, fn
-import RDF
+from peewee import IntegrityError
 
-from models import User, Token, Repo, HMap, CSet, Blob
+from models import User, Token, Repo, CSet
 from handlers import RequestHandler
+from revision import Spool, parse, parse_graphs, shasum, chunked, joined
+from revision import content, replay, measured, revise, revise_reverse
+from revision import LINES, IDS, LAYOUTS
+
+import compression
+import policy
+import stmtdict
 
 def authenticated(method):
     """Decorate API methods to require user authentication via token."""
@@ -32,82 +42,225 @@ def date(s, fmt):
     return datetime.datetime.strptime(s, fmt)
 
 def now():
-    return datetime.datetime.utcnow()
+    # Times are stored with a precision of seconds
+    return datetime.datetime.utcnow().replace(microsecond=0)
+
+# Metric labels of changeset types, by `CSet.type`
+CSTYPES = ("snapshot", "delta", "delete")
 
 # Pagination size for indexes (number of resource URIs per page)
 INDEX_PAGE_SIZE = 1000
 
-# This factor (among others) determines whether a snapshot is stored rather
-# than a delta, depending on the size of the latest snapshot and subsequent
-# deltas. For the latest snapshot `base` and deltas `d1`, `d2`, ..., `dn`
-# a new snapshot is definitely stored if:
-#
-# `SNAPF * len(base) <= len(d1) + len(d2) + ... + len(dn)`
-#
-# In short, larger values will result in longer delta chains and likely reduce
-# storage size at the expense of higher revision reconstruction costs.
-#
-# TODO: Empirically determine a good value with real data/statistics.
-SNAPF = 10.0
-
-# TODO: Tune zlib compression parameters `level`, `wbits`, `bufsize`?
-
-def compress(s):
-    return zlib.compress(s)
-
-def decompress(s):
-    return zlib.decompress(s)
-
-def shasum(s):
-    return hashlib.sha1(s).digest()
-
-# Parse serialized RDF:
-#
-# RDF/XML:      application/rdf+xml
-# N-Triples:    application/n-triples
-# Turtle:       text/turtle
-def parse(s, fmt):
-    stmts = set()
-    parser = RDF.Parser(mime_type=fmt)
-    for st in parser.parse_string_as_stream(s, "urn:x-default:tailr"):
-        stmts.add(str(st) + " .")
-    return stmts
-
-def join(parts, sep):
-    return string.joinfields(parts, sep)
+# Memento responses are written and flushed in chunks of this many
+# statements (or bytes, for a snapshot streamed as it is decompressed), each
+# produced in a worker thread (large enough for the hand-over to be cheap)
+RESPONSE_CHUNK_LINES = 4000
+RESPONSE_CHUNK_SIZE = 256 * 1024
+
+# Mementos of statement lines restored from delta chains with a base snapshot
+# of up to this many (compressed) bytes are restored in memory and cached,
+# those of larger ones are replayed as they are sent
+STREAM_SIZE = 1024**2
+
+# Cache-Control of mementos requested by a `datetime` in the query string
+# whose revision is final (see `Storage.chain`): they never change. Caches
+# have to revalidate all other mementos (see `fresh`).
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+def etag(repo, sha, time):
+    # The entity tag of the memento of a revision, from its resource and
+    # time. It is weak, as the statements of the same state may be sent in
+    # a different order (e.g. from the cache).
+    return 'W/"%d-%s-%d"' % (repo.id, sha.encode("hex"),
+        calendar.timegm(time.timetuple()))
 
 class BaseHandler(RequestHandler):
-    """Base class for all web API handlers."""
+    """Base class for all web API handlers.
+
+    API handlers are coroutines: database queries, RDF parsing and delta
+    replay run in the worker thread pool (see `background`), keeping the
+    IOLoop free to serve other requests in the meantime.
+    """
+
+    def initialize(self):
+        # Request bodies are streamed into a spool (see `data_received`)
+        self.body = Spool()
+
+    @tornado.gen.coroutine
+    def prepare(self):
+        if self.request.method == "PUT":
+            self.request.connection.set_max_body_size(
+                self.settings["max_body_size"])
+
+        # No database connection for the IOLoop thread; look up the user
+        # (unless cached) in a worker thread before `authenticated` asks
+        # for it.
+        value = self.token()
+        if value is not None:
+            user = self.tokencache.get(value)
+            if user is None:
+                user = yield self.background(self.authenticate, value)
+            self.current_user = user
+
+        if self.request.method in ("PUT", "DELETE"):
+            # Only the owner of a repository writes to it: others are
+            # rejected before any request body is received (see
+            # `data_received`).
+            if not self.current_user:
+                raise HTTPError(401)
+            if self.path_args[0] != self.current_user.name:
+                raise HTTPError(403)
+
+    def data_received(self, chunk):
+        self.body.write(chunk)
+
+    def on_finish(self):
+        self.body.close()
+        super(BaseHandler, self).on_finish()
 
     def get_current_user(self):
+        # Users of requests with a token are looked up by `prepare`
+        return None
+
+    def token(self):
+        # Return the API token given as "Authorization: token VALUE"
         try:
-            header = self.request.headers["Authorization"]
-            method, value = header.split(" ")
-            if method == "token":
-                user = User.select().join(Token).where(Token.value == value)
-                return user.get()
-            else:
-                return None
-        except (KeyError, ValueError, User.DoesNotExist):
+            method, value = self.request.headers["Authorization"].split(" ")
+        except (KeyError, ValueError):
             return None
+        return method == "token" and value or None
+
+    def authenticate(self, value):
+        # Return the user owning the token `value` or `None`, caching it
+        generation = self.tokencache.generation
+        t = time.time()
+        try:
+            user = User.select().join(Token).where(Token.value == value).get()
+        except User.DoesNotExist:
+            user = None
+        self.tokencache.query(time.time() - t)
+        if user is not None:
+            self.tokencache.put(value, user, user.id, generation)
+        return user
 
     def check_xsrf_cookie(self):
         pass
 
+    @property
+    def engine(self):
+        return self.application.engine
+
+    @property
+    def statecache(self):
+        return self.application.statecache
+
+    @property
+    def tokencache(self):
+        return self.application.tokencache
+
+    @property
+    def repocache(self):
+        return self.application.repocache
+
+    @property
+    def stats(self):
+        return self.application.stats
+
+    @property
+    def metrics(self):
+        return self.application.metrics
+
+    def fresh(self, tag, modified):
+        """Return whether the client has the response with the entity tag
+        `tag` and last modification time `modified` already, according to
+        the "If-None-Match" or (without one) "If-Modified-Since" header."""
+        headers = self.request.headers
+        if "If-None-Match" in headers:
+            tags = [t.strip() for t in headers["If-None-Match"].split(",")]
+            # Weak comparison
+            return "*" in tags or tag[2:] in [
+                t.startswith("W/") and t[2:] or t for t in tags]
+        since = email.utils.parsedate(headers.get("If-Modified-Since", ""))
+        return since is not None and datetime.datetime(*since[:6]) >= modified
+
+    def snapshot_policy(self, repo):
+        return policy.load(repo.policy or self.settings["snapshot_policy"])
+
+    def codec(self, repo):
+        # The codec for new blobs, which may load the dictionary of the
+        # repository from the database (not on the IOLoop thread)
+        return compression.load(repo.codec or self.settings["compression"],
+            repo.id)
+
+    def layout(self, repo):
+        return LAYOUTS[repo.layout]
+
+    def restore(self, repo, layout, data):
+        # Restore a state from the blob data of its delta chain, recording
+        # the time taken. States of statement lines are replayed in sorted
+        # chunks as they are consumed (see `replay`), those of ids at once.
+        self.metrics.decompressed(sum(map(len, data)))
+        t = time.time()
+        if layout is IDS:
+            ids = layout.reconstruct(data)
+            self.stats.reconstruction(repo.id, time.time() - t, data)
+            return ids
+        chunks = replay(data)
+        started = time.time() - t
+        return measured(chunks, lambda seconds:
+            self.stats.reconstruction(repo.id, started + seconds, data))
+
+    @tornado.gen.coroutine
+    def resolve(self, username, reponame):
+        # Return the repository `username/reponame` (see `lookup`), from
+        # the cache if possible
+        repo = self.repocache.get((username, reponame))
+        if repo is None:
+            repo = yield self.background(self.lookup, username, reponame)
+        raise tornado.gen.Return(repo)
+
+    def lookup(self, username, reponame):
+        # Only existing repositories are cached, so creating one needs no
+        # invalidation; renaming a user drops those of the user.
+        generation = self.repocache.generation
+        t = time.time()
+        try:
+            repo = (Repo
+                .select(Repo.id, Repo.user, Repo.mode, Repo.policy,
+                    Repo.codec, Repo.layout)
+                .join(User)
+                .where((User.name == username) & (Repo.name == reponame))
+                .naive()
+                .get())
+        except Repo.DoesNotExist:
+            raise HTTPError(404)
+        finally:
+            self.repocache.query(time.time() - t)
+        self.repocache.put((username, reponame), repo, repo.user_id,
+            generation)
+        return repo
+
+@tornado.web.stream_request_body
 class RepoHandler(BaseHandler):
     """Processes repository calls: Push, timegate, memento, timemap etc."""
 
     # def head(self, username, reponame):
     #     pass
 
+    @tornado.gen.coroutine
     def get(self, username, reponame):
         timemap = self.get_query_argument("timemap", "false") == "true"
         index = self.get_query_argument("index", "false") == "true"
+        stats = self.get_query_argument("stats", "false") == "true"
         key = self.get_query_argument("key", None)
 
         if (index and timemap) or (index and key) or (timemap and not key):
             raise HTTPError(400)
 
+        if stats and (index or timemap or key):
+            raise HTTPError(400)
+
         if self.get_query_argument("datetime", None):
             datestr = self.get_query_argument("datetime")
             ts = date(datestr, QSDATEFMT)
@@ -116,18 +269,12 @@ class RepoHandler(BaseHandler):
             ts = date(datestr, RFC1123DATEFMT)
         else:
             ts = now()
+            datestr = None
 
-        try:
-            repo = (Repo
-                .select(Repo.id)
-                .join(User)
-                .where((User.name == username) & (Repo.name == reponame))
-                .naive()
-                .get())
-        except Repo.DoesNotExist:
-            raise HTTPError(404)
+        repo = yield self.resolve(username, reponame)
 
         if key and not timemap:
+            self.branch = "memento"
             # Recreate the resource for the given key in its latest state -
             # if no `datetime` was provided - or in the state it was in at
             # the time indicated by the passed `datetime` argument.
@@ -137,28 +284,8 @@ class RepoHandler(BaseHandler):
 
             sha = shasum(key.encode("utf-8"))
 
-            # Fetch all relevant changes from the last "non-delta" onwards,
-            # ordered by time. The returned delta-chain consists of either:
-            # a snapshot followed by 0 or more deltas, or
-            # a single delete.
-            chain = list(CSet
-                .select(CSet.time, CSet.type)
-                .where(
-                    (CSet.repo == repo) &
-                    (CSet.hkey == sha) &
-                    (CSet.time <= ts) &
-                    (CSet.time >= SQL(
-                        "COALESCE((SELECT time FROM cset "
-                        "WHERE repo_id = %s "
-                        "AND hkey_id = %s "
-                        "AND time <= %s "
-                        "AND type != %s "
-                        "ORDER BY time DESC "
-                        "LIMIT 1), 0)",
-                        repo.id, sha, ts, CSet.DELTA
-                    )))
-                .order_by(CSet.time)
-                .naive())
+            chain, final, chunks = yield self.background(self.memento, repo,
+                sha, ts)
 
             if len(chain) == 0:
                 # A resource does not exist for the given key.
@@ -183,62 +310,53 @@ class RepoHandler(BaseHandler):
                 # appropriate "Link" and "Memento-Datetime" headers.
                 raise HTTPError(404)
 
-            # Load the data required in order to restore the resource state.
-            blobs = (Blob
-                .select(Blob.data)
-                .where(
-                    (Blob.repo == repo) &
-                    (Blob.hkey == sha) &
-                    (Blob.time << map(lambda e: e.time, chain)))
-                .order_by(Blob.time)
-                .naive())
-
-            if len(chain) == 1:
-                # Special case, where we can simply return
-                # the blob data of the snapshot.
-                snap = blobs.first().data
-                return self.finish(decompress(snap))
-
-            stmts = set()
-
-            for i, blob in enumerate(blobs.iterator()):
-                data = decompress(blob.data)
-
-                if i == 0:
-                    # Base snapshot for the delta chain
-                    stmts.update(data.splitlines())
-                else:
-                    for line in data.splitlines():
-                        mode, stmt = line[0], line[2:]
-                        if mode == "A":
-                            stmts.add(stmt)
-                        else:
-                            stmts.discard(stmt)
-
-            self.write(join(stmts, "\n"))
+            head = chain[-1].time
+
+            self.set_header("ETag", etag(repo, sha, head))
+            self.set_header("Last-Modified", head.strftime(RFC1123DATEFMT))
+
+            # Only the URIs of mementos with a `datetime` identify a
+            # revision, the others are negotiated by "Accept-Datetime".
+            pinned = self.get_query_argument("datetime", None) is not None
+            self.set_header("Cache-Control",
+                pinned and final and IMMUTABLE or REVALIDATE)
+
+            if chunks is None:
+                # The client has the state already (see `memento`)
+                self.set_status(304)
+                return
+
+            # Write the state as it is produced, waiting for each chunk
+            # to be sent before producing the next one in a worker thread
+            # (decompressing and merging blobs, or serializing statements).
+            chunks = iter(chunks)
+            try:
+                while True:
+                    chunk = yield self.produce(chunks, "stream")
+                    if chunk is None:
+                        break
+                    self.write(chunk)
+                    yield self.flush()
+            except tornado.iostream.StreamClosedError:
+                pass # client went away
         elif key and timemap:
+            self.branch = "timemap"
             # Generate a timemap containing historic change information
             # for the requested key. The timemap is in the default link-format
             # or as JSON (http://mementoweb.org/guide/timemap-json/).
 
             sha = shasum(key.encode("utf-8"))
 
-            csets = (CSet
-                .select(CSet.time)
-                .where((CSet.repo == repo) & (CSet.hkey == sha))
-                .order_by(CSet.time.desc())
-                .naive())
-
             # TODO: Paginate?
 
-            csit = csets.iterator()
+            times = yield self.background(self.timemap, repo, sha)
 
-            try:
-                first = csit.next()
-            except StopIteration:
+            if len(times) == 0:
                 # Resource for given key does not exist.
                 raise HTTPError(404)
 
+            first, rest = times[0], times[1:]
+
             req = self.request
             base = req.protocol + "://" + req.host + req.path
 
@@ -254,12 +372,12 @@ class RepoHandler(BaseHandler):
                     url_escape(key) +
                     '&datetime={1}"}}')
 
-                self.write(m.format(first.time.isoformat(),
-                    first.time.strftime(QSDATEFMT)))
+                self.write(m.format(first.isoformat(),
+                    first.strftime(QSDATEFMT)))
 
-                for cs in csit:
-                    self.write(', ' + m.format(cs.time.isoformat(),
-                        cs.time.strftime(QSDATEFMT)))
+                for t in rest:
+                    self.write(', ' + m.format(t.isoformat(),
+                        t.strftime(QSDATEFMT)))
 
                 self.write(']}')
                 self.write('}')
@@ -273,51 +391,80 @@ class RepoHandler(BaseHandler):
                 self.set_header("Content-Type", "application/link-format")
 
                 self.write('<' + key + '>; rel="original"')
-                self.write(m.format(first.time.strftime(QSDATEFMT),
-                    first.time.strftime(RFC1123DATEFMT)))
+                self.write(m.format(first.strftime(QSDATEFMT),
+                    first.strftime(RFC1123DATEFMT)))
 
-                for cs in csit:
-                    self.write(m.format(cs.time.strftime(QSDATEFMT),
-                        cs.time.strftime(RFC1123DATEFMT)))
+                for t in rest:
+                    self.write(m.format(t.strftime(QSDATEFMT),
+                        t.strftime(RFC1123DATEFMT)))
         elif index:
+            self.branch = "index"
             # Generate an index of all URIs contained in the dataset at the
             # provided point in time or in its current state.
 
             self.set_header("Vary", "accept-datetime")
             self.set_header("Content-Type", "text/plain")
 
+            # Pages follow the opaque cursor `after` (the hash of the last
+            # key on the previous page). Numbered pages are still supported,
+            # but cost more the further they are into the index.
             page = int(self.get_query_argument("page", "1"))
-
-            # Subquery for selecting max. time per hkey group
-            mx = (CSet
-                .select(CSet.hkey, fn.Max(CSet.time).alias("maxtime"))
-                .where((CSet.repo == repo) & (CSet.time <= ts))
-                .group_by(CSet.hkey)
-                .order_by(CSet.hkey)
-                .paginate(page, INDEX_PAGE_SIZE)
-                .alias("mx"))
-
-            # Query for all the relevant csets (those with max. time values)
-            cs = (CSet
-                .select(CSet.hkey, CSet.time)
-                .join(mx, on=(
-                    (CSet.hkey == mx.c.hkey_id) &
-                    (CSet.time == mx.c.maxtime)))
-                .where((CSet.repo == repo) & (CSet.type != CSet.DELETE))
-                .alias("cs"))
-
-            # Join with the hmap table to retrieve the plain key values
-            hm = (HMap
-                .select(HMap.val)
-                .join(cs, on=(HMap.sha == cs.c.hkey_id))
-                .naive())
-
-            for h in hm.iterator():
-                self.write(h.val + "\n")
+            after = self.get_query_argument("after", None)
+
+            if after is not None:
+                try:
+                    after = after.decode("hex")
+                except TypeError:
+                    raise HTTPError(400)
+                if len(after) != 20 or page != 1:
+                    raise HTTPError(400)
+
+            if datestr is None:
+                # Index of the current state
+                keys, cursor = yield self.background(self.current, repo,
+                    after, page)
+            else:
+                keys, cursor = yield self.background(self.index, repo, ts,
+                    after, page)
+
+            if cursor is not None:
+                # Pin the time (if any), so that all pages show the same state
+                next_url = (self.request.protocol + "://" +
+                    self.request.host + self.request.path + "?index=true" +
+                    (datestr and "&datetime=" + ts.strftime(QSDATEFMT) or "") +
+                    "&after=" + cursor.encode("hex"))
+                self.set_header("Link", '<%s>; rel="next"' % next_url)
+
+            for k in keys:
+                self.write(k + "\n")
+        elif stats:
+            self.branch = "stats"
+            # Report the storage size of the repository along with the
+            # reconstruction statistics observed by this process, to help
+            # choosing a snapshot policy.
+
+            storage = yield self.background(self.storage, repo)
+
+            rs = self.stats.get(repo.id)
+
+            self.set_header("Content-Type", "application/json")
+            self.write(json_encode(dict(
+                policy=self.snapshot_policy(repo).spec,
+                compression=repo.codec or self.settings["compression"],
+                mode=repo.mode == Repo.REVERSE and "reverse" or "forward",
+                layout=repo.layout == Repo.IDS and "ids" or "lines",
+                storage=storage,
+                reads=rs.reads,
+                writes=rs.writes,
+                reconstructions=rs.reconstructions,
+                latency=rs.latency(),
+                throughput=rs.throughput(),
+            )))
         else:
             raise HTTPError(400)
 
     @authenticated
+    @tornado.gen.coroutine
     def put(self, username, reponame):
         # Create a new revision of the resource specified by `key`.
 
@@ -333,112 +480,13 @@ class RepoHandler(BaseHandler):
         datestr = self.get_query_argument("datetime", None)
         ts = datestr and date(datestr, QSDATEFMT) or now()
 
-        try:
-            repo = (Repo
-                .select(Repo.id)
-                .join(User)
-                .where((User.name == username) & (Repo.name == reponame))
-                .naive()
-                .get())
-        except Repo.DoesNotExist:
-            raise HTTPError(404)
-
-        sha = shasum(key.encode("utf-8"))
-
-        chain = list(CSet
-            .select(CSet.time, CSet.type, CSet.len)
-            .where(
-                (CSet.repo == repo) &
-                (CSet.hkey == sha) &
-                (CSet.time >= SQL(
-                    "COALESCE((SELECT time FROM cset "
-                    "WHERE repo_id = %s "
-                    "AND hkey_id = %s "
-                    "AND type != %s "
-                    "ORDER BY time DESC "
-                    "LIMIT 1), 0)",
-                    repo.id, sha, CSet.DELTA
-                )))
-            .order_by(CSet.time)
-            .naive())
-
-        if len(chain) > 0 and not ts > chain[-1].time:
-            # Appended timestamps must be monotonically increasing!
-            raise HTTPError(400)
-
-        if len(chain) == 0:
-            # Mapping for `key` likely does not exist:
-            # Store the SHA-to-KEY mapping in HMap,
-            # looking out for possible collisions.
-            try:
-                HMap.create(sha=sha, val=key)
-            except IntegrityError:
-                val = HMap.select(HMap.val).where(HMap.sha == sha).scalar()
-                if val != key:
-                    raise HTTPError(500)
+        repo = yield self.resolve(username, reponame)
 
-        # Parse and normalize into a set of N-Quad lines
-        stmts = parse(self.request.body, fmt)
-        snapc = compress(join(stmts, "\n"))
-
-        if len(chain) == 0 or chain[0].type == CSet.DELETE:
-            # Provide dummy value for `patch` which is never stored.
-            # If we get here, we always store a snapshot later on!
-            patch = ""
-        else:
-            # Reconstruct the previous state of the resource
-            prev = set()
-
-            blobs = (Blob
-                .select(Blob.data)
-                .where(
-                    (Blob.repo == repo) &
-                    (Blob.hkey == sha) &
-                    (Blob.time << map(lambda e: e.time, chain)))
-                .order_by(Blob.time)
-                .naive())
-
-            for i, blob in enumerate(blobs.iterator()):
-                data = decompress(blob.data)
-
-                if i == 0:
-                    # Base snapshot for the delta chain
-                    prev.update(data.splitlines())
-                else:
-                    for line in data.splitlines():
-                        mode, stmt = line[0], line[2:]
-                        if mode == "A":
-                            prev.add(stmt)
-                        else:
-                            prev.discard(stmt)
-
-            if stmts == prev:
-                # No changes, nothing to be done. Bail out.
-                return self.finish()
-
-            patch = compress(join(
-                map(lambda s: "D " + s, prev - stmts) +
-                map(lambda s: "A " + s, stmts - prev), "\n"))
-
-        # Calculate the accumulated size of the delta chain including
-        # the (potential) patch from the previous to the pushed state.
-        acclen = reduce(lambda s, e: s + e.len, chain[1:], 0) + len(patch)
-
-        blen = len(chain) > 0 and chain[0].len or 0 # base length
-
-        if (len(chain) == 0 or chain[0].type == CSet.DELETE or
-            len(snapc) <= len(patch) or SNAPF * blen <= acclen):
-            # Store the current state as a new snapshot
-            Blob.create(repo=repo, hkey=sha, time=ts, data=snapc)
-            CSet.create(repo=repo, hkey=sha, time=ts, type=CSet.SNAPSHOT,
-                len=len(snapc))
-        else:
-            # Store a directed delta between the previous and current state
-            Blob.create(repo=repo, hkey=sha, time=ts, data=patch)
-            CSet.create(repo=repo, hkey=sha, time=ts, type=CSet.DELTA,
-                len=len(patch))
+        yield self.background(self.push, repo, key, ts,
+            self.body, fmt)
 
     @authenticated
+    @tornado.gen.coroutine
     def delete(self, username, reponame):
         # Check whether the key exists and if maybe the last change already is
         # a delete, else insert a `CSet.DELETE` entry without any blob data.
@@ -454,38 +502,437 @@ class RepoHandler(BaseHandler):
         datestr = self.get_query_argument("datetime", None)
         ts = datestr and date(datestr, QSDATEFMT) or now()
 
-        try:
-            repo = (Repo
-                .select(Repo.id)
-                .join(User)
-                .where((User.name == username) & (Repo.name == reponame))
-                .naive()
-                .get())
-        except Repo.DoesNotExist:
-            raise HTTPError(404)
+        repo = yield self.resolve(username, reponame)
+
+        yield self.background(self.remove, repo, key, ts)
+
+    # The following methods run in the worker thread pool.
+
+    def memento(self, repo, sha, ts):
+        # Return the delta chain of the revision valid at `ts`, whether the
+        # revision is final (see `Storage.chain`) and, if it is not a delete
+        # and the client does not have it already (see `fresh`), an iterator
+        # over the serialized resource state in chunks. Large states are
+        # produced chunk by chunk as they are sent (see `produce`), by
+        # decompressing and merging sorted blobs: codecs and dictionaries
+        # are loaded here, and chains of unsorted blobs are restored here at
+        # once (see `content` and `replay`).
+
+        reverse = repo.mode == Repo.REVERSE
+        layout = self.layout(repo)
+
+        chain, final = self.engine.chain(repo, sha, ts, reverse)
+        self.lap("chain")
+
+        if len(chain) == 0 or chain[0].type == CSet.DELETE:
+            return chain, final, None
+
+        head = chain[-1].time
+
+        if self.fresh(etag(repo, sha, head), head):
+            # Validated by the changesets alone, without loading any blobs
+            return chain, final, None
+
+        self.stats.read(repo.id)
+        self.metrics.chain("read", len(chain))
+
+        # Serve the resource state from the cache if it is known
+        stmts = self.statecache.get(repo.id, sha, head)
+        self.lap("cache")
+
+        if stmts is not None:
+            return chain, final, joined(stmts, "\n", RESPONSE_CHUNK_LINES)
+
+        # Load the data required in order to restore the resource state.
+        data = self.engine.blobs(repo, sha, [e.time for e in chain], reverse)
+        self.lap("blobs")
+
+        if len(chain) == 1 and layout is LINES:
+            # Special case, where we can simply return the blob data of
+            # the snapshot, decompressing it as it is sent. Decompressing
+            # costs about as much as serializing a cached state, so the
+            # state is not cached (nor counted as a reconstruction).
+            self.metrics.decompressed(len(data[0]))
+            return chain, final, content(data[0], RESPONSE_CHUNK_SIZE)
+
+        stmts = self.restore(repo, layout, data)
+
+        if layout is IDS:
+            # Look up the statements by id
+            stmts = stmtdict.resolve(stmts)
+        else:
+            stmts = itertools.chain.from_iterable(stmts)
+
+            if len(data[0]) > STREAM_SIZE:
+                # Replay the chain as the state is sent, without caching it
+                return chain, final, joined(stmts, "\n", RESPONSE_CHUNK_LINES)
+
+        stmts = self.statecache.put(repo.id, sha, head, stmts)
+        self.lap("restore")
+
+        return chain, final, joined(stmts, "\n", RESPONSE_CHUNK_LINES)
+
+    def timemap(self, repo, sha):
+        # Return the times of all changes to the resource, latest first.
+        return self.engine.timemap(repo, sha)
+
+    def index(self, repo, ts, after, page):
+        # Return a page of the keys of all resources existing at `ts`, with
+        # hashes following `after` (if given), and the cursor for the next
+        # page or `None` if this is the last one. Pages hold fewer keys if
+        # some of the resources were deleted.
+
+        rows = self.engine.index(repo, ts, after, page, INDEX_PAGE_SIZE)
+
+        cursor = len(rows) == INDEX_PAGE_SIZE and rows[-1][0] or None
+
+        keys = [val for _, val, cstype in rows if cstype != CSet.DELETE]
+
+        return keys, cursor
+
+    def current(self, repo, after, page):
+        # Same as `index` for the current state, read from the heads.
+
+        rows = self.engine.current(repo, after, page, INDEX_PAGE_SIZE)
+
+        cursor = len(rows) == INDEX_PAGE_SIZE and rows[-1][0] or None
+
+        return [val for _, val in rows], cursor
+
+    def storage(self, repo):
+        # Return the number and total size of changesets by type, and the
+        # number of blobs per compression format.
+        return self.engine.sizes(repo)
+
+    def push(self, repo, key, ts, body, fmt):
+        # Store the new state `body` of the resource as a revision at `ts`.
+        # Apart from interning statements (for statement ids), all queries
+        # run in one transaction: reading the key mapping and current delta
+        # chain (see `resource`), mapping a new key, fetching the blobs of
+        # the chain (unless cached) and writing the revision.
 
         sha = shasum(key.encode("utf-8"))
 
+        reverse = repo.mode == Repo.REVERSE
+        layout = self.layout(repo)
+
+        # Parse and normalize into a set of N-Quad lines
+        stmts = parse(body, fmt)
+
+        if layout is IDS:
+            state = stmtdict.array(stmtdict.intern(stmts).itervalues())
+        else:
+            state = sorted(stmts)
+
+        self.lap("parse")
+
+        snapshot_policy = self.snapshot_policy(repo)
+        stats = self.stats.get(repo.id)
+        codec = self.codec(repo)
+
+        with self.engine.atomic():
+            val, chain = self.engine.resource(repo, sha)
+
+            if len(chain) > 0 and not ts > chain[-1].time:
+                # Appended timestamps must be monotonically increasing!
+                raise HTTPError(400)
+
+            if val is None:
+                if not self.engine.map(sha, key):
+                    # Hash collision with a concurrently mapped key
+                    raise HTTPError(500)
+            elif val != key:
+                # Hash collision
+                raise HTTPError(500)
+
+            self.lap("resource")
+
+            prev = None
+
+            if len(chain) > 0 and chain[-1].type != CSet.DELETE:
+                # Restore the previous state of the resource (cached states
+                # are statement lines, so states of ids are always restored)
+                if layout is LINES:
+                    prev = self.statecache.get(repo.id, sha, chain[-1].time)
+
+                if prev is None:
+                    # In reverse-delta repositories, the latest state
+                    # is always stored as a snapshot.
+                    times = (reverse and [chain[-1].time] or
+                        [e.time for e in chain])
+
+                    data = self.engine.blobs(repo, sha, times)
+                    prev = self.restore(repo, layout, data)
+                    self.lap("blobs")
+
+            if not reverse:
+                rev = revise(chain, prev, state, snapshot_policy, stats,
+                    codec, layout)
+                self.lap("revise")
+
+                if rev is None:
+                    # No changes, nothing to be done. Bail out.
+                    return
+
+                cstype, data = rev
+                size = len(data)
+
+                # Deltas extend the current chain, snapshots start a new one
+                extend = cstype == CSet.DELTA
+                base = extend and chain[0].time or ts
+
+                self.engine.append(repo, sha, ts, cstype, data, base, codec)
+            else:
+                rev = revise_reverse(chain, prev, state, snapshot_policy,
+                    stats, codec, layout)
+                self.lap("revise")
+
+                if rev is None:
+                    # No changes, nothing to be done. Bail out.
+                    return
+
+                snap, back = rev
+                cstype, size = CSet.SNAPSHOT, len(snap) + len(back or "")
+
+                # Unless the previous snapshot is kept, the chain is extended
+                extend = back is not None
+                base = extend and chain[0].time or ts
+
+                if back is not None:
+                    # Replace the previous snapshot with a backward delta
+                    self.engine.replace(repo, sha, chain[-1].time, back,
+                        codec)
+
+                self.engine.append(repo, sha, ts, CSet.SNAPSHOT, snap, base,
+                    codec)
+
+        self.lap("write")
+
+        self.statecache.extend(repo.id, sha, ts, stmts)
+        self.stats.write(repo.id)
+        self.metrics.changesets(CSTYPES[cstype])
+        self.metrics.compressed(size)
+        self.metrics.chain("write", extend and len(chain) + 1 or 1)
+
+    def remove(self, repo, key, ts):
+        # Mark the resource as deleted at `ts`.
+
+        sha = shasum(key.encode("utf-8"))
+
+        with self.engine.atomic():
+            last = self.engine.latest(repo, sha)
+
+            if last is None:
+                # No changeset was found for the given key -
+                # the resource does not exist.
+                raise HTTPError(400)
+
+            if not ts > last.time:
+                # Appended timestamps must be monotonically increasing!
+                raise HTTPError(400)
+
+            if last.type == CSet.DELETE:
+                # The resource was deleted already, return instantly.
+                return
+
+            # Insert the new "delete" change.
+            self.engine.delete(repo, sha, ts)
+
+        self.statecache.invalidate(repo.id, sha)
+        self.metrics.changesets(CSTYPES[CSet.DELETE])
+
+@tornado.web.stream_request_body
+class BatchHandler(BaseHandler):
+    """Pushes new revisions for many resources at once (batch push)."""
+
+    # Maximum number of keys or rows per query/multi-row insert
+    CHUNK_SIZE = 500
+
+    @authenticated
+    @tornado.gen.coroutine
+    def put(self, username, reponame):
+        # Create new revisions for all resources contained in the body. The
+        # body holds N-Quads (or another format with named graphs), the graph
+        # name of each statement being the key of the resource it belongs to.
+        # All changes are written in a single transaction and the response
+        # reports the outcome for each individual key.
+
+        fmt = self.request.headers.get("Content-Type", "application/n-quads")
+
+        if username != self.current_user.name:
+            raise HTTPError(403)
+
+        datestr = self.get_query_argument("datetime", None)
+        ts = datestr and date(datestr, QSDATEFMT) or now()
+
+        repo = yield self.resolve(username, reponame)
+
+        report = yield self.background(self.push, repo, ts,
+            self.body, fmt)
+
+        self.set_header("Content-Type", "application/json")
+        self.write(json_encode(report))
+
+    # The following methods run in the worker thread pool.
+
+    def push(self, repo, ts, body, fmt):
+        # Store the new states of all resources in `body` as revisions at
+        # `ts`, returning a report of the outcome per key.
+
         try:
-            last = (CSet
-                .select(CSet.time, CSet.type)
-                .where((CSet.repo == repo) & (CSet.hkey == sha))
-                .order_by(CSet.time.desc())
-                .limit(1)
-                .naive()
-                .get())
-        except CSet.DoesNotExist:
-            # No changeset was found for the given key -
-            # the resource does not exist.
+            graphs = parse_graphs(body, fmt)
+        except ValueError:
             raise HTTPError(400)
 
-        if not ts > last.time:
-            # Appended timestamps must be monotonically increasing!
-            raise HTTPError(400)
+        self.lap("parse")
+
+        keys = {} # sha -> key
+        for key in graphs:
+            keys[shasum(key.encode("utf-8"))] = key
+
+        shas = keys.keys()
+        report = {}
+
+        # Look up existing SHA-to-KEY mappings, checking for collisions.
+        known = set()
+        for part in chunked(shas, self.CHUNK_SIZE):
+            for sha, val in self.engine.mappings(part):
+                if val != keys[sha]:
+                    report[keys.pop(sha)] = "collision"
+                else:
+                    known.add(sha)
+
+        self.lap("mappings")
+
+        shas = keys.keys()
+        reverse = repo.mode == Repo.REVERSE
+        layout = self.layout(repo)
+
+        if layout is IDS:
+            # Intern the statements of all resources at once
+            ids = stmtdict.intern(itertools.chain.from_iterable(
+                graphs.itervalues()))
+            states = dict((key, stmtdict.array(ids[s] for s in stmts))
+                for key, stmts in graphs.iteritems())
+        else:
+            states = dict((key, sorted(stmts))
+                for key, stmts in graphs.iteritems())
+
+        self.lap("states")
+
+        # Fetch the delta chains for all keys, ordered by key and time.
+        chains = dict((sha, []) for sha in shas)
+        for part in chunked(shas, self.CHUNK_SIZE):
+            for cs in self.engine.chains(repo, part):
+                chains[cs.sha].append(cs)
+
+        self.lap("resource")
+
+        # Keys with a non-empty chain not ending in a delete need their
+        # previous state, either from the cache (statement lines only) or
+        # reconstructed from the blobs of their chain.
+        prevs = {}
+        for sha in shas:
+            chain = chains[sha]
+            if len(chain) > 0 and chain[-1].type != CSet.DELETE:
+                prevs[sha] = None
+                if layout is LINES:
+                    prevs[sha] = self.statecache.get(repo.id, sha,
+                        chain[-1].time)
+
+        missing = [sha for sha in prevs if prevs[sha] is None]
+
+        blobs = dict((sha, []) for sha in missing)
+        for part in chunked(missing, self.CHUNK_SIZE):
+            for sha, data in self.engine.heads(repo, part, reverse):
+                blobs[sha].append(data)
+
+        self.lap("blobs")
+
+        # States of statement lines are only replayed when compared
+        for sha in missing:
+            prevs[sha] = self.restore(repo, layout, blobs.pop(sha))
+
+        snapshot_policy = self.snapshot_policy(repo)
+        stats = self.stats.get(repo.id)
+        codec = self.codec(repo)
+
+        hmrows, blobrows, csrows, headrows = [], [], [], []
+        lengths = [] # of the delta chains written
+        rewrites = [] # previous snapshots replaced by backward deltas
+
+        for sha in shas:
+            key, chain = keys[sha], chains[sha]
+
+            if len(chain) > 0 and not ts > chain[-1].time:
+                # Appended timestamps must be monotonically increasing!
+                report[key] = "conflict"
+                continue
+
+            if sha not in known:
+                hmrows.append(dict(sha=sha, val=key))
+
+            if not reverse:
+                rev = revise(chain, prevs.get(sha), states[key],
+                    snapshot_policy, stats, codec, layout)
+            else:
+                rev = revise_reverse(chain, prevs.get(sha), states[key],
+                    snapshot_policy, stats, codec, layout)
+
+            if rev is None:
+                report[key] = "unchanged"
+                continue
+
+            if not reverse:
+                cstype, data = rev
+                extend = cstype == CSet.DELTA
+            else:
+                cstype, data = CSet.SNAPSHOT, rev[0]
+                extend = rev[1] is not None
+
+            # New start of the delta chain (see `RepoHandler.push`)
+            base = extend and chain[0].time or ts
+
+            if reverse and extend:
+                rewrites.append((sha, chain[-1].time, base, rev[1]))
+
+            lengths.append(extend and len(chain) + 1 or 1)
+
+            blobrows.append(dict(repo=repo.id, hkey=sha, time=ts, data=data,
+                codec=codec.id))
+            csrows.append(dict(repo=repo.id, hkey=sha, time=ts, type=cstype,
+                len=len(data), base=base))
+            headrows.append(dict(repo=repo.id, hkey=sha, time=ts, type=cstype,
+                base=base))
+
+            report[key] = cstype == CSet.SNAPSHOT and "snapshot" or "delta"
+
+        self.lap("revise")
+
+        try:
+            with self.engine.atomic():
+                for part in chunked(rewrites, self.CHUNK_SIZE):
+                    self.engine.rewrite(repo, part, codec)
+
+                self.engine.insert(hmrows, blobrows, csrows, headrows,
+                    self.CHUNK_SIZE)
+        except IntegrityError:
+            # Concurrent push for some of the keys, nothing was written.
+            raise HTTPError(409)
+
+        self.lap("write")
+
+        for row in csrows:
+            sha = row["hkey"]
+            self.statecache.extend(repo.id, sha, ts, graphs[keys[sha]])
+
+        self.stats.write(repo.id, len(csrows))
 
-        if last.type == CSet.DELETE:
-            # The resource was deleted already, return instantly.
-            return self.finish()
+        for row in csrows:
+            self.metrics.changesets(CSTYPES[row["type"]])
+        for n in lengths:
+            self.metrics.chain("write", n)
+        self.metrics.compressed(sum(len(row["data"]) for row in blobrows) +
+            sum(len(back) for _, _, _, back in rewrites))
 
-        # Insert the new "delete" change.
-        CSet.create(repo=repo, hkey=sha, time=ts, type=CSet.DELETE, len=0)
+        return report
@@ -0,0 +1,13 @@
+from handlers import RequestHandler
+
+class MetricsHandler(RequestHandler):
+    """Serves the metrics of the process for Prometheus (see `metrics`)."""
+
+    def prepare(self):
+        # No database connection needed
+        pass
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(self.application.metrics.render(
+            self.application.collect()))
@@ -12,9 +12,7 @@ from tornado.web import authenticated
 
 import peewee
 
-from peewee import fn
-
-from models import User, Repo, HMap, CSet, Token
+from models import User, Repo, HMap, CSet, Head, Token
 from handlers import RequestHandler
 
 class BaseHandler(RequestHandler):
@@ -76,11 +74,17 @@ class EditUserHandler(BaseHandler):
     @authenticated
     def post(self):
         user = self.current_user
-        user.name = self.get_argument("username", None)
+        name = self.get_argument("username", None)
+        renamed = user.name != name
+        user.name = name
         user.homepage_url = self.get_argument("homepage", None)
         user.avatar_url = self.get_argument("avatar", None)
         user.email = self.get_argument("email", None)
         user.save()
+        if renamed:
+            # Drop the cached tokens and repositories of the user in all
+            # processes
+            self.application.broadcast.publish("user %d" % user.id)
         self.redirect(self.reverse_url("web:settings"))
 
 class RepoHandler(BaseHandler):
@@ -101,10 +105,11 @@ class RepoHandler(BaseHandler):
             elif key and timemap:
                 self.render("repo/history.html", repo=repo, key=key)
             else:
-                cs = (CSet.select(fn.distinct(CSet.hkey))
-                    .where(CSet.repo == repo).limit(5).alias("cs"))
+                hd = (Head.select(Head.hkey)
+                    .where((Head.repo == repo) & (Head.type != CSet.DELETE))
+                    .limit(5).alias("hd"))
                 samples = (HMap.select(HMap.val)
-                    .join(cs, on=(HMap.sha == cs.c.hkey_id)))
+                    .join(hd, on=(HMap.sha == hd.c.hkey_id)))
                 self.render("repo/show.html", title=title, repo=repo,
                     samples=list(samples))
         except Repo.DoesNotExist:
@@ -121,11 +126,16 @@ class CreateRepoHandler(BaseHandler):
     def post(self):
         reponame = self.get_argument("reponame", None)
         desc = self.get_argument("description", None)
+        reverse = self.get_argument("mode", "forward") == "reverse"
+        ids = self.get_argument("layout", "lines") == "ids"
         user = self.current_user
         if not reponame:
             self.redirect(self.reverse_url("web:create-repo"))
             return
-        repo = Repo.create(user=user, name=reponame, desc=desc)
+        mode = reverse and Repo.REVERSE or Repo.FORWARD
+        layout = ids and Repo.IDS or Repo.LINES
+        repo = Repo.create(user=user, name=reponame, desc=desc, mode=mode,
+            layout=layout)
         self.redirect(self.reverse_url("web:repo", user.name, repo.name))
 
 class SettingsHandler(BaseHandler):
@@ -160,10 +170,12 @@ class DelTokenHandler(BaseHandler):
     def post(self, id):
         try:
             token = Token.get((Token.user == self.current_user) & (Token.id == id))
-            token.delete_instance()
-            self.redirect(self.reverse_url("web:settings"))
-        except:
+        except Token.DoesNotExist:
             raise HTTPError(404)
+        token.delete_instance()
+        # Other processes drop the revoked token from their caches
+        self.application.broadcast.publish("token " + token.value)
+        self.redirect(self.reverse_url("web:settings"))
 
 class JoinHandler(BaseHandler):
     """Allows users to join through email and password or GitHub OAuth."""
@@ -0,0 +1,139 @@
+import bisect
+import collections
+import threading
+
+# Metrics of an application process, exposed in the Prometheus text format
+# (https://prometheus.io/docs/instrumenting/exposition_formats/) at
+# `/metrics`. Counters and histograms are kept in memory, labelled e.g. by
+# route; the state of the process (connection pool, caches) is read when
+# rendering. Every worker process (see `app.py --processes`) reports its own
+# requests.
+
+# Upper bounds of the histogram buckets of request durations, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0)
+
+# ... and of the lengths of delta chains (number of changesets)
+CHAIN_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+# Name, type, help text and histogram buckets of all counters and histograms
+FAMILIES = [
+    ("tailr_http_requests_total", "counter",
+        "Requests by route, branch and status code.", None),
+    ("tailr_http_request_duration_seconds", "histogram",
+        "Request durations by route and branch.", LATENCY_BUCKETS),
+    ("tailr_db_queries_total", "counter",
+        "Database statements of requests by route and branch.", None),
+    ("tailr_db_query_seconds_total", "counter",
+        "Time spent on database statements by route and branch.", None),
+    ("tailr_delta_chain_length", "histogram",
+        "Changesets in the delta chains of reads and pushes.", CHAIN_BUCKETS),
+    ("tailr_changesets_total", "counter",
+        "Changesets written by type.", None),
+    ("tailr_compressed_bytes_total", "counter",
+        "Bytes of blob data written (compressed snapshots and deltas).", None),
+    ("tailr_decompressed_bytes_total", "counter",
+        "Bytes of blob data read to restore states.", None),
+]
+
+class Histogram(object):
+    """Counts of observed values per bucket, with their sum."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one for +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class Metrics(object):
+    """Thread-safe counters and histograms of the `FAMILIES`."""
+
+    def __init__(self):
+        self._families = dict((f[0], f) for f in FAMILIES)
+        self._samples = collections.defaultdict(dict) # name -> labels -> v
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.iteritems()))
+        with self._lock:
+            samples = self._samples[name]
+            samples[key] = samples.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.iteritems()))
+        with self._lock:
+            samples = self._samples[name]
+            if key not in samples:
+                samples[key] = Histogram(self._families[name][3])
+            samples[key].observe(value)
+
+    def request(self, route, branch, code, seconds, queries):
+        """Account for a finished request and its database statements (see
+        `database.Queries`)."""
+        labels = dict(route=route, branch=branch)
+        self.inc("tailr_http_requests_total", code=str(code), **labels)
+        self.observe("tailr_http_request_duration_seconds", seconds, **labels)
+        self.inc("tailr_db_queries_total", queries.count, **labels)
+        self.inc("tailr_db_query_seconds_total", queries.time, **labels)
+
+    def chain(self, op, length):
+        """Account for a delta chain of `length` changesets read (`op` "read")
+        or extended ("write")."""
+        self.observe("tailr_delta_chain_length", length, op=op)
+
+    def changesets(self, cstype, n=1):
+        self.inc("tailr_changesets_total", n, type=cstype)
+
+    def compressed(self, size):
+        self.inc("tailr_compressed_bytes_total", size)
+
+    def decompressed(self, size):
+        self.inc("tailr_decompressed_bytes_total", size)
+
+    def render(self, collected=()):
+        """Return all metrics in the text exposition format, followed by the
+        `collected` ones, a list of `(name, type, help, samples)` tuples,
+        `samples` being a list of `(labels, value)` pairs."""
+        lines = []
+
+        with self._lock:
+            for name, kind, text, buckets in FAMILIES:
+                lines.append("# HELP %s %s" % (name, text))
+                lines.append("# TYPE %s %s" % (name, kind))
+                for key, value in sorted(self._samples[name].iteritems()):
+                    if kind == "histogram":
+                        lines.extend(histogram(name, key, value))
+                    else:
+                        lines.append(sample(name, key, value))
+
+        for name, kind, text, samples in collected:
+            lines.append("# HELP %s %s" % (name, text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                lines.append(sample(name, sorted(labels.iteritems()), value))
+
+        return "\n".join(lines) + "\n"
+
+def escape(value):
+    return (unicode(value).replace("\\", "\\\\").replace("\"", "\\\"")
+        .replace("\n", "\\n"))
+
+def sample(name, labels, value):
+    # A sample line, e.g. `name{label="value",...} 1.5`
+    if labels:
+        name += "{%s}" % ",".join("%s=\"%s\"" % (k, escape(v))
+            for k, v in labels)
+    return "%s %s" % (name, repr(float(value)))
+
+def histogram(name, labels, h):
+    # The cumulative bucket counts, sum and count of a histogram
+    total = 0
+    for bound, count in zip(h.buckets + ("+Inf",), h.counts):
+        total += count
+        le = bound == "+Inf" and bound or repr(float(bound))
+        yield sample(name + "_bucket", labels + (("le", le),), total)
+    yield sample(name + "_sum", labels, h.sum)
+    yield sample(name + "_count", labels, total)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Apply schema changes to an existing database. Pass the names of the
+# migrations to run, e.g. `python migrate.py repo-mode` (run without
+# arguments to list the available migrations).
+
+import hashlib
+import itertools
+import sys
+
+from playhouse.migrate import MySQLMigrator, migrate
+
+from blobstore import Blobstore
+from database import MDB, from_url
+from database import MSQLTinyIntegerField, MSQLTimestampField
+
+from config import dburl, bsconf
+from models import *
+
+import models
+
+def repo_mode(migrator):
+    # Storage mode per repository (forward or reverse deltas)
+    field = MSQLTinyIntegerField(unsigned=True, null=False,
+        default=Repo.FORWARD)
+    migrate(migrator.add_column("repo", "mode", field))
+
+def repo_policy(migrator):
+    # Snapshot policy per repository (default policy if null)
+    field = CharField(max_length=64, null=True, default=None)
+    migrate(migrator.add_column("repo", "policy", field))
+
+# Blobs moved per transaction by `move_blobs`
+MOVE_BATCH = 1000
+
+# Size of the digests of blobs in the blob store (SHA-1)
+DIGEST_SIZE = hashlib.sha1().digest_size
+
+def move_blobs(migrator):
+    # Move blob data from the database into the configured blob store,
+    # keeping only the digests. Run when enabling the blob store for an
+    # existing database. Rows holding the digest of a stored blob already
+    # are skipped (compressed data practically never is one), so that an
+    # interrupted migration can be run again.
+    if models.blobstore is None:
+        raise RuntimeError("no blob store configured (BLOBSTORE_PATH)")
+
+    db = migrator.database
+    keys = db.execute_sql("SELECT repo_id, hkey_id, time FROM blob").fetchall()
+    where = " WHERE repo_id = %s AND hkey_id = %s AND time = %s"
+    moved = 0
+
+    for start in xrange(0, len(keys), MOVE_BATCH):
+        with db.atomic():
+            for key in keys[start:start + MOVE_BATCH]:
+                data, = db.execute_sql("SELECT data FROM blob" + where,
+                    key).fetchone()
+                data = str(data)
+                if len(data) == DIGEST_SIZE and data in models.blobstore:
+                    continue
+                digest = models.blobstore.put(data)
+                db.execute_sql("UPDATE blob SET data = %s" + where,
+                    (digest,) + key)
+                moved += 1
+
+        print "%d of %d blobs checked, %d moved" % (
+            min(start + MOVE_BATCH, len(keys)), len(keys), moved)
+
+def cset_base(migrator):
+    # Time of the first changeset of the delta chain per changeset (see
+    # `CSet.bases`), indexed together with the key so that the chain of a
+    # revision can be read with a single range scan.
+    field = MSQLTimestampField(precision=0, null=True)
+    migrate(migrator.add_column("cset", "base", field))
+
+    db = migrator.database
+
+    for repo in Repo.select(Repo.id, Repo.mode).naive():
+        changes = (CSet
+            .select(CSet.hkey, CSet.time, CSet.type)
+            .where(CSet.repo == repo)
+            .order_by(CSet.hkey, CSet.time)
+            .tuples())
+
+        with db.atomic():
+            for sha, group in itertools.groupby(changes.iterator(),
+                                                lambda row: row[0]):
+                group = [row[1:] for row in group]
+                bases = CSet.bases(group, repo.mode)
+
+                # One update per chain (range of changesets with one base)
+                for base, chain in itertools.groupby(
+                        zip(bases, group), lambda row: row[0]):
+                    chain = list(chain)
+                    db.execute_sql("UPDATE cset SET base = %s "
+                        "WHERE repo_id = %s AND hkey_id = %s "
+                        "AND time BETWEEN %s AND %s",
+                        (base, repo.id, sha, chain[0][1][0], chain[-1][1][0]))
+
+        print "repo %d: changeset bases set" % repo.id
+
+    migrate(migrator.add_not_null("cset", "base"),
+        migrator.add_index("cset", ("repo_id", "hkey_id", "base", "time"),
+            False))
+
+def heads(migrator):
+    # Create and fill the table of resource heads from the changesets. Can
+    # also be run to rebuild the heads (while the application is not used).
+    Head.create_table(fail_silently=True)
+
+    for repo in Repo.select(Repo.id, Repo.mode).naive():
+        changes = (CSet
+            .select(CSet.hkey, CSet.time, CSet.type)
+            .where(CSet.repo == repo)
+            .order_by(CSet.hkey, CSet.time)
+            .tuples())
+
+        rows = []
+
+        with migrator.database.atomic():
+            Head.delete().where(Head.repo == repo).execute()
+
+            for sha, group in itertools.groupby(changes.iterator(),
+                                                lambda row: row[0]):
+                time, cstype, base = Head.derive([row[1:] for row in group],
+                    repo.mode)
+                rows.append(dict(repo=repo.id, hkey=sha, time=time,
+                    type=cstype, base=base))
+
+                if len(rows) == 1000:
+                    Head.insert_many(rows).execute()
+                    rows = []
+
+            if rows:
+                Head.insert_many(rows).execute()
+
+        print "repo %d: heads rebuilt" % repo.id
+
+def codecs(migrator):
+    # Compression codec per repository (default codec if null), format of
+    # each blob (all zlib so far) and trained compression dictionaries
+    migrate(
+        migrator.add_column("repo", "codec",
+            CharField(max_length=64, null=True, default=None)),
+        migrator.add_column("blob", "codec",
+            MSQLTinyIntegerField(unsigned=True, null=False, default=0)))
+    Dictionary.create_table(fail_silently=True)
+
+def repo_layout(migrator):
+    # Storage layout per repository (statement lines or statement ids) and
+    # the statement dictionary for the latter
+    field = MSQLTinyIntegerField(unsigned=True, null=False,
+        default=Repo.LINES)
+    migrate(migrator.add_column("repo", "layout", field))
+    Stmt.create_table(fail_silently=True)
+
+MIGRATIONS = [
+    ("repo-mode", repo_mode),
+    ("repo-policy", repo_policy),
+    ("blobstore", move_blobs),
+    ("cset-base", cset_base),
+    ("heads", heads),
+    ("codecs", codecs),
+    ("repo-layout", repo_layout),
+]
+
+if __name__ == "__main__":
+    database = from_url(dburl)
+    if not isinstance(database, MDB):
+        # SQLite databases are created with the current schema (prepare.py)
+        raise SystemExit("migrate.py: only MariaDB/MySQL databases")
+    blobstore = (bsconf["nodes"] and
+        Blobstore(bsconf["nodes"], **bsconf["opts"]) or None)
+    models.initialize(database, blobstore)
+
+    available = dict(MIGRATIONS)
+
+    if len(sys.argv) < 2 or not all(n in available for n in sys.argv[1:]):
+        print "usage: python migrate.py MIGRATION [MIGRATION ...]\n"
+        print "available migrations (in order):\n"
+        for name, fn in MIGRATIONS:
+            print "  " + name
+        sys.exit(1)
+
+    migrator = MySQLMigrator(database)
+
+    for name in sys.argv[1:]:
+        print "Running " + name
+        available[name](migrator)
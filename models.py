@@ -2,6 +2,7 @@ from peewee import *
 from database import *
 
 dbproxy = Proxy()
+blobstore = None
 
 class Base(Model):
     class Meta:
@@ -30,39 +31,145 @@ class Repo(Base):
     user = ForeignKeyField(User, related_name="repos", null=False)
     name = CharField(null=False, index=True)
     desc = CharField(max_length=255)
+    mode = MSQLTinyIntegerField(unsigned=True, null=False, default=0)
+    policy = CharField(max_length=64, null=True, default=None) # snapshots
+    codec = CharField(max_length=64, null=True, default=None) # compression
+    layout = MSQLTinyIntegerField(unsigned=True, null=False, default=0)
 
     class Meta:
         indexes = [(("user", "name"), True)]
 
+    FORWARD = 0 # latest snapshot followed by forward deltas
+    REVERSE = 1 # backward deltas leading back from the latest snapshot
+
+    LINES = 0 # snapshots and deltas hold statement lines
+    IDS = 1 # snapshots and deltas hold statement ids (see `stmtdict`)
+
 class HMap(Base):
     sha = MSQLBinaryField(length=20, primary_key=True)
     val = CharField(max_length=2048, null=False)
 
+class Stmt(Base):
+    """Statement dictionary, holding each distinct statement line stored
+    by repositories in the `Repo.IDS` layout once (see `stmtdict`)."""
+
+    id = PrimaryKeyField()
+    sha = MSQLBinaryField(length=20, unique=True, null=False)
+    val = MSQLMediumBlobField(null=False)
+
 class CSet(Base):
     repo = ForeignKeyField(Repo, related_name="csets", null=False)
     hkey = ForeignKeyField(HMap, null=False)
     time = MSQLTimestampField(precision=0, null=False)
     type = MSQLTinyIntegerField(unsigned=True, null=False)
     len  = MSQLMediumIntegerField(unsigned=True, null=False)
-    # base = MSQLTimestampField(precision=3, null=False)
+    base = MSQLTimestampField(precision=0, null=False) # start of the chain
 
     class Meta:
         primary_key = CompositeKey("repo", "hkey", "time")
+        indexes = [(("repo", "hkey", "base", "time"), False)]
 
     SNAPSHOT = 0
     DELTA = 1
     DELETE = 2
 
-# TODO: Store blobs in a dedicated blobstore? (benchmark)
+    @staticmethod
+    def bases(changes, mode):
+        """Return the `base` of each of the `(time, type)` tuples of all
+        changesets of a resource, ordered by time.
+
+        The base is the time of the first changeset of the delta chain a
+        changeset belongs to: the snapshot (or delete) it follows for forward
+        deltas, or the earliest of the backward deltas leading back from the
+        same snapshot in reverse-delta repositories.
+        """
+        bases, base, prev = [], None, None
+
+        for time, cstype in changes:
+            if mode == Repo.REVERSE:
+                # Chains end with a "non-delta"
+                if prev is None or prev != CSet.DELTA:
+                    base = time
+            elif cstype != CSet.DELTA:
+                base = time
+            bases.append(base)
+            prev = cstype
+
+        return bases
+
+class Head(Base):
+    """Latest changeset of each resource, maintained along with `CSet`.
+
+    `base` is the time of the first changeset of the current delta chain,
+    i.e. the chain consists of the changesets from `base` to `time` (see
+    `CSet.bases`).
+    """
+
+    repo = ForeignKeyField(Repo, related_name="heads", null=False)
+    hkey = ForeignKeyField(HMap, null=False)
+    time = MSQLTimestampField(precision=0, null=False)
+    type = MSQLTinyIntegerField(unsigned=True, null=False)
+    base = MSQLTimestampField(precision=0, null=False)
+
+    class Meta:
+        primary_key = CompositeKey("repo", "hkey")
+
+    @classmethod
+    def advance(cls, rows):
+        """Insert or update heads, given as dicts like for `insert_many`.
+
+        Existing heads are only replaced by newer ones, so that concurrent
+        writes can not move a head back in time.
+        """
+        cls._meta.database.insert_newer(cls.insert_many(rows),
+            ["repo_id", "hkey_id"], ["type", "base", "time"])
+
+    @staticmethod
+    def derive(changes, mode):
+        """Return the head `(time, type, base)` for the `(time, type)` tuples
+        of all changesets of a resource, ordered by time."""
+        time, cstype = changes[-1]
+        return time, cstype, CSet.bases(changes, mode)[-1]
+
+class BlobDataField(MSQLMediumBlobField):
+    """Blob data, kept in the blob store (if configured) and referenced by its
+    digest in the database, or stored in the database itself otherwise."""
+
+    def db_value(self, value):
+        if blobstore is not None and value is not None:
+            value = blobstore.put(value)
+        return super(BlobDataField, self).db_value(value)
+
+    def python_value(self, value):
+        value = super(BlobDataField, self).python_value(value)
+        if blobstore is not None and value is not None:
+            value = blobstore.get(str(value))
+        return value
 
 class Blob(Base):
     repo = ForeignKeyField(Repo, related_name="blobs", null=False)
     hkey = ForeignKeyField(HMap, null=False)
     time = MSQLTimestampField(precision=0, null=False)
-    data = MSQLMediumBlobField()
+    data = BlobDataField()
+    codec = MSQLTinyIntegerField(unsigned=True, null=False, default=0)
 
     class Meta:
         primary_key = CompositeKey("repo", "hkey", "time")
 
-def initialize(database, blobstore):
+class Dictionary(Base):
+    """Compression dictionary trained on the blobs of a repository.
+
+    The `id` is the one chosen (at random) when training the dictionary,
+    which is embedded in the data compressed with it (see `compression`).
+    Dictionaries must be kept as long as any blobs compressed with them.
+    """
+
+    id = MSQLIntegerField(unsigned=True, primary_key=True)
+    repo = ForeignKeyField(Repo, related_name="dictionaries", null=False)
+    time = MSQLTimestampField(precision=0, null=False)
+    data = MSQLMediumBlobField(null=False)
+
+def initialize(database, store):
+    global blobstore
     dbproxy.initialize(database)
+    blobstore = store
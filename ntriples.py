@@ -0,0 +1,159 @@
+import re
+import sys
+
+# Line-based parser for N-Triples and N-Quads, producing the same canonical
+# statement lines as serializing the statements parsed by librdf (`str(st) +
+# " ."`), without creating any librdf nodes:
+#
+# - terms are separated by single spaces, followed by " .",
+# - in IRIs and literals, `"` and `\` are escaped with a backslash, tabs,
+#   line feeds and carriage returns as `\t`, `\n` and `\r`, other control
+#   characters and all non-ASCII characters as `\uXXXX` or `\UXXXXXXXX`
+#   (upper case hex digits).
+#
+# Input the parser does not handle exactly like librdf raises `Unsupported`,
+# so that callers can fall back to librdf for the whole document: blank
+# nodes (librdf replaces their labels with generated ones), relative IRIs
+# (resolved against the base URI by librdf) and invalid lines. Lines that
+# are canonical already (most of them) are only matched, not rewritten.
+
+class Unsupported(Exception):
+    """Raised for input to be parsed by librdf instead."""
+
+# Absolute IRIs only, relative ones are resolved against the base by librdf
+IRI = (r'<[A-Za-z][A-Za-z0-9+.-]*:(?:[^\x00-\x20<>"{}|^`\\]+'
+    r'|\\u[0-9A-Fa-f]{4}|\\U[0-9A-Fa-f]{8})*>')
+
+LITERAL = (r'"(?:[^"\\\n\r]+|\\[tbnrf"\'\\]|\\u[0-9A-Fa-f]{4}'
+    r'|\\U[0-9A-Fa-f]{8})*"'
+    r'(?:@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*|\^\^' + IRI + ')?')
+
+WS = r'[ \t]*'
+
+STATEMENT = re.compile('^' + WS + '(' + IRI + ')' + WS + '(' + IRI + ')' +
+    WS + '(' + IRI + '|' + LITERAL + ')' + WS + '(?:(' + IRI + ')' + WS +
+    ')?\.' + WS + '(?:#.*)?$')
+
+# Lines without statements
+EMPTY = re.compile(r'^[ \t]*(?:#.*)?$')
+
+# Printable ASCII characters, any others are escaped in canonical form
+PRINTABLE = "".join(map(chr, xrange(0x20, 0x7f)))
+
+# Escapes differing from the canonical form: other escapes than \t, \n, \r,
+# \" and \\, lower case hex digits, escaped ASCII characters (other than
+# DEL), surrogates, BMP characters escaped with \U and \U escapes beyond
+# U+10FFFF
+NONCANONICAL = re.compile(r'\\(?:[bf\']'
+    r'|u(?![0-9A-F]{4})|u00(?:0[9AD]|[2-6][0-9A-F]|7[0-9A-E])|uD[89A-F]'
+    r'|U(?![0-9A-F]{8})|U(?!000[1-9A-F]|0010))')
+
+UNESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+
+ESCAPES = dict(t=u"\t", b=u"\b", n=u"\n", r=u"\r", f=u"\f")
+
+# Characters to escape (non-BMP ones are surrogate pairs in narrow builds)
+ESCAPE = re.compile(u'[\ud800-\udbff][\udc00-\udfff]|'
+    u'[\x00-\x1f"\\\\\x7f-\uffff' +
+    (sys.maxunicode > 0xffff and u'\U00010000-\U0010ffff' or u'') + u']')
+
+def triples(lines):
+    """Return canonical statement lines for the N-Triples `lines`."""
+    for s, p, o, g in statements(lines):
+        if g is not None:
+            raise Unsupported("graph name in N-Triples")
+        yield statement(s, p, o)
+
+def quads(lines):
+    """Return `(graph name, canonical statement line)` tuples for the
+    N-Quads `lines`, graph names being decoded IRIs.
+
+    Raises a `ValueError` for statements in the default graph.
+    """
+    for s, p, o, g in statements(lines):
+        if g is None:
+            raise ValueError("statement outside of a named graph")
+        yield iri(g)[1:-1], statement(s, p, o)
+
+def statements(lines):
+    # Return the terms (subject, predicate, object, graph or `None`) of
+    # the statements in `lines`, skipping empty lines and comments
+    for line in lines:
+        line = line.rstrip("\r\n")
+        match = STATEMENT.match(line)
+        if match is not None:
+            yield match.groups()
+        elif not EMPTY.match(line):
+            raise Unsupported("invalid or unsupported line: %r" % line)
+
+def statement(s, p, o):
+    line = " ".join((s, p, o, "."))
+    if canonical(line):
+        return line
+    return " ".join((term(s), term(p), term(o), "."))
+
+def canonical(s):
+    # Whether the (matched) terms in `s` are in canonical form already
+    return (not s.translate(None, PRINTABLE) and
+        ("\\" not in s or NONCANONICAL.search(s) is None))
+
+def term(t):
+    if t[0] == "<":
+        if not canonical(t):
+            return "<" + escape(iri(t)[1:-1]) + ">"
+        return t
+
+    # Literals, with an optional language tag or datatype IRI
+    end = t.rindex('"')
+    if end + 1 < len(t) and t[end + 1] == "^":
+        suffix = "^^" + term(t[end + 3:])
+    else:
+        suffix = t[end + 1:]
+    value = t[1:end]
+    if not canonical(value):
+        value = escape(unescape(value))
+    return '"' + value + '"' + suffix
+
+def iri(t):
+    # Return the decoded IRI (in angle brackets) as a unicode string
+    return unescape(t)
+
+def unescape(s):
+    try:
+        s = s.decode("utf-8")
+    except UnicodeDecodeError:
+        raise Unsupported("invalid UTF-8")
+    return UNESCAPE.sub(_unescape, s)
+
+def _unescape(m):
+    if m.group(1):
+        return unichr(int(m.group(1), 16))
+    if m.group(2):
+        # Works for narrow builds as well (surrogate pairs)
+        try:
+            return ("\\U" + m.group(2)).decode("unicode_escape")
+        except UnicodeDecodeError:
+            raise Unsupported("invalid escape \\U" + m.group(2))
+    c = m.group(3)
+    return ESCAPES.get(c, c)
+
+def escape(s):
+    return ESCAPE.sub(_escape, s).encode("utf-8")
+
+def _escape(m):
+    c = m.group(0)
+    if len(c) == 2:
+        n = 0x10000 + ((ord(c[0]) - 0xd800) << 10) + (ord(c[1]) - 0xdc00)
+        return u"\\U%08X" % n
+    n = ord(c)
+    if c in u'"\\':
+        return u"\\" + c
+    if c == u"\t":
+        return u"\\t"
+    if c == u"\n":
+        return u"\\n"
+    if c == u"\r":
+        return u"\\r"
+    if n > 0xffff:
+        return u"\\U%08X" % n
+    return u"\\u%04X" % n
@@ -0,0 +1,174 @@
+import collections
+import threading
+
+# Snapshot policies decide whether a new revision of a resource is stored as
+# a snapshot rather than a delta. Policies are configured per repository with
+# a short specification string `name[:argument]`, e.g. "size:10" or "chain:16".
+#
+# All policies are asked the same question: given a delta chain consisting of
+# a base snapshot of size `blen` and deltas of sizes `dlens`, should the chain
+# be ended by storing a snapshot of size `slen` instead of appending another
+# delta of size `plen`? For reverse-delta repositories the question is whether
+# the previous latest snapshot should be kept instead of being replaced by a
+# backward delta, the new snapshot acting as the base of the chain.
+
+class Policy(object):
+    """Base class for snapshot policies, which implement
+    `snapshot(blen, dlens, plen, slen, stats=None)`, returning whether to
+    store a snapshot (see above), `stats` being the `RepoStats` of the
+    repository, if any."""
+
+    def __repr__(self):
+        return "<%s>" % self.spec
+
+class SizePolicy(Policy):
+    """Limits the accumulated size of deltas relative to the base snapshot.
+
+    For the base snapshot `base` and deltas `d1`, `d2`, ..., `dn` a new
+    snapshot is definitely stored if:
+
+    `factor * len(base) <= len(d1) + len(d2) + ... + len(dn)`
+
+    In short, larger factors will result in longer delta chains and likely
+    reduce storage size at the expense of higher reconstruction costs.
+    """
+
+    def __init__(self, factor=10.0):
+        self.factor = factor
+        self.spec = "size:%g" % factor
+
+    def snapshot(self, blen, dlens, plen, slen, stats=None):
+        return slen <= plen or self.factor * blen <= sum(dlens) + plen
+
+class ChainPolicy(Policy):
+    """Limits the number of deltas in a delta chain."""
+
+    def __init__(self, maxlen=16):
+        self.maxlen = int(maxlen)
+        self.spec = "chain:%d" % self.maxlen
+
+    def snapshot(self, blen, dlens, plen, slen, stats=None):
+        return slen <= plen or len(dlens) + 1 > self.maxlen
+
+class CostPolicy(Policy):
+    """Weighs expected reconstruction time against additional storage.
+
+    The time to reconstruct a revision is estimated from the compressed size
+    of its delta chain, the observed decompression throughput and a fixed
+    overhead per blob. A snapshot is stored if the time saved for the reads
+    expected per write (the observed read/write ratio) outweighs the storage
+    it takes up in addition to a delta, `price` being the exchange rate in
+    seconds per byte.
+    """
+
+    def __init__(self, price=1e-6):
+        self.price = price
+        self.spec = "cost:%g" % price
+
+    def snapshot(self, blen, dlens, plen, slen, stats=None):
+        if slen <= plen:
+            return True
+
+        stats = stats or RepoStats()
+        tput, overhead = stats.throughput(), stats.overhead()
+
+        chain = (blen + sum(dlens) + plen) / tput + (len(dlens) + 2) * overhead
+        snap = slen / tput + overhead
+
+        return stats.ratio() * (chain - snap) >= self.price * (slen - plen)
+
+POLICIES = dict(
+    size=SizePolicy,
+    chain=ChainPolicy,
+    cost=CostPolicy,
+)
+
+_loaded = {}
+
+def load(spec):
+    """Return the policy for the given specification, e.g. "size:10"."""
+    try:
+        return _loaded[spec]
+    except KeyError:
+        pass
+
+    name, _, arg = spec.partition(":")
+
+    try:
+        cls = POLICIES[name]
+        policy = arg and cls(float(arg)) or cls()
+    except (KeyError, ValueError):
+        raise ValueError("invalid snapshot policy: %r" % spec)
+
+    _loaded[spec] = policy
+    return policy
+
+class RepoStats(object):
+    """Read/write and reconstruction statistics of a single repository."""
+
+    # Assumed until enough reconstructions have been observed
+    THROUGHPUT = 20e6   # compressed bytes decompressed and replayed per second
+    OVERHEAD = 0.00005  # seconds per blob (transfer, decompressor setup)
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.reconstructions = 0
+        self.rtime = 0.0 # total reconstruction time
+        self.rbytes = 0 # total compressed bytes reconstructed from
+        self.rblobs = 0 # total number of blobs reconstructed from
+
+    def ratio(self):
+        return (self.reads + 1.0) / (self.writes + 1.0)
+
+    def throughput(self):
+        if self.reconstructions < 10 or self.rtime <= 0:
+            return self.THROUGHPUT
+        return self.rbytes / self.rtime
+
+    def overhead(self):
+        return self.OVERHEAD
+
+    def latency(self):
+        """Average reconstruction latency in seconds."""
+        if self.reconstructions == 0:
+            return 0.0
+        return self.rtime / self.reconstructions
+
+class Stats(object):
+    """Cheap in-process statistics for all repositories, used by policies."""
+
+    def __init__(self):
+        self._repos = collections.defaultdict(RepoStats)
+        self._lock = threading.Lock()
+
+    def get(self, repo):
+        with self._lock:
+            return self._repos[repo]
+
+    def read(self, repo):
+        with self._lock:
+            self._repos[repo].reads += 1
+
+    def write(self, repo, n=1):
+        with self._lock:
+            self._repos[repo].writes += n
+
+    def reconstruction(self, repo, seconds, blobs):
+        with self._lock:
+            stats = self._repos[repo]
+            stats.reconstructions += 1
+            stats.rtime += seconds
+            stats.rbytes += sum(map(len, blobs))
+            stats.rblobs += len(blobs)
+
+    def report(self):
+        """Return per-repository statistics as plain dicts."""
+        with self._lock:
+            return dict((repo, dict(
+                reads=s.reads,
+                writes=s.writes,
+                reconstructions=s.reconstructions,
+                latency=s.latency(),
+                throughput=s.throughput(),
+            )) for repo, s in self._repos.iteritems())
@@ -0,0 +1,131 @@
+import errno
+import os
+import signal
+import time
+
+from tornado.log import gen_log
+
+class Master(object):
+    """Pre-fork process manager.
+
+    Forks `processes` workers, each calling `run()`, and supervises them:
+
+    - Workers exiting unexpectedly are replaced by new ones.
+    - On SIGHUP, workers are replaced one at a time (rolling restart), each
+      new worker being started before the old one is asked to stop.
+    - On SIGTERM or SIGINT, all workers are asked to stop and the master
+      exits once they are gone. A second signal kills the workers.
+
+    Workers are asked to stop with SIGTERM and are expected to finish the
+    requests in progress before exiting. Sockets bound before `serve` is
+    called are shared by all workers. Note that workers are forked from the
+    master, so restarts do not load any changed code.
+    """
+
+    # Minimum time between two forks replacing failed workers
+    BACKOFF = 1.0
+
+    def __init__(self, processes, run):
+        self.processes = processes
+        self.run = run
+        self.workers = set() # pids of running workers
+        self.retiring = set() # pids of workers asked to stop for a restart
+        self.restarts = [] # pids of workers still to be restarted
+        self.stopping = False
+        self.signals = []
+        self.failed = 0 # time of the last replacement of a failed worker
+
+    def serve(self):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self.signal)
+
+        for _ in xrange(self.processes):
+            self.spawn()
+
+        while self.workers:
+            self.handle()
+
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+
+            self.reap(pid, status)
+
+    def signal(self, sig, frame):
+        self.signals.append(sig)
+
+    def handle(self):
+        while self.signals:
+            sig = self.signals.pop(0)
+
+            if sig == signal.SIGHUP and not self.stopping:
+                gen_log.info("restarting %d workers", len(self.workers))
+                self.restarts = list(self.workers - self.retiring)
+                if not self.retiring:
+                    self.rollover()
+            elif self.stopping:
+                gen_log.info("killing %d workers", len(self.workers))
+                self.kill(signal.SIGKILL)
+            elif sig != signal.SIGHUP:
+                gen_log.info("stopping %d workers", len(self.workers))
+                self.stopping = True
+                self.kill(signal.SIGTERM)
+
+    def spawn(self):
+        pid = os.fork()
+
+        if pid == 0:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(sig, signal.SIG_DFL)
+            code = 1
+            try:
+                self.run()
+                code = 0
+            except Exception:
+                gen_log.exception("worker %d failed", os.getpid())
+            finally:
+                os._exit(code)
+
+        self.workers.add(pid)
+
+    def reap(self, pid, status):
+        if pid not in self.workers:
+            return
+
+        self.workers.discard(pid)
+
+        if self.stopping:
+            return
+
+        if pid in self.retiring:
+            self.retiring.discard(pid)
+            self.rollover()
+        else:
+            gen_log.warning("worker %d exited with status %d, replacing it",
+                pid, status)
+            pause = self.failed + self.BACKOFF - time.time()
+            if pause > 0:
+                time.sleep(pause)
+            self.failed = time.time()
+            self.spawn()
+
+    def rollover(self):
+        # Replace the next worker due to be restarted
+        while self.restarts:
+            pid = self.restarts.pop(0)
+            if pid in self.workers:
+                self.spawn()
+                self.retiring.add(pid)
+                os.kill(pid, signal.SIGTERM)
+                return
+
+    def kill(self, sig):
+        for pid in self.workers:
+            try:
+                os.kill(pid, sig)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
@@ -1,21 +1,26 @@
 #!/usr/bin/env python
 
-from database import MDB as Database
+from blobstore import Blobstore
+from database import from_url
 
-from config import dbconf, bsconf
+from config import dburl, bsconf
 from models import *
 
 import models
 
 if __name__ == "__main__":
-    database = Database(**dbconf)
-    blobstore = None # Blobstore(bsconf.nodes, **bsconf.opts)
+    database = from_url(dburl)
+    blobstore = (bsconf["nodes"] and
+        Blobstore(bsconf["nodes"], **bsconf["opts"]) or None)
     models.initialize(database, blobstore)
     database.create_tables([
         User,
         Token,
         Repo,
         HMap,
+        Stmt,
         CSet,
+        Head,
         Blob,
+        Dictionary,
     ])
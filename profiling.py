@@ -0,0 +1,144 @@
+import cProfile
+import collections
+import datetime
+import hmac
+import logging
+import os
+import random
+import time
+
+# Profiling of single requests: the time taken by each phase of a request
+# (e.g. the chain query, blob transfer, restoring and sending a memento; see
+# `RequestHandler.lap`) and the SQL statements it executed (see
+# `database.Queries`). Requests taking longer than `slow_request_time`
+# seconds are written to the "tailr.slow" log with their phases and SQL.
+#
+# In addition, requests can be profiled in full with cProfile, covering the
+# work done in the worker threads and the production of streamed responses:
+# those carrying the secret `profile_token` in an "X-Profile" header, and a
+# random sample of `profile_rate` of all requests. Their report is always
+# logged, and the profiler statistics are written to `profile_dir` (if
+# set), to be read with `pstats` or a viewer like snakeviz.
+
+log = logging.getLogger("tailr.slow")
+
+# Reports show up to this many parameters of a statement, shortened to this
+# many characters each
+PARAM_COUNT = 16
+PARAM_SIZE = 64
+
+class Profile(object):
+    """The phases and SQL statements of a request, profiled in full (with
+    cProfile) if `full`."""
+
+    def __init__(self, full=False):
+        self.phases = collections.OrderedDict() # name -> seconds
+        self.profiler = full and cProfile.Profile() or None
+        self.mark = time.time()
+
+    def lap(self, name):
+        """Add the time since the previous lap, or since entering `running`,
+        to the phase `name`."""
+        t = time.time()
+        self.phases[name] = self.phases.get(name, 0.0) + t - self.mark
+        self.mark = t
+
+    def running(self):
+        """Return a context manager starting a lap and running the profiler
+        (if any) in the current thread."""
+        return Running(self)
+
+    def report(self, summary, seconds, queries):
+        """Return a report on the request `summary` (method, URI and remote
+        IP) which took `seconds`, with the statements logged by `queries`."""
+        lines = ["%.2fms %s: %s; %d queries, %.2fms" % (1000.0 * seconds,
+            summary, ", ".join("%s %.2fms" % (name, 1000.0 * t)
+                for name, t in self.phases.iteritems()) or "no phases",
+            queries.count, 1000.0 * queries.time)]
+        for sql, params, t in queries.log or ():
+            lines.append("  %8.2fms %s %s" % (1000.0 * t, sql,
+                shorten(params)))
+        if queries.log and len(queries.log) < queries.count:
+            lines.append("  (%d more)" % (queries.count - len(queries.log)))
+        return "\n".join(lines)
+
+    def dump(self, directory, name):
+        """Write the profiler statistics to a file in `directory`, named
+        after the time and `name`, and return its path."""
+        path = os.path.join(directory, "%s-%s.prof" % (
+            datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S.%f"), name))
+        self.profiler.dump_stats(path)
+        return path
+
+class Running(object):
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __enter__(self):
+        self.profile.mark = time.time()
+        if self.profile.profiler is not None:
+            self.profile.profiler.enable()
+
+    def __exit__(self, *exc_info):
+        if self.profile.profiler is not None:
+            self.profile.profiler.disable()
+
+class NoProfile(object):
+    """Stands in for the profile of requests not profiled at all."""
+
+    def lap(self, name):
+        pass
+
+    def running(self):
+        return NOOP
+
+class Noop(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+NOOP = Noop()
+NOPROFILE = NoProfile()
+
+def start(settings, request):
+    """Return the profile of a request: a `Profile` if it is profiled in full
+    or slow requests are logged, `None` otherwise."""
+    token = settings.get("profile_token")
+    full = (token and hmac.compare_digest(
+            request.headers.get("X-Profile", ""), token) or
+        random.random() < settings.get("profile_rate", 0.0))
+    if full or settings.get("slow_request_time"):
+        return Profile(full)
+    return None
+
+def finish(settings, profile, summary, seconds, queries, name):
+    """Log the report on a finished request if it was profiled in full or
+    took `slow_request_time` seconds or longer, writing the profiler
+    statistics (named after `name`) to `profile_dir` if set."""
+    full = profile.profiler is not None
+    threshold = settings.get("slow_request_time")
+    if not full and not (threshold and seconds >= threshold):
+        return
+    report = profile.report(summary, seconds, queries)
+    if full and settings.get("profile_dir"):
+        path = profile.dump(settings["profile_dir"], name)
+        report += "\n  profile written to %s" % path
+    log.warning("%s", report)
+
+def shorten(params):
+    # Statement parameters for reports, binary values in hex
+    values = []
+    for value in params[:PARAM_COUNT]:
+        if isinstance(value, (str, buffer)):
+            value = str(value[:PARAM_SIZE])
+            if any(c < " " or c > "~" for c in value):
+                value = value.encode("hex")
+        value = repr(value)
+        if len(value) > PARAM_SIZE:
+            value = value[:PARAM_SIZE - 3] + "..."
+        values.append(value)
+    if len(params) > PARAM_COUNT:
+        values.append("... (%d more)" % (len(params) - PARAM_COUNT))
+    return values and "[" + ", ".join(values) + "]" or ""
@@ -0,0 +1,464 @@
+import bisect
+import collections
+import cStringIO
+import hashlib
+import itertools
+import string
+import tempfile
+import threading
+import time
+
+import RDF
+
+from models import Repo, CSet
+
+import compression
+import ntriples
+import stmtdict
+
+# Revision engine: parsing pushed RDF into sets of statement lines, encoding
+# states as compressed snapshots and deltas (see `revise`), and restoring
+# states from delta chains (see `replay`). None of it touches the database
+# or HTTP, so it runs as well in the worker threads of the API handlers as
+# in offline tools (`convert.py`, `bench/micro.py`).
+
+# Blob data is compressed with the codec configured for the repository (see
+# `compression`) and decompressed with the codec it was compressed with.
+
+def compress(s, codec=compression.DEFAULT):
+    return codec.compress(s)
+
+# Number of lines passed to the compressor at once by `compress_lines`
+COMPRESS_BATCH = 4096
+
+# Compress lines joined by newlines, same as `compress(join(lines, "\n"))`,
+# without building the joined string (or even a list of the lines).
+def compress_lines(lines, codec=compression.DEFAULT):
+    c = codec.compressobj()
+    out = [c.compress(s) for s in joined(lines, "\n", COMPRESS_BATCH)]
+    out.append(c.flush())
+    return join(out, "")
+
+def decompress(s):
+    return compression.codec(s).decompress(s)
+
+# Decompress `s` in chunks of at most `size` bytes, same as `decompress(s)`.
+# The codec (and its dictionary, if any) is loaded right away.
+def decompress_chunks(s, size):
+    return compression.codec(s).decompress_chunks(s, size)
+
+# Decompress the statements of a snapshot `s` in chunks of at most `size`
+# bytes, without the marker line of sorted snapshots (see `SORTED`). The
+# codec is loaded and the first chunk decompressed right away, the others as
+# they are consumed.
+def content(s, size):
+    chunks, head = iter(decompress_chunks(s, size)), ""
+    for chunk in chunks:
+        head += chunk
+        if len(head) > len(SORTED):
+            break
+    if head.startswith(SORTED):
+        head = head[len(SORTED) + 1:]
+    return itertools.chain(head and [head] or [], chunks)
+
+def shasum(s):
+    return hashlib.sha1(s).digest()
+
+# Request bodies up to this size are kept in memory, larger ones are spooled
+# to a temporary file.
+SPOOL_SIZE = 1024**2
+
+class Spool(object):
+    """Buffer for a streamed request body, which is written to a temporary
+    file once it exceeds `maxmem` bytes. The Redland parsers read files in
+    chunks, so large bodies are never held in memory as a whole."""
+
+    def __init__(self, maxmem=SPOOL_SIZE):
+        self.maxmem = maxmem
+        self.size = 0
+        self.chunks = []
+        self.file = None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+
+        if self.file is not None:
+            self.file.write(chunk)
+        else:
+            self.chunks.append(chunk)
+
+            if self.size > self.maxmem:
+                self.file = tempfile.NamedTemporaryFile(prefix="tailr-")
+                self.file.write(join(self.chunks, ""))
+                self.chunks = None
+
+    def stream(self, parser, base):
+        if self.file is None:
+            return parser.parse_string_as_stream(join(self.chunks, ""), base)
+        self.file.flush()
+        return parser.parse_as_stream("file://" + self.file.name, base)
+
+    def lines(self):
+        if self.file is None:
+            for line in cStringIO.StringIO(join(self.chunks, "")):
+                yield line
+        else:
+            self.file.flush()
+            with open(self.file.name, "rb") as f:
+                for line in f:
+                    yield line
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.chunks = []
+
+# Parse a request body, given as a string or `Spool`, into a statement stream
+def rdfstream(parser, body):
+    if isinstance(body, Spool):
+        return body.stream(parser, "urn:x-default:tailr")
+    return parser.parse_string_as_stream(body, "urn:x-default:tailr")
+
+# Iterate over the lines of a request body, given as a string or `Spool`
+def rdflines(body):
+    if isinstance(body, Spool):
+        return body.lines()
+    return cStringIO.StringIO(body)
+
+# The Redland bindings share a single (global) librdf world, which is not
+# safe to be used by several worker threads at the same time.
+rdflock = threading.Lock()
+
+# Parse serialized RDF:
+#
+# RDF/XML:      application/rdf+xml
+# N-Triples:    application/n-triples
+# Turtle:       text/turtle
+#
+# N-Triples are parsed line by line without librdf (see `ntriples`), unless
+# they contain anything but IRIs and literals.
+def parse(s, fmt):
+    if fmt == "application/n-triples":
+        try:
+            return set(ntriples.triples(rdflines(s)))
+        except ntriples.Unsupported:
+            pass
+
+    stmts = set()
+    with rdflock:
+        parser = RDF.Parser(mime_type=fmt)
+        for st in rdfstream(parser, s):
+            stmts.add(str(st) + " .")
+    return stmts
+
+# Parse serialized RDF with named graphs into a mapping from graph names
+# to sets of N-Quad lines (statements without their graph name):
+#
+# N-Quads:      application/n-quads
+# TriG:         application/trig
+#
+# Raises a `ValueError` for statements in the default graph. N-Quads are
+# parsed without librdf, unless they contain anything but IRIs and literals.
+def parse_graphs(s, fmt):
+    if fmt == "application/n-quads":
+        try:
+            graphs = {}
+            for name, stmt in ntriples.quads(rdflines(s)):
+                graphs.setdefault(name, set()).add(stmt)
+            return graphs
+        except ntriples.Unsupported:
+            pass
+
+    graphs = {}
+    with rdflock:
+        parser = RDF.Parser(mime_type=fmt)
+        stream = rdfstream(parser, s)
+        for st, ctx in stream.context_iter():
+            if ctx is None or not ctx.is_resource():
+                raise ValueError("statement outside of a named graph")
+            name = str(ctx.uri).decode("utf-8")
+            graphs.setdefault(name, set()).add(str(st) + " .")
+    return graphs
+
+def join(parts, sep):
+    return string.joinfields(parts, sep)
+
+# Join `parts` with `sep` in pieces of up to `count` parts, yielding strings
+# which concatenated are the same as `join(parts, sep)`.
+def joined(parts, sep, count):
+    it, prefix = iter(parts), ""
+    while True:
+        batch = list(itertools.islice(it, count))
+        if not batch:
+            break
+        yield prefix + join(batch, sep)
+        prefix = sep
+
+def chunked(seq, size):
+    for i in xrange(0, len(seq), size):
+        yield seq[i:i + size]
+
+# Snapshots and deltas of statement lines start with this line, followed by
+# the statements (or delta lines) sorted by statement, so that states can be
+# replayed and compared as streams, merging them line by line (see `replay`
+# and `diff`). Blobs stored before carry no marker and are not sorted; they
+# are restored in memory.
+SORTED = "#sorted"
+
+# Decompressed bytes per chunk when streaming the lines of a blob
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Drop the marker line of sorted snapshots and deltas, if any.
+def unmarked(lines):
+    if lines and lines[0] == SORTED:
+        del lines[0]
+    return lines
+
+# Reconstruct a set of statements from the (compressed) blob data of a delta
+# chain: a base snapshot followed by 0 or more deltas, ordered by time.
+def reconstruct(blobs):
+    stmts = set()
+
+    for i, blob in enumerate(blobs):
+        lines = unmarked(decompress(blob).splitlines())
+
+        if i == 0:
+            # Base snapshot for the delta chain
+            stmts.update(lines)
+        else:
+            for line in lines:
+                mode, stmt = line[0], line[2:]
+                if mode == "A":
+                    stmts.add(stmt)
+                else:
+                    stmts.discard(stmt)
+
+    return stmts
+
+# Apply the (compressed) delta `blob` to a copy of the state `stmts`.
+def patch(stmts, blob):
+    stmts = set(stmts)
+    for line in unmarked(decompress(blob).splitlines()):
+        mode, stmt = line[0], line[2:]
+        if mode == "A":
+            stmts.add(stmt)
+        else:
+            stmts.discard(stmt)
+    return stmts
+
+# Iterate over the lines of the (compressed) blob data in chunks (lists of
+# lines), as it is decompressed.
+def stream(blob):
+    rest = ""
+    for chunk in decompress_chunks(blob, STREAM_CHUNK_SIZE):
+        lines = (rest + chunk).split("\n")
+        rest = lines.pop()
+        yield lines
+    if rest:
+        yield [rest]
+
+# Iterate over the lines of a sorted blob in chunks, without the marker line,
+# or return `None` if the blob is not sorted.
+def sorted_stream(blob):
+    chunks = stream(blob)
+    for lines in chunks:
+        if lines:
+            if lines[0] != SORTED:
+                return None
+            return itertools.chain([lines[1:]], chunks)
+    return None
+
+# Return an iterator over the statements of the state restored from the blob
+# data of a delta chain (see `reconstruct`) in sorted chunks. Sorted blobs
+# are merged as the chunks are consumed, holding no more than a chunk of each
+# in memory; their codecs are loaded and their first chunks decompressed
+# right away. Chains with unsorted blobs (stored before they were sorted)
+# are restored at once.
+def replay(blobs):
+    streams = [sorted_stream(blob) for blob in blobs]
+
+    if any(chunks is None for chunks in streams):
+        return iter([sorted(reconstruct(blobs))])
+
+    stmts = streams[0]
+    for delta in streams[1:]:
+        stmts = merge(stmts, delta)
+
+    return stmts
+
+# Apply the sorted `delta` lines to the sorted statements `stmts`, both in
+# chunks. Chunks of statements without changes are passed on as they are.
+def merge(stmts, delta):
+    lines = itertools.chain.from_iterable(delta)
+    line = next(lines, None)
+
+    for chunk in stmts:
+        if not chunk:
+            continue
+        last, changes = chunk[-1], []
+        while line is not None and line[2:] <= last:
+            changes.append(line)
+            line = next(lines, None)
+        if changes:
+            chunk = apply(chunk, changes)
+        yield chunk
+
+    rest = itertools.chain(line is not None and [line] or [], lines)
+    added = [d[2:] for d in rest if d[0] == "A"]
+    if added:
+        yield added
+
+# Apply the sorted delta `lines` to the sorted list of statements `stmts`.
+def apply(stmts, lines):
+    out, i = [], 0
+    for line in lines:
+        stmt = line[2:]
+        j = bisect.bisect_left(stmts, stmt, i)
+        out.extend(stmts[i:j])
+        i = j < len(stmts) and stmts[j] == stmt and j + 1 or j
+        if line[0] == "A":
+            out.append(stmt)
+    out.extend(stmts[i:])
+    return out
+
+# Iterate over the delta lines for the statements only in one of the states,
+# the sorted chunks `prev` (prefixed with `a`) or the sorted list `stmts`
+# (prefixed with `b`), in order. Chunks of `prev` matching the corresponding
+# statements of `stmts` are skipped as a whole.
+def changes(prev, stmts, a="D ", b="A "):
+    i = 0
+    for chunk in prev:
+        if not chunk:
+            continue
+        j = bisect.bisect_right(stmts, chunk[-1], i)
+        part = stmts[i:j]
+        if part != chunk:
+            old, new = set(chunk), set(part)
+            for stmt, op in sorted([(s, a) for s in old - new] +
+                                   [(s, b) for s in new - old]):
+                yield op + stmt
+        i = j
+    for stmt in stmts[i:]:
+        yield b + stmt
+
+# Return the statements of a state, given as a set or a sorted list, in order.
+def ordered(stmts):
+    if isinstance(stmts, (set, frozenset)):
+        return sorted(stmts)
+    return stmts
+
+# Whether the state `stmts` is given as a set or a sorted list, rather than
+# as sorted chunks (see `replay`).
+def listed(stmts):
+    return isinstance(stmts, (list, set, frozenset))
+
+# Compress the state `stmts` as a (sorted) snapshot.
+def snapshot(stmts, codec=compression.DEFAULT):
+    return compress_lines(itertools.chain([SORTED], ordered(stmts)), codec)
+
+# Compress the delta between the states `prev` and `stmts`, or return `None`
+# if they are the same. One of them may be given in sorted chunks, which are
+# consumed once, in order.
+def diff(prev, stmts, codec=compression.DEFAULT):
+    if listed(stmts):
+        prev = listed(prev) and [ordered(prev)] or prev
+        lines = changes(prev, ordered(stmts))
+    else:
+        lines = changes(stmts, ordered(prev), "A ", "D ")
+    first = next(lines, None)
+    if first is None:
+        return None
+    return compress_lines(itertools.chain([SORTED, first], lines), codec)
+
+# Compress an empty delta.
+def nochange(codec=compression.DEFAULT):
+    return compress(SORTED, codec)
+
+# Yield the items of the iterator `it` (e.g. chunks of statements), passing
+# the time spent producing them to `done` once it is exhausted.
+def measured(it, done):
+    seconds = 0.0
+    while True:
+        t = time.time()
+        item = next(it, None)
+        seconds += time.time() - t
+        if item is None:
+            break
+        yield item
+    done(seconds)
+
+# Storage layouts (see `Repo.layout`): functions to compress states as
+# snapshots and deltas (`None` for unchanged states), to compress an empty
+# delta and to restore states. States are sets, sorted lists or sorted chunks
+# of statement lines, or sorted arrays of statement ids (see `stmtdict`).
+Layout = collections.namedtuple("Layout",
+    "snapshot delta empty reconstruct patch")
+
+LINES = Layout(snapshot, diff, nochange, reconstruct, patch)
+
+IDS = Layout(stmtdict.snapshot, stmtdict.delta, stmtdict.empty,
+    stmtdict.reconstruct, stmtdict.patch)
+
+LAYOUTS = {Repo.LINES: LINES, Repo.IDS: IDS}
+
+# Determine the changeset to be stored for the new state `stmts` of a resource,
+# given its current delta `chain` and its previous state `prev` (reconstructed
+# from the chain). The snapshot `policy` decides whether to store a snapshot
+# or a delta, taking the repository `stats` into account. Returns a tuple
+# `(type, data)` or `None` if the state did not change. Changesets are
+# compressed with `codec`, states being encoded in the given `layout`.
+def revise(chain, prev, stmts, policy, stats=None,
+           codec=compression.DEFAULT, layout=LINES):
+    snapc = layout.snapshot(stmts, codec)
+
+    if len(chain) == 0 or chain[0].type == CSet.DELETE:
+        # Provide dummy value for `patch` which is never stored.
+        # If we get here, we always store a snapshot later on!
+        patch = ""
+    else:
+        patch = layout.delta(prev, stmts, codec)
+
+        if patch is None:
+            # No changes, nothing to be done.
+            return None
+
+    if (len(chain) == 0 or chain[0].type == CSet.DELETE or
+        policy.snapshot(chain[0].len, [e.len for e in chain[1:]],
+            len(patch), len(snapc), stats)):
+        # Store the current state as a new snapshot
+        return CSet.SNAPSHOT, snapc
+    else:
+        # Store a directed delta between the previous and current state
+        return CSet.DELTA, patch
+
+# Determine the changes to be stored for the new state `stmts` of a resource
+# in a reverse-delta repository. In these, the latest revision is always
+# stored as a snapshot and older revisions as deltas relative to the next
+# newer one. `chain` holds the changesets after the second latest "non-delta",
+# i.e. the latest snapshot `chain[-1]` preceded by the deltas leading back from
+# it, and `prev` is the previous state. Returns a tuple `(snapshot, delta)`,
+# where `delta` is the backward delta replacing the previous latest snapshot
+# (or `None` if it is kept, as decided by the snapshot `policy`), or `None` if
+# the state did not change.
+def revise_reverse(chain, prev, stmts, policy, stats=None,
+                   codec=compression.DEFAULT, layout=LINES):
+    snapc = layout.snapshot(stmts, codec)
+
+    if len(chain) == 0 or chain[-1].type == CSet.DELETE:
+        return snapc, None
+
+    back = layout.delta(stmts, prev, codec)
+
+    if back is None:
+        # No changes, nothing to be done.
+        return None
+
+    # The new snapshot is the base of the deltas leading back from it,
+    # should the previous snapshot be replaced by the backward delta.
+    if policy.snapshot(len(snapc), [e.len for e in chain[:-1]], len(back),
+        chain[-1].len, stats):
+        # Keep the previous snapshot, starting a new delta chain
+        return snapc, None
+    else:
+        return snapc, back
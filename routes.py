@@ -2,6 +2,7 @@ from tornado.web import url
 
 import handlers.web
 import handlers.api
+import handlers.metrics
 
 routes = [
     url(r"/", handlers.web.HomeHandler, name="web:home"),
@@ -19,9 +20,12 @@ routes = [
         name="web:new-token"),
     url(r"/settings/tokens/([0-9]+)/del", handlers.web.DelTokenHandler,
         name="web:del-token"),
+    url(r"/metrics", handlers.metrics.MetricsHandler, name="metrics"),
     url(r"/([^/]+)", handlers.web.UserHandler, name="web:user"),
     url(r"/([^/]+)/([^/]+)", handlers.web.RepoHandler, name="web:repo"),
     url(r"/api/([^/]+)/([^/]+)", handlers.api.RepoHandler, name="api:repo"),
+    url(r"/api/([^/]+)/([^/]+)/batch", handlers.api.BatchHandler,
+        name="api:batch"),
     url(r".*", handlers.web.ErrorHandler, dict(status_code=404)), # catch all
 ]
 
@@ -41,13 +45,18 @@ routes = [
 # GET   /settings/tokens/new            Provide information for a new API token
 # POST  /settings/tokens/new            Generate a new API token
 # POST  /settings/tokens/:id/del        Delete API token
+# GET   /metrics                        Process metrics (Prometheus format)
 # GET   /:user                          User page
 # GET   /:user/:repo                    Repository access
 #
 # PUT   /api/:user/:repo?key=URI
 # PUT   /api/:user/:repo?key=URI&datetime=DATETIME
+# PUT   /api/:user/:repo/batch
+# PUT   /api/:user/:repo/batch?datetime=DATETIME
 #
 # GET   /api/:user/:repo?key=URI
 # GET   /api/:user/:repo?key=URI&datetime=DATETIME
 # GET   /api/:user/:repo?key=URI&timemap=true
-# GET   /api/:user/:repo?index=true&page=1
+# GET   /api/:user/:repo?index=true
+# GET   /api/:user/:repo?index=true&after=CURSOR
+# GET   /api/:user/:repo?stats=true
@@ -0,0 +1,146 @@
+import hashlib
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # optional: pip install numpy
+
+import compression
+
+from models import Stmt
+
+# Statement dictionary for repositories storing statement ids (see
+# `Repo.IDS`): every distinct statement line is stored once in the `stmt`
+# table, shared by all resources and repositories, and the snapshots and
+# deltas of resources hold sorted arrays of statement ids instead of lines.
+# Differences between states and the replay of deltas then are operations
+# on integer arrays, and the statements of a state are looked up by id when
+# it is served.
+#
+# Decompressed blob data starts with `MAGIC`, followed by:
+#
+# snapshots:    the ids of the statements
+# deltas:       the number of removed ids, the removed ids and the added ids
+#
+# Each list of ids is sorted and stored as the differences to the preceding
+# id (the first one as is), 32-bit unsigned little endian integers, which
+# compress much better than the ids themselves.
+
+MAGIC = "\x00ids"
+
+DTYPE = "<u4"
+
+# Number of statements per query when interning or resolving statements
+CHUNK_SIZE = 1000
+
+def intern(stmts):
+    """Return a dict mapping the statement lines `stmts` to their ids,
+    adding the ones not known yet to the dictionary."""
+    require()
+
+    shas = dict((hashlib.sha1(s).digest(), s) for s in stmts)
+
+    ids = lookup(shas.keys())
+    missing = [sha for sha in shas if sha not in ids]
+
+    # Statements interned concurrently by other requests are ignored, the
+    # ids are looked up afterwards either way
+    for i in xrange(0, len(missing), CHUNK_SIZE):
+        Stmt._meta.database.insert_ignore(Stmt
+            .insert_many([dict(sha=sha, val=shas[sha])
+                for sha in missing[i:i + CHUNK_SIZE]]))
+
+    ids.update(lookup(missing))
+
+    return dict((shas[sha], id) for sha, id in ids.iteritems())
+
+def lookup(shas):
+    # Return the ids of the statements with the given digests, if known
+    ids = {}
+    for i in xrange(0, len(shas), CHUNK_SIZE):
+        rows = (Stmt
+            .select(Stmt.sha, Stmt.id)
+            .where(Stmt.sha << shas[i:i + CHUNK_SIZE])
+            .tuples())
+        ids.update(rows.iterator())
+    return ids
+
+def resolve(ids):
+    """Return the statement lines for an array of statement ids."""
+    ids = ids.tolist()
+    stmts = []
+    for i in xrange(0, len(ids), CHUNK_SIZE):
+        part = ids[i:i + CHUNK_SIZE]
+        rows = (Stmt
+            .select(Stmt.val)
+            .where(Stmt.id << part)
+            .tuples())
+        stmts.extend(str(val) for val, in rows.iterator())
+        if len(stmts) != i + len(part):
+            raise LookupError("unknown statement ids")
+    return stmts
+
+def array(ids):
+    """Return a sorted array of the (distinct) statement ids `ids`."""
+    return numpy.unique(numpy.fromiter(ids, dtype=numpy.uint32))
+
+def snapshot(ids, codec=compression.DEFAULT):
+    """Compress the state `ids` as a snapshot."""
+    return codec.compress(MAGIC + pack(ids))
+
+def delta(prev, ids, codec=compression.DEFAULT):
+    """Compress the delta between the states `prev` and `ids`, or return
+    `None` if they are the same."""
+    removed = numpy.setdiff1d(prev, ids, assume_unique=True)
+    added = numpy.setdiff1d(ids, prev, assume_unique=True)
+    if len(removed) == 0 and len(added) == 0:
+        return None
+    return codec.compress(MAGIC + struct.pack("<I", len(removed)) +
+        pack(removed) + pack(added))
+
+def empty(codec=compression.DEFAULT):
+    """Compress an empty delta."""
+    return codec.compress(MAGIC + struct.pack("<I", 0))
+
+def reconstruct(blobs):
+    """Restore a state from the (compressed) blob data of a delta chain:
+    a base snapshot followed by 0 or more deltas, ordered by time."""
+    require()
+
+    ids = None
+
+    for blob in blobs:
+        if ids is None:
+            ids = unpack(decode(blob), len(MAGIC))
+        else:
+            ids = patch(ids, blob)
+
+    return ids
+
+def patch(ids, blob):
+    """Apply the (compressed) delta `blob` to the state `ids`."""
+    data = decode(blob)
+    start = len(MAGIC) + 4
+    count, = struct.unpack_from("<I", data, len(MAGIC))
+    removed = unpack(data, start, count)
+    added = unpack(data, start + count * 4)
+    return numpy.union1d(
+        numpy.setdiff1d(ids, removed, assume_unique=True), added)
+
+def require():
+    if numpy is None:
+        raise RuntimeError("ids: the numpy module is not installed")
+
+def decode(blob):
+    data = compression.codec(blob).decompress(blob)
+    if not data.startswith(MAGIC):
+        raise ValueError("ids: not a statement id snapshot or delta")
+    return data
+
+def pack(ids):
+    return numpy.ediff1d(ids, to_begin=ids[:1]).astype(DTYPE).tostring()
+
+def unpack(data, offset, count=-1):
+    return numpy.cumsum(numpy.frombuffer(data, DTYPE, count, offset),
+        dtype=numpy.uint32)
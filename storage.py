@@ -0,0 +1,341 @@
+from peewee import JOIN_LEFT_OUTER, fn
+
+from models import HMap, CSet, Head, Blob
+from revision import chunked
+
+# Storage engine: the queries of the API handlers on the key mappings,
+# changesets, blobs and heads of resources (see `models`). They run on any
+# of the databases returned by `database.from_url`, MariaDB/MySQL or an
+# embedded SQLite database, which implement the few statements differing
+# between them (`insert_ignore`, `insert_newer`, `row_in`).
+#
+# Delta chains are lists of changesets with at least `time` and `type`
+# attributes: in forward-delta repositories, the last "non-delta" and the
+# deltas following it; in reverse-delta repositories, the latest snapshot
+# or delete and the deltas leading back from it.
+
+class Storage(object):
+    """Storage engine on top of the peewee `database`."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def atomic(self):
+        """Return a context manager running its queries in a transaction."""
+        return self.database.atomic()
+
+    # Single resources, identified by the SHA-1 digest `sha` of their key
+
+    def latest(self, repo, sha):
+        """Return the head of a resource (see `Head`) or `None`."""
+        return (Head
+            .select(Head.time, Head.type, Head.base)
+            .where((Head.repo == repo) & (Head.hkey == sha))
+            .naive()
+            .first())
+
+    def resource(self, repo, sha):
+        """Return the key mapped to `sha` (`None` if not mapped yet) and the
+        current delta chain of the resource (with `len` attributes), in one
+        query."""
+        rows = list(HMap
+            .select(HMap.val, CSet.time, CSet.type, CSet.len)
+            .join(Head, JOIN_LEFT_OUTER, on=(
+                (Head.repo == repo) &
+                (Head.hkey == HMap.sha)))
+            .join(CSet, JOIN_LEFT_OUTER, on=(
+                (CSet.repo == Head.repo) &
+                (CSet.hkey == Head.hkey) &
+                (CSet.time >= Head.base)))
+            .where(HMap.sha == sha)
+            .order_by(CSet.time)
+            .naive())
+
+        if len(rows) == 0:
+            return None, []
+
+        return rows[0].val, [row for row in rows if row.time is not None]
+
+    def map(self, sha, key):
+        """Store the mapping of `sha` to `key`, unless stored concurrently,
+        and return whether `sha` is mapped to `key` (rather than another key,
+        in case of a collision)."""
+        if self.database.insert_ignore(HMap.insert(sha=sha, val=key)).rowcount:
+            return True
+        return HMap.select(HMap.val).where(HMap.sha == sha).scalar() == key
+
+    def chain(self, repo, sha, ts, reverse):
+        """Return the delta chain of the revision of a resource valid at `ts`,
+        ordered by time (descending in reverse-delta repositories, so that
+        it starts with the snapshot or delete), and whether the revision is
+        final: pushes are newer than the head, so the revision valid at any
+        time up to the head never changes."""
+        latest = self.latest(repo, sha)
+
+        if latest is None:
+            # A resource does not exist for the given key.
+            return [], False
+
+        final = ts <= latest.time
+
+        if latest.time <= ts:
+            # The latest revision is requested, its delta chain starts at
+            # the base of the head.
+            if reverse or latest.type == CSet.DELETE:
+                # The latest state is stored as a snapshot (or deleted)
+                return [latest], final
+
+            return list(CSet
+                .select(CSet.time, CSet.type)
+                .where(
+                    (CSet.repo == repo) &
+                    (CSet.hkey == sha) &
+                    (CSet.time >= latest.base))
+                .order_by(CSet.time)
+                .naive()), final
+
+        # The last change at or before `ts` and the base of its chain
+        last = (CSet
+            .select(CSet.time, CSet.base)
+            .where(
+                (CSet.repo == repo) &
+                (CSet.hkey == sha) &
+                (CSet.time <= ts))
+            .order_by(CSet.time.desc())
+            .limit(1)
+            .alias("last"))
+
+        if not reverse:
+            # Fetch all changes of its chain up to that change, ordered
+            # by time. The returned delta-chain consists of either:
+            # a snapshot followed by 0 or more deltas, or
+            # a single delete.
+            end = CSet.time <= last.c.time
+            order = CSet.time
+        else:
+            # Fetch all changes of its chain from that change onwards,
+            # ordered by time, descending. The delta-chain consists of
+            # either:
+            # a snapshot followed by 0 or more backward deltas, or
+            # a single delete.
+            end = CSet.time >= last.c.time
+            order = CSet.time.desc()
+
+        # A range scan on the (repo, hkey, base, time) index
+        return list(CSet
+            .select(CSet.time, CSet.type)
+            .join(last, on=((CSet.base == last.c.base) & end))
+            .where((CSet.repo == repo) & (CSet.hkey == sha))
+            .order_by(order)
+            .naive()), final
+
+    def blobs(self, repo, sha, times, reverse=False):
+        """Return the blob data of the changesets at `times`, ordered by time
+        (descending if `reverse`)."""
+        return [data for data, in Blob
+            .select(Blob.data)
+            .where(
+                (Blob.repo == repo) &
+                (Blob.hkey == sha) &
+                (Blob.time << times))
+            .order_by(reverse and Blob.time.desc() or Blob.time)
+            .tuples()
+            .iterator()]
+
+    def append(self, repo, sha, ts, cstype, data, base, codec):
+        """Store a changeset with its blob `data` (compressed with `codec`)
+        as the new head of a resource."""
+        Blob.create(repo=repo, hkey=sha, time=ts, data=data, codec=codec.id)
+        CSet.create(repo=repo, hkey=sha, time=ts, type=cstype, len=len(data),
+            base=base)
+        Head.advance([dict(repo=repo.id, hkey=sha, time=ts, type=cstype,
+            base=base)])
+
+    def replace(self, repo, sha, time, data, codec):
+        """Replace the snapshot of a resource at `time` with a (backward)
+        delta."""
+        (Blob
+            .update(data=data, codec=codec.id)
+            .where(
+                (Blob.repo == repo) &
+                (Blob.hkey == sha) &
+                (Blob.time == time))
+            .execute())
+        (CSet
+            .update(type=CSet.DELTA, len=len(data))
+            .where(
+                (CSet.repo == repo) &
+                (CSet.hkey == sha) &
+                (CSet.time == time))
+            .execute())
+
+    def delete(self, repo, sha, ts):
+        """Store a delete as the new head of a resource."""
+        CSet.create(repo=repo, hkey=sha, time=ts, type=CSet.DELETE, len=0,
+            base=ts)
+        Head.advance([dict(repo=repo.id, hkey=sha, time=ts,
+            type=CSet.DELETE, base=ts)])
+
+    def timemap(self, repo, sha):
+        """Return the times of all changes to a resource, latest first."""
+        return [t for t, in CSet
+            .select(CSet.time)
+            .where((CSet.repo == repo) & (CSet.hkey == sha))
+            .order_by(CSet.time.desc())
+            .tuples()
+            .iterator()]
+
+    # Repositories
+
+    def index(self, repo, ts, after, page, size):
+        """Return a page of `size` rows `(sha, key, type)` of the latest
+        changes at `ts` of all resources, ordered by `sha` and following
+        `after` (if given)."""
+        where = (CSet.repo == repo) & (CSet.time <= ts)
+
+        if after is not None:
+            # Seek to the cursor in the primary key (repo, hkey, time)
+            where &= CSet.hkey > after
+
+        # Subquery for selecting max. time per hkey group
+        mx = (CSet
+            .select(CSet.hkey, fn.Max(CSet.time).alias("maxtime"))
+            .where(where)
+            .group_by(CSet.hkey)
+            .order_by(CSet.hkey)
+            .paginate(page, size)
+            .alias("mx"))
+
+        # Query for all the relevant csets (those with max. time values)
+        cs = (CSet
+            .select(CSet.hkey, CSet.type)
+            .join(mx, on=(
+                (CSet.hkey == mx.c.hkey_id) &
+                (CSet.time == mx.c.maxtime)))
+            .where(CSet.repo == repo)
+            .alias("cs"))
+
+        # Join with the hmap table to retrieve the plain key values
+        return list(HMap
+            .select(HMap.sha, HMap.val, cs.c.type)
+            .join(cs, on=(HMap.sha == cs.c.hkey_id))
+            .order_by(HMap.sha)
+            .tuples()
+            .iterator())
+
+    def current(self, repo, after, page, size):
+        """Return a page of `size` rows `(sha, key)` of the resources existing
+        now, read from the heads (see `index`)."""
+        where = (Head.repo == repo) & (Head.type != CSet.DELETE)
+
+        if after is not None:
+            where &= Head.hkey > after
+
+        return list(HMap
+            .select(HMap.sha, HMap.val)
+            .join(Head, on=(Head.hkey == HMap.sha))
+            .where(where)
+            .order_by(Head.hkey)
+            .paginate(page, size)
+            .tuples()
+            .iterator())
+
+    def sizes(self, repo):
+        """Return the number and total size of changesets by type, and the
+        number of blobs per compression format."""
+        sizes = (CSet
+            .select(CSet.type, fn.Count(CSet.time), fn.Sum(CSet.len))
+            .where(CSet.repo == repo)
+            .group_by(CSet.type)
+            .tuples())
+
+        storage = dict(snapshots=0, deltas=0, deletes=0, bytes=0)
+
+        for cstype, count, size in sizes.iterator():
+            name = ("snapshots", "deltas", "deletes")[cstype]
+            storage[name] = count
+            storage["bytes"] += int(size or 0)
+
+        codecs = (Blob
+            .select(Blob.codec, fn.Count(Blob.time))
+            .where(Blob.repo == repo)
+            .group_by(Blob.codec)
+            .tuples())
+
+        storage["codecs"] = dict((("zlib", "zstd")[codec], count)
+            for codec, count in codecs.iterator())
+
+        return storage
+
+    # Many resources at once (batch pushes), up to a few hundred per call
+
+    def mappings(self, shas):
+        """Return the `(sha, key)` mappings of the digests `shas`."""
+        return (HMap
+            .select(HMap.sha, HMap.val)
+            .where(HMap.sha << shas)
+            .tuples()
+            .iterator())
+
+    def chains(self, repo, shas):
+        """Return the changesets of the current delta chain of each of the
+        resources `shas`, starting at the base of its head, ordered by
+        `sha` and time."""
+        return (CSet
+            .select(CSet.hkey.alias("sha"), CSet.time, CSet.type, CSet.len)
+            .join(Head, on=(
+                (CSet.repo == Head.repo) &
+                (CSet.hkey == Head.hkey) &
+                (CSet.time >= Head.base)))
+            .where((CSet.repo == repo) & (CSet.hkey << shas))
+            .order_by(CSet.hkey, CSet.time)
+            .naive()
+            .iterator())
+
+    def heads(self, repo, shas, reverse):
+        """Return the `(sha, data)` of the blobs needed to restore the current
+        state of each of the resources `shas`, ordered by `sha` and time: the
+        whole delta chain or, in reverse-delta repositories, the latest
+        snapshot."""
+        if not reverse:
+            start = Blob.time >= Head.base
+        else:
+            start = Blob.time == Head.time
+
+        return (Blob
+            .select(Blob.hkey, Blob.data)
+            .join(Head, on=(
+                (Blob.repo == Head.repo) &
+                (Blob.hkey == Head.hkey) &
+                start))
+            .where((Blob.repo == repo) & (Blob.hkey << shas))
+            .order_by(Blob.hkey, Blob.time)
+            .tuples()
+            .iterator())
+
+    def rewrite(self, repo, rewrites, codec):
+        """Replace snapshots by backward deltas: `rewrites` is a list of
+        `(sha, time, base, delta)` tuples, one per changeset to be replaced,
+        the deltas being compressed with `codec`."""
+        match = self.database.row_in(["hkey_id", "time"],
+            [(Blob.hkey.db_value(sha), Blob.time.db_value(time))
+                for sha, time, _, _ in rewrites])
+
+        Blob.delete().where((Blob.repo == repo) & match).execute()
+        CSet.delete().where((CSet.repo == repo) & match).execute()
+
+        Blob.insert_many([dict(repo=repo.id, hkey=sha, time=time, data=back,
+            codec=codec.id) for sha, time, _, back in rewrites]).execute()
+        CSet.insert_many([dict(repo=repo.id, hkey=sha, time=time,
+            type=CSet.DELTA, len=len(back), base=base)
+            for sha, time, base, back in rewrites]).execute()
+
+    def insert(self, mappings, blobs, csets, heads, size=500):
+        """Store key mappings, blobs, changesets and heads, given as dicts
+        like for `insert_many`, in multi-row inserts of up to `size` rows."""
+        for model, rows in ((HMap, mappings), (Blob, blobs), (CSet, csets)):
+            for part in chunked(rows, size):
+                model.insert_many(part).execute()
+
+        for part in chunked(heads, size):
+            Head.advance(part)
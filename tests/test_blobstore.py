@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from blobstore import Blobstore
+
+class BlobstoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="tailr-test-")
+        self.store = self.open()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root)
+
+    def open(self, **opts):
+        return Blobstore([self.root], shards=1, **opts)
+
+    def index(self):
+        return os.path.join(self.root, "000", "index")
+
+    def test_put_get(self):
+        a, b = self.store.put("a" * 100), self.store.put("b" * 200)
+        self.assertEqual(self.store.put("a" * 100), a)
+        self.assertEqual(self.store.get(a), "a" * 100)
+        self.assertEqual(self.store.get(b), "b" * 200)
+        self.assertRaises(KeyError, self.store.get, "x" * 20)
+
+    def test_packsize(self):
+        self.store = self.open(packsize=250)
+        digests = [self.store.put(c * 100) for c in "abcde"]
+        self.assertEqual([self.store.get(d) for d in digests],
+            [c * 100 for c in "abcde"])
+        packs = [n for n in os.listdir(os.path.dirname(self.index()))
+            if n.startswith("pack-")]
+        self.assertEqual(len(packs), 3)
+
+    def test_torn_record(self):
+        a = self.store.put("a" * 100)
+
+        # A writer crashed halfway through its index record
+        with open(self.index(), "ab") as f:
+            f.write("\0" * (Blobstore.RECORD.size // 2))
+
+        other = self.open()
+        b = other.put("b" * 100)
+        c = other.put("c" * 100)
+        other.close()
+
+        self.assertEqual(os.path.getsize(self.index()),
+            3 * Blobstore.RECORD.size)
+
+        fresh = self.open()
+        self.assertEqual(fresh.get(a), "a" * 100)
+        self.assertEqual(fresh.get(b), "b" * 100)
+        self.assertEqual(fresh.get(c), "c" * 100)
+        fresh.close()
+
+        # Processes which skipped the torn record read the later ones
+        self.assertEqual(self.store.get(c), "c" * 100)
+
+    def test_compact(self):
+        self.store = self.open(packsize=250)
+        digests = [self.store.put(c * 100) for c in "abcde"]
+        live = set(digests[1::2])
+
+        self.assertEqual(self.store.compact(live), (3, 300))
+        self.assertEqual(self.store.compact(live), (0, 0))
+
+        for store in (self.store, self.open()):
+            for digest, c in zip(digests, "abcde"):
+                if digest in live:
+                    self.assertEqual(store.get(digest), c * 100)
+                else:
+                    self.assertRaises(KeyError, store.get, digest)
+            self.assertEqual(store.get(store.put("f" * 100)), "f" * 100)
+
+        packs = [n for n in os.listdir(os.path.dirname(self.index()))
+            if n.startswith("pack-")]
+        self.assertEqual(len(packs), 2)
+
+    def test_compact_all(self):
+        self.store.put("a" * 100)
+        self.assertEqual(self.store.compact(set()), (1, 100))
+        self.assertEqual(os.path.getsize(self.index()), 0)
+        self.assertEqual(self.store.get(self.store.put("b")), "b")
+
+if __name__ == "__main__":
+    unittest.main()
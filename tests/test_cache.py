@@ -0,0 +1,48 @@
+import unittest
+
+from cache import StateCache, sizeof
+
+class StateCacheTest(unittest.TestCase):
+    def test_hits_misses(self):
+        cache = StateCache(1024**2)
+        self.assertEqual(cache.get(1, "a", 1), None)
+        cache.put(1, "a", 1, ["x", "y"])
+        self.assertEqual(cache.get(1, "a", 1), frozenset(["x", "y"]))
+        self.assertEqual(cache.get(1, "a", 2), None)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_evictions(self):
+        state = frozenset("s%d" % i for i in xrange(10))
+        cache = StateCache(2 * sizeof(state))
+        cache.put(1, "a", 1, state)
+        cache.put(1, "b", 1, state)
+        cache.get(1, "a", 1) # most recently used
+        cache.put(1, "c", 1, state)
+        self.assertEqual(cache.get(1, "b", 1), None)
+        self.assertEqual(cache.get(1, "a", 1), state)
+        self.assertEqual(cache.get(1, "c", 1), state)
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(cache.size <= cache.maxsize)
+
+    def test_oversized(self):
+        cache = StateCache(10)
+        cache.put(1, "a", 1, ["x" * 100])
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_extend(self):
+        cache = StateCache(1024**2)
+        cache.put(1, "a", 1, ["x"])
+        cache.put(1, "a", 2, ["y"])
+        cache.put(1, "b", 1, ["z"])
+        cache.extend(1, "a", 3, ["w"])
+        self.assertEqual(cache.get(1, "a", 1), None)
+        self.assertEqual(cache.get(1, "a", 2), None)
+        self.assertEqual(cache.get(1, "a", 3), frozenset(["w"]))
+        cache.invalidate(1, "a")
+        self.assertEqual(cache.get(1, "a", 3), None)
+        self.assertEqual(cache.get(1, "b", 1), frozenset(["z"]))
+        self.assertEqual(cache.size, sizeof(frozenset(["z"])))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from database import PooledSDB
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="tailr-test-")
+        self.db = PooledSDB(os.path.join(self.root, "test.db"),
+            max_connections=4)
+
+    def tearDown(self):
+        self.db.close_all()
+        shutil.rmtree(self.root)
+
+    def test_threads(self):
+        errors = []
+
+        def work():
+            try:
+                for _ in xrange(200):
+                    self.db.connect()
+                    self.db.execute_sql("SELECT 1").fetchone()
+                    self.db.close()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work) for _ in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.db._in_use), 0)
+        self.assertTrue(len(self.db._connections) <= 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import itertools
+import random
+import unittest
+
+from revision import SORTED, compress, content, diff, replay, snapshot
+
+def states(count, size=300, seed=0):
+    # A history of states, each changing some statements of the previous one
+    rnd = random.Random(seed)
+    stmts = set("<http://a/%d> <http://p> \"%d\" ." % (i, i)
+        for i in xrange(size))
+    history = [frozenset(stmts)]
+    for i in xrange(count - 1):
+        for stmt in rnd.sample(sorted(stmts), 10):
+            stmts.discard(stmt)
+        stmts.update("<http://b/%d/%d> <http://p> \"x\" ." % (i, j)
+            for j in xrange(rnd.randint(0, 20)))
+        history.append(frozenset(stmts))
+    return history
+
+def restored(blobs):
+    return list(itertools.chain.from_iterable(replay(blobs)))
+
+class ReplayTest(unittest.TestCase):
+    def test_forward(self):
+        history = states(8)
+        blobs = [snapshot(history[0])]
+        for prev, stmts in zip(history, history[1:]):
+            blobs.append(diff(prev, stmts))
+        for i, stmts in enumerate(history):
+            self.assertEqual(restored(blobs[:i + 1]), sorted(stmts))
+
+    def test_reverse(self):
+        # The latest snapshot followed by backward deltas
+        history = states(8)
+        blobs = [snapshot(history[-1])]
+        for stmts, prev in reversed(zip(history, history[1:])):
+            blobs.append(diff(prev, stmts))
+        for i, stmts in enumerate(reversed(history)):
+            self.assertEqual(restored(blobs[:i + 1]), sorted(stmts))
+
+    def test_diff_chunks(self):
+        # Deltas against a state in sorted chunks (as restored by `replay`)
+        # are the same as against the whole state
+        a, b, c = states(3)
+        blobs = [snapshot(a), diff(a, b)]
+        self.assertEqual(diff(replay(blobs), c), diff(b, c))
+        self.assertEqual(diff(c, replay(blobs)), diff(c, b))
+
+    def test_unchanged(self):
+        a, = states(1)
+        self.assertEqual(diff(a, set(a)), None)
+        self.assertEqual(diff(replay([snapshot(a)]), a), None)
+
+    def test_unsorted(self):
+        # Blobs stored before snapshots and deltas were sorted
+        blobs = [compress("<b> .\n<a> ."), compress("A <c> .\nD <a> .")]
+        self.assertEqual(restored(blobs), ["<b> .", "<c> ."])
+        self.assertEqual(restored(blobs[:1]), ["<a> .", "<b> ."])
+
+    def test_content(self):
+        a, = states(1)
+        self.assertEqual("".join(content(snapshot(a), 1024)),
+            "\n".join(sorted(a)))
+        self.assertEqual("".join(content(compress("<b> .\n<a> ."), 4)),
+            "<b> .\n<a> .")
+        self.assertFalse("".join(content(snapshot(a), 4)).startswith(SORTED))
+
+if __name__ == "__main__":
+    unittest.main()
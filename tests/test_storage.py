@@ -0,0 +1,96 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime
+
+from database import SDB
+from models import User, Repo, HMap, CSet, Head, Blob
+from storage import Storage
+
+import models
+
+S, D, X = CSet.SNAPSHOT, CSet.DELTA, CSet.DELETE
+
+# Timestamp of day `n` (of changes to the test resource)
+def day(n):
+    return datetime(2017, 1, n)
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="tailr-test-")
+        self.db = SDB(os.path.join(self.root, "test.db"))
+        models.initialize(self.db, None)
+        self.db.create_tables([User, Repo, HMap, CSet, Head, Blob])
+        self.storage = Storage(self.db)
+        self.sha = hashlib.sha1("http://example.org/a").digest()
+        self.storage.map(self.sha, "http://example.org/a")
+        self.user = User.create(name="test")
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.root)
+
+    # Store the changes `(day, type)` of a resource in a new repository
+    def history(self, mode, changes):
+        repo = Repo.create(user=self.user, name="r%d" % mode, desc="",
+            mode=mode)
+        changes = [(day(n), cstype) for n, cstype in changes]
+        for (ts, cstype), base in zip(changes, CSet.bases(changes, mode)):
+            CSet.create(repo=repo, hkey=self.sha, time=ts, type=cstype,
+                len=0, base=base)
+        ts, cstype, base = Head.derive(changes, mode)
+        Head.advance([dict(repo=repo.id, hkey=self.sha, time=ts, type=cstype,
+            base=base)])
+        return repo
+
+    # The days of the chain valid on day `n` and whether it is final
+    def chain(self, repo, n):
+        chain, final = self.storage.chain(repo, self.sha, day(n),
+            repo.mode == Repo.REVERSE)
+        return [cs.time.day for cs in chain], final
+
+    def test_forward(self):
+        repo = self.history(Repo.FORWARD,
+            [(1, S), (2, D), (3, D), (5, S), (6, D), (8, X), (9, S)])
+        self.assertEqual(self.chain(repo, 3), ([1, 2, 3], True))
+        self.assertEqual(self.chain(repo, 4), ([1, 2, 3], True))
+        self.assertEqual(self.chain(repo, 6), ([5, 6], True))
+        self.assertEqual(self.chain(repo, 8), ([8], True))
+        self.assertEqual(self.chain(repo, 9), ([9], True))
+        self.assertEqual(self.chain(repo, 10), ([9], False))
+
+    def test_forward_latest(self):
+        repo = self.history(Repo.FORWARD, [(1, S), (2, D), (3, S), (4, D)])
+        self.assertEqual(self.chain(repo, 10), ([3, 4], False))
+
+    def test_reverse(self):
+        repo = self.history(Repo.REVERSE,
+            [(1, D), (2, D), (3, S), (4, X), (5, D), (6, S)])
+        self.assertEqual(self.chain(repo, 1), ([3, 2, 1], True))
+        self.assertEqual(self.chain(repo, 2), ([3, 2], True))
+        self.assertEqual(self.chain(repo, 3), ([3], True))
+        self.assertEqual(self.chain(repo, 4), ([4], True))
+        self.assertEqual(self.chain(repo, 5), ([6, 5], True))
+        self.assertEqual(self.chain(repo, 7), ([6], False))
+
+    def test_before_first(self):
+        repo = self.history(Repo.FORWARD, [(2, S), (3, D)])
+        self.assertEqual(self.chain(repo, 1), ([], True))
+
+    def test_missing(self):
+        repo = Repo.create(user=self.user, name="empty", desc="")
+        self.assertEqual(self.chain(repo, 1), ([], False))
+
+    def test_advance(self):
+        repo = self.history(Repo.FORWARD, [(1, S), (2, D)])
+        head = dict(repo=repo.id, hkey=self.sha, type=S)
+        Head.advance([dict(head, time=day(4), base=day(4))])
+        Head.advance([dict(head, time=day(3), base=day(3))])
+        latest = self.storage.latest(repo, self.sha)
+        self.assertEqual((latest.time, latest.base), (day(4), day(4)))
+
+if __name__ == "__main__":
+    unittest.main()
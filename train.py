@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Train a compression dictionary on a sample of the current snapshots of a
+# repository, e.g.: `python train.py pmeinhardt/test`. New blobs are
+# compressed with the latest dictionary of a repository if it uses the
+# "dict" codec (see `compression`), existing ones are left as they are.
+#
+# Requires zstandard (https://github.com/indygreg/python-zstandard), see
+# requirements.txt.
+
+import datetime
+import sys
+
+from blobstore import Blobstore
+from database import from_url
+
+from config import dburl, bsconf
+from models import *
+
+import compression
+import models
+
+# Dictionary size in bytes and number of snapshots to train on
+SIZE = 112640
+SAMPLES = 10000
+
+def samples(repo, count):
+    """Return the decompressed data of the snapshots at the base of the
+    current delta chains (or the latest snapshots, in reverse-delta
+    repositories) of up to `count` resources."""
+    if repo.mode == Repo.REVERSE:
+        start = Blob.time == Head.time
+    else:
+        start = Blob.time == Head.base
+
+    rows = (Blob
+        .select(Blob.data)
+        .join(Head, on=(
+            (Blob.repo == Head.repo) &
+            (Blob.hkey == Head.hkey) &
+            start))
+        .where((Blob.repo == repo) & (Head.type != CSet.DELETE))
+        .limit(count)
+        .tuples())
+
+    return [compression.codec(data).decompress(data)
+        for data, in rows.iterator()]
+
+def train(repo, size=SIZE, count=SAMPLES):
+    data = samples(repo, count)
+
+    # Trained dictionaries get a random id (embedded in compressed data)
+    d = compression.zstandard.train_dictionary(size, data)
+
+    Dictionary.create(id=d.dict_id(), repo=repo,
+        time=datetime.datetime.utcnow(), data=d.as_bytes())
+
+    return d.dict_id(), len(data)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or "/" not in sys.argv[1]:
+        print "usage: python train.py USER/REPO"
+        sys.exit(1)
+
+    if compression.zstandard is None:
+        print "the zstandard module is not installed"
+        sys.exit(1)
+
+    database = from_url(dburl)
+    blobstore = (bsconf["nodes"] and
+        Blobstore(bsconf["nodes"], **bsconf["opts"]) or None)
+    models.initialize(database, blobstore)
+
+    username, reponame = sys.argv[1].split("/", 1)
+
+    repo = (Repo
+        .select()
+        .join(User)
+        .where((User.name == username) & (Repo.name == reponame))
+        .get())
+
+    id, count = train(repo)
+
+    print "dictionary %d trained on %d snapshots" % (id, count)